@@ -0,0 +1,83 @@
+"""
+Compares per-request latency of the ORM and the Core insert engines of TransactionService.
+
+Runs against the database configured in AppSettings, e.g.:
+
+    python benchmarks/bench_insert_engines.py --requests 2000 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from configs.config import settings  # noqa: E402
+from db.transaction_service import TransactionService  # noqa: E402
+from validation import RequestModel  # noqa: E402
+from payloads import make_payload  # noqa: E402
+
+
+def percentile(samples: list[float], q: float):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_engine(engine: str, requests: list[RequestModel], concurrency: int):
+    settings.INSERT_ENGINE = engine
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def insert(request):
+        async with semaphore:
+            started = time.perf_counter()
+            await TransactionService.insert_transaction(request)
+            latencies.append(time.perf_counter() - started)
+
+    # Warm up pool connections and the compiled/prepared statement caches.
+    for request in requests[:concurrency]:
+        await insert(request)
+    latencies.clear()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(insert(request) for request in requests[concurrency:]))
+    elapsed = time.perf_counter() - started
+    return {
+        "engine": engine,
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def main(args):
+    results = []
+    for offset, engine in enumerate(args.engines):
+        rng = random.Random(args.seed + offset)
+        requests = [
+            RequestModel.model_validate(make_payload(rng, index, args.merchants, args.customers))
+            for index in range(args.requests + args.concurrency)
+        ]
+        results.append(await run_engine(engine, requests, args.concurrency))
+
+    print(f"{'engine':<8}{'requests':>10}{'req/s':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        print(f"{result['engine']:<8}{result['requests']:>10}{result['throughput_rps']:>10.0f}"
+              f"{result['mean_ms']:>10.2f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--merchants", type=int, default=50)
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--engines", nargs="+", default=["orm", "core"], choices=["orm", "core"])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""
+Measures the per-request CPU spent on (de)serialization by the /wpp/ handler, before and
+after forwarding the raw request body to the queue and rendering responses with orjson.
+
+    python benchmarks/bench_request_serialization.py --iterations 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse, ORJSONResponse  # noqa: E402
+
+from validation import RequestModel  # noqa: E402
+from payloads import make_payload  # noqa: E402
+
+
+def reserializing_path(body: bytes):
+    # FastAPI parses and validates the body, the handler re-serializes the model for Redis
+    # and the default JSON response class renders the result.
+    request = RequestModel.model_validate(json.loads(body))
+    queued = request.model_dump_json()
+    response = {
+        "description": "Transaction has been processed successfully",
+        "statusCode": 200,
+        "txnReference": request.transaction.txnReference
+    }
+    return queued, JSONResponse(jsonable_encoder(response)).body
+
+
+def passthrough_path(body: bytes):
+    # What `handle_transaction` runs: the raw body is validated by pydantic's JSON parser,
+    # queued as received, and the response is rendered with orjson.
+    request = RequestModel.model_validate_json(body)
+    queued = body
+    response = {
+        "description": "Transaction has been processed successfully",
+        "statusCode": 200,
+        "txnReference": request.transaction.txnReference
+    }
+    return queued, ORJSONResponse(response).body
+
+
+def measure(path, bodies: list[bytes]):
+    started = time.process_time()
+    for body in bodies:
+        path(body)
+    return (time.process_time() - started) / len(bodies) * 1_000_000
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    bodies = [json.dumps(make_payload(rng, index)).encode() for index in range(args.iterations)]
+
+    measure(reserializing_path, bodies[:1000])
+    measure(passthrough_path, bodies[:1000])
+    before = measure(reserializing_path, bodies)
+    after = measure(passthrough_path, bodies)
+
+    print(f"re-serializing: {before:8.1f} us CPU/request")
+    print(f"passthrough:    {after:8.1f} us CPU/request")
+    print(f"saved:          {before - after:8.1f} us CPU/request ({(before - after) / before:.0%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
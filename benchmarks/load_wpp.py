@@ -0,0 +1,231 @@
+"""
+Load test of POST /wpp/: reports throughput and p50/p95/p99 latency per concurrency level
+and compares them with a stored baseline.
+
+The app is driven in-process through httpx's ASGI transport by default, against the
+database configured in AppSettings (a local Postgres; the insert paths use
+PostgreSQL-only SQL, so SQLite cannot stand in) and, with --fake-redis, an in-memory
+fakeredis instead of Redis (pip install -r benchmarks/requirements.txt).
+With --url the requests go to an already running server, e.g. under gunicorn (src/gunicorn_conf.py):
+
+    python benchmarks/load_wpp.py --fake-redis --requests 2000 --concurrency 1 8 32
+    python benchmarks/load_wpp.py --fake-redis --update-baseline
+    python benchmarks/load_wpp.py --url http://127.0.0.1:8080 --concurrency 16
+
+Payloads are generated from --seed, so two runs send the same request mix. Their
+txnReferences get a per-run prefix, otherwise a second run would only measure idempotency replays.
+Only 2xx responses count towards throughput and latency; any other response, or a failed
+request, is an error, and more errors than the baseline are a regression.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+import httpx
+import orjson
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from payloads import make_payload  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'load_wpp_baseline.json')
+COMPARED = {"throughput_rps": 1, "p50_ms": -1, "p95_ms": -1, "p99_ms": -1}
+
+
+def percentile(samples: list[float], q: float):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def milliseconds(seconds: float | None):
+    return seconds * 1000 if seconds is not None else None
+
+
+def format_ms(value: float | None, width: int = 10):
+    return f"{value:>{width}.2f}" if value is not None else f"{'-':>{width}}"
+
+
+def make_bodies(args, concurrency: int, run_prefix: str):
+    rng = random.Random(args.seed + concurrency)
+    bodies = []
+    for index in range(args.warmup + args.requests):
+        payload = make_payload(rng, index, args.merchants, args.customers)
+        payload["transaction"]["txnReference"] = f'{run_prefix}-{payload["transaction"]["txnReference"]}'
+        bodies.append(orjson.dumps(payload))
+    return bodies
+
+
+async def run_level(client: httpx.AsyncClient, bodies: list[bytes], warmup: int, concurrency: int):
+    latencies = []
+    sent = errors = 0
+    pending = iter(bodies)
+
+    async def send(body: bytes, record: bool):
+        nonlocal sent, errors
+        started = time.perf_counter()
+        try:
+            response = await client.post("/wpp/", content=body, headers={"content-type": "application/json"})
+            ok = 200 <= response.status_code < 300
+        except httpx.HTTPError:
+            ok = False
+        if record:
+            sent += 1
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    async def user(record: bool, count: int | None):
+        # Closed loop: every virtual user sends its next request as soon as the previous one returned.
+        for body in pending:
+            await send(body, record)
+            if count is not None:
+                count -= 1
+                if not count:
+                    return
+
+    # Exactly `warmup` requests, spread over the users; a user with none left sends nothing.
+    counts = [warmup // concurrency + (index < warmup % concurrency) for index in range(concurrency)]
+    await asyncio.gather(*(user(False, count) for count in counts if count))
+    started = time.perf_counter()
+    await asyncio.gather(*(user(True, None) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": sent,
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": milliseconds(statistics.mean(latencies)) if latencies else None,
+        "p50_ms": milliseconds(percentile(latencies, 0.50)),
+        "p95_ms": milliseconds(percentile(latencies, 0.95)),
+        "p99_ms": milliseconds(percentile(latencies, 0.99)),
+    }
+
+
+def use_fake_redis():
+    from fakeredis import aioredis as fake_aioredis
+
+    from container import redis_producer
+
+    # The producer keeps an injected client, and the lifespan hands it to the other stores.
+    client = fake_aioredis.FakeRedis()
+    redis_producer.client = client
+    redis_producer._pool = client.connection_pool
+
+
+async def run(args):
+    run_prefix = args.run_prefix or uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout)
+        lifespan = None
+    else:
+        if args.fake_redis:
+            use_fake_redis()
+        from api import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                   limits=limits, timeout=args.timeout)
+        # The ASGI transport does not send lifespan events, so the producer is started here.
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+
+    results = []
+    try:
+        async with client:
+            for concurrency in args.concurrency:
+                bodies = make_bodies(args, concurrency, run_prefix)
+                results.append(await run_level(client, bodies, args.warmup, concurrency))
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+    return results
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float):
+    """
+    Prints the relative change of every compared metric and returns the regressions,
+    i.e. changes in the wrong direction larger than `tolerance` and any rise of the errors.
+    """
+    regressions = []
+    by_concurrency = {entry["concurrency"]: entry for entry in baseline}
+    print(f"\n{'conc':>6}{'metric':>16}{'baseline':>12}{'current':>12}{'change':>10}")
+    for result in results:
+        reference = by_concurrency.get(result["concurrency"])
+        if reference is None:
+            continue
+        errors = result["errors"] - reference.get("errors", 0)
+        flag = ""
+        if errors > 0:
+            regressions.append((result["concurrency"], "errors", errors))
+            flag = "  REGRESSION"
+        print(f"{result['concurrency']:>6}{'errors':>16}{reference.get('errors', 0):>12}{result['errors']:>12}"
+              f"{errors:>+10}{flag}")
+        for metric, direction in COMPARED.items():
+            if result[metric] is None or reference[metric] is None:
+                # Nothing succeeded on one side, which the errors already report.
+                print(f"{result['concurrency']:>6}{metric:>16}{format_ms(reference[metric], 12)}"
+                      f"{format_ms(result[metric], 12)}{'-':>10}")
+                continue
+            change = (result[metric] - reference[metric]) / reference[metric] if reference[metric] else 0.0
+            flag = ""
+            if change * direction < -tolerance:
+                regressions.append((result["concurrency"], metric, change))
+                flag = "  REGRESSION"
+            print(f"{result['concurrency']:>6}{metric:>16}{reference[metric]:>12.2f}{result[metric]:>12.2f}"
+                  f"{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main(args):
+    results = asyncio.run(run(args))
+
+    print(f"{'conc':>6}{'requests':>10}{'errors':>8}{'req/s':>10}{'mean ms':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        print(f"{result['concurrency']:>6}{result['requests']:>10}{result['errors']:>8}"
+              f"{result['throughput_rps']:>10.0f}{format_ms(result['mean_ms'])}{format_ms(result['p50_ms'])}"
+              f"{format_ms(result['p95_ms'])}{format_ms(result['p99_ms'])}")
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --update-baseline to store one.")
+        return 0
+
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base URL of a running server, the app is run in-process if omitted.")
+    parser.add_argument("--fake-redis", action="store_true", help="Use an in-memory fakeredis (in-process only).")
+    parser.add_argument("--requests", type=int, default=1000, help="Measured requests per concurrency level.")
+    parser.add_argument("--warmup", type=int, default=100, help="Unmeasured requests per concurrency level.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--merchants", type=int, default=50)
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--run-prefix", help="txnReference prefix, random by default.")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Relative change tolerated before a metric counts as a regression.")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,58 @@
+import random
+
+
+def make_payload(rng: random.Random, index: int, merchants: int = 50, customers: int = 5000):
+    """
+    Builds a deterministic `RequestModel` payload for benchmarks.
+
+    Args:
+        rng (random.Random): Seeded generator, the same seed yields the same payload sequence.
+        index (int): Sequence number, used to keep txnReference unique.
+        merchants (int): Size of the merchant id pool.
+        customers (int): Size of the customer id pool.
+
+    Returns:
+        dict: A JSON-serializable request payload.
+    """
+    customer = rng.randrange(customers)
+    return {
+        "lang": "en",
+        "merchant": {
+            "merchantID": f"merchant{rng.randrange(merchants):04d}",
+            "customerID": f"customer{customer:06d}",
+        },
+        "customer": {
+            "billingAddress": {
+                "firstName": f"First{customer}",
+                "lastName": f"Last{customer}",
+                "mobileNo": f"+1555{customer:07d}",
+                "emailId": f"customer{customer}@example.com",
+                "addressLine1": f"{rng.randrange(1, 999)} Main Street",
+                "city": rng.choice(["Berlin", "Paris", "Warsaw", "Madrid"]),
+                "state": None,
+                "zip": f"{rng.randrange(10000, 99999)}",
+                "country": rng.choice(["DE", "FR", "PL", "ES"]),
+            }
+        },
+        "transaction": {
+            "txnAmount": round(rng.uniform(1, 1000), 2),
+            "paymentType": "card",
+            "currencyCode": rng.choice(["EUR", "USD", "PLN"]),
+            "txnReference": f"bench-{index:09d}-{rng.getrandbits(32):08x}",
+            "seriestype": None,
+            "method": None,
+            "paymentDetail": {
+                "cardNumber": f"4111{customer:012d}",
+                "cardType": "visa",
+                "expYear": rng.randrange(2026, 2032),
+                "expMonth": rng.randrange(1, 13),
+                "nameOnCard": f"First{customer} Last{customer}",
+                "saveDetails": rng.random() < 0.5,
+                "cvv": f"{rng.randrange(1000):03d}",
+            },
+            "url": {
+                "successURL": "https://example.com/success",
+                "failURL": "https://example.com/fail",
+            },
+        },
+    }
@@ -1,5 +1,6 @@
 import asyncio
 import os
+import re
 import sys
 from logging.config import fileConfig
 
@@ -19,7 +20,13 @@ sys.path.append(os.path.join(sys.path[0], 'src'))
 config = context.config
 
 section = config.config_ini_section
-config.set_section_option(section, "DB_URL", settings.DATABASE_URL_asyncpg)
+# Every shard is migrated separately: `alembic -x shard=<name> upgrade head`, with the name of a
+# DB_SHARDS entry or the address of a shard that is not in DB_SHARDS yet.
+shard = context.get_x_argument(as_dictionary=True).get("shard")
+if shard is not None:
+    config.set_section_option(section, "DB_URL", settings.shard_url_asyncpg(settings.DB_SHARDS.get(shard, shard)))
+else:
+    config.set_section_option(section, "DB_URL", settings.DATABASE_URL_asyncpg)
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -37,6 +44,16 @@ target_metadata = metadata
 # ... etc.
 
 
+# Monthly partitions of `transaction` are managed by partition_maintenance.py, not by migrations.
+PARTITION_NAME = re.compile(r'^transaction_y\d{4}m\d{2}$')
+
+
+def include_name(name, type_, parent_names):
+    if type_ == "table":
+        return not PARTITION_NAME.match(name)
+    return True
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -53,6 +70,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_name=include_name,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -62,7 +80,7 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(connection=connection, target_metadata=target_metadata, include_name=include_name)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -0,0 +1,26 @@
+"""in
+
+Revision ID: 2a99349026c6
+Revises: 559f78b0fd0f
+Create Date: 2024-08-29 16:47:03.345888
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2a99349026c6'
+down_revision: Union[str, None] = '559f78b0fd0f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    pass
+
+
+def downgrade() -> None:
+    pass
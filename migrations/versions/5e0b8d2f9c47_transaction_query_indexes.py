@@ -0,0 +1,38 @@
+"""transaction query indexes
+
+Revision ID: 5e0b8d2f9c47
+Revises: a1c41138779a
+Create Date: 2026-10-17 10:03:18.502117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e0b8d2f9c47'
+down_revision: Union[str, None] = 'a1c41138779a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = (
+    ('ix_transaction_merchant_id_id', ['merchant_id', 'id']),
+    ('ix_transaction_customer_id_id', ['customer_id', 'id']),
+    ('ix_transaction_txn_reference', ['txn_reference']),
+)
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps the table writable while the indexes are built on large tables,
+    # it cannot run inside a transaction.
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES:
+            op.create_index(name, 'transaction', columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, _ in INDEXES:
+            op.drop_index(name, table_name='transaction', postgresql_concurrently=True, if_exists=True)
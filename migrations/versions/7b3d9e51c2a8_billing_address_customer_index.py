@@ -0,0 +1,32 @@
+"""billing address customer index
+
+Revision ID: 7b3d9e51c2a8
+Revises: f1a26c8e4d07
+Create Date: 2026-10-17 16:42:09.331870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3d9e51c2a8'
+down_revision: Union[str, None] = 'f1a26c8e4d07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Serves the latest billing address of a customer in exports. CONCURRENTLY keeps the table
+    # writable while it is built, it cannot run inside a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_billing_address_customer_id_id', 'billing_address', ['customer_id', sa.text('id DESC')],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_billing_address_customer_id_id', table_name='billing_address',
+                      postgresql_concurrently=True, if_exists=True)
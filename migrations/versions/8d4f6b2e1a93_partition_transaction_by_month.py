@@ -0,0 +1,124 @@
+"""partition transaction by month
+
+Revision ID: 8d4f6b2e1a93
+Revises: 5e0b8d2f9c47
+Create Date: 2026-10-17 14:21:07.334518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d4f6b2e1a93'
+down_revision: Union[str, None] = '5e0b8d2f9c47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Partitions created up front, further ones are created by partition_maintenance.py.
+PRECREATE_MONTHS = 3
+
+INDEXES = (
+    ('ix_transaction_merchant_id_id', ['merchant_id', 'id']),
+    ('ix_transaction_customer_id_id', ['customer_id', 'id']),
+    ('ix_transaction_txn_reference', ['txn_reference']),
+)
+
+COLUMNS = ('id, txn_amount, payment_type, currency_code, txn_reference, seriestype, method, '
+           'success_url, fail_url, merchant_id, customer_id, payment_detail_id')
+
+
+def transaction_columns():
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('transaction_id_seq'::regclass)"),
+                  nullable=False),
+        sa.Column('txn_amount', sa.Numeric(), nullable=False),
+        sa.Column('payment_type', sa.String(), nullable=False),
+        sa.Column('currency_code', sa.String(), nullable=False),
+        sa.Column('txn_reference', sa.String(), nullable=False),
+        sa.Column('seriestype', sa.String(), nullable=True),
+        sa.Column('method', sa.String(), nullable=True),
+        sa.Column('success_url', sa.String(), nullable=False),
+        sa.Column('fail_url', sa.String(), nullable=False),
+        sa.Column('merchant_id', sa.String(), nullable=False),
+        sa.Column('customer_id', sa.String(), nullable=False),
+        sa.Column('payment_detail_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['customer_id'], ['customer.customer_id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['merchant_id'], ['merchant.merchant_id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['payment_detail_id'], ['payment_detail.id'], ondelete='CASCADE'),
+    ]
+
+
+def upgrade() -> None:
+    # now() is stable, so existing rows get the migration time without a table rewrite.
+    for table in ('billing_address', 'payment_detail'):
+        op.add_column(table, sa.Column('created_at', sa.DateTime(timezone=True),
+                                       server_default=sa.text('now()'), nullable=False))
+
+    op.create_table('transaction_reference',
+    sa.Column('merchant_id', sa.String(), nullable=False),
+    sa.Column('txn_reference', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('merchant_id', 'txn_reference', name='pk_transaction_reference')
+    )
+
+    # The old table is rebuilt as a partitioned one. Index and primary key names are schema-wide,
+    # so the old ones are dropped or renamed first.
+    op.execute('ALTER TABLE transaction RENAME TO transaction_unpartitioned')
+    op.execute('ALTER TABLE transaction_unpartitioned RENAME CONSTRAINT transaction_pkey TO transaction_unpartitioned_pkey')
+    op.drop_constraint('uq_transaction_merchant_id_txn_reference', 'transaction_unpartitioned', type_='unique')
+    for name, _ in INDEXES:
+        op.drop_index(name, table_name='transaction_unpartitioned')
+
+    op.create_table('transaction',
+    *transaction_columns(),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY transaction.id')
+
+    current = op.get_bind().scalar(sa.text("SELECT date_trunc('month', now() AT TIME ZONE 'UTC')::date"))
+    for offset in range(PRECREATE_MONTHS + 1):
+        index = current.year * 12 + current.month - 1 + offset
+        lower = f'{index // 12:04d}-{index % 12 + 1:02d}-01'
+        upper = f'{(index + 1) // 12:04d}-{(index + 1) % 12 + 1:02d}-01'
+        op.execute(
+            f"CREATE TABLE transaction_y{lower[:4]}m{lower[5:7]} PARTITION OF transaction "
+            f"FOR VALUES FROM ('{lower} 00:00:00+00') TO ('{upper} 00:00:00+00')"
+        )
+
+    # Rows stored before partitioning get the migration time and land in the current month.
+    op.execute(f'INSERT INTO transaction ({COLUMNS}, created_at) '
+               f'SELECT {COLUMNS}, now() FROM transaction_unpartitioned')
+    op.execute('INSERT INTO transaction_reference (merchant_id, txn_reference, created_at) '
+               'SELECT merchant_id, txn_reference, now() FROM transaction_unpartitioned')
+    op.drop_table('transaction_unpartitioned')
+
+    for name, columns in INDEXES:
+        op.create_index(name, 'transaction', columns)
+
+
+def downgrade() -> None:
+    op.execute('ALTER TABLE transaction RENAME TO transaction_partitioned')
+    op.execute('ALTER TABLE transaction_partitioned RENAME CONSTRAINT transaction_pkey TO transaction_partitioned_pkey')
+    for name, _ in INDEXES:
+        op.drop_index(name, table_name='transaction_partitioned')
+
+    op.create_table('transaction',
+    *transaction_columns(),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('merchant_id', 'txn_reference', name='uq_transaction_merchant_id_txn_reference')
+    )
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY transaction.id')
+    op.execute(f'INSERT INTO transaction ({COLUMNS}) SELECT {COLUMNS} FROM transaction_partitioned')
+    op.drop_table('transaction_partitioned')
+    for name, columns in INDEXES:
+        op.create_index(name, 'transaction', columns)
+
+    op.drop_table('transaction_reference')
+    for table in ('billing_address', 'payment_detail'):
+        op.drop_column(table, 'created_at')
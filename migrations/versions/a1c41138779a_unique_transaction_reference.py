@@ -0,0 +1,45 @@
+"""unique transaction reference per merchant
+
+Revision ID: a1c41138779a
+Revises: 2a99349026c6
+Create Date: 2026-10-17 09:12:40.118452
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c41138779a'
+down_revision: Union[str, None] = '2a99349026c6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Client retries may already have stored duplicates. They are financial records, so they are
+    # listed instead of deleted: resolve them, then run the migration again.
+    duplicates = op.get_bind().execute(sa.text(
+        """
+        SELECT merchant_id, txn_reference, array_agg(id ORDER BY id)
+        FROM transaction
+        GROUP BY merchant_id, txn_reference
+        HAVING count(*) > 1
+        ORDER BY merchant_id, txn_reference
+        """
+    )).all()
+    if duplicates:
+        listed = "\n".join(f"  merchant {merchant_id}, txnReference {txn_reference}: transactions "
+                           f"{', '.join(map(str, ids))}" for merchant_id, txn_reference, ids in duplicates)
+        raise RuntimeError(f"{len(duplicates)} (merchant_id, txn_reference) pairs are stored more than once, "
+                           f"resolve them before adding the unique constraint:\n{listed}")
+
+    op.create_unique_constraint(
+        'uq_transaction_merchant_id_txn_reference', 'transaction', ['merchant_id', 'txn_reference']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_transaction_merchant_id_txn_reference', 'transaction', type_='unique')
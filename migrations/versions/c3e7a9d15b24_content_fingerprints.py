@@ -0,0 +1,42 @@
+"""content fingerprints
+
+Revision ID: c3e7a9d15b24
+Revises: 8d4f6b2e1a93
+Create Date: 2026-10-17 16:42:51.208736
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e7a9d15b24'
+down_revision: Union[str, None] = '8d4f6b2e1a93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ('billing_address', 'payment_detail')
+
+
+def upgrade() -> None:
+    # Fingerprints are keyed with FINGERPRINT_KEY, which the database does not know,
+    # so existing rows keep a NULL fingerprint and are never shared.
+    for table in TABLES:
+        op.add_column(table, sa.Column('fingerprint', sa.String(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            op.create_index(f'uq_{table}_fingerprint', table, ['fingerprint'], unique=True,
+                            postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            op.drop_index(f'uq_{table}_fingerprint', table_name=table, postgresql_concurrently=True, if_exists=True)
+
+    for table in TABLES:
+        op.drop_column(table, 'fingerprint')
@@ -0,0 +1,31 @@
+"""transaction reference created_at index
+
+Revision ID: c4e8a2f61d93
+Revises: 7b3d9e51c2a8
+Create Date: 2026-10-17 18:05:41.207316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e8a2f61d93'
+down_revision: Union[str, None] = '7b3d9e51c2a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Serves the pruning of the references of archived months. CONCURRENTLY keeps the table
+    # writable while it is built, it cannot run inside a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_transaction_reference_created_at', 'transaction_reference', ['created_at'],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_transaction_reference_created_at', table_name='transaction_reference',
+                      postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,39 @@
+"""merchant daily rollup
+
+Revision ID: f1a26c8e4d07
+Revises: c3e7a9d15b24
+Create Date: 2026-10-17 18:05:36.917402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1a26c8e4d07'
+down_revision: Union[str, None] = 'c3e7a9d15b24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('merchant_daily_rollup',
+    sa.Column('merchant_id', sa.String(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('currency_code', sa.String(), nullable=False),
+    sa.Column('txn_count', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('txn_amount', sa.Numeric(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('merchant_id', 'day', 'currency_code', name='pk_merchant_daily_rollup')
+    )
+    # Existing transactions are rolled up once, later ones are added as they are written.
+    op.execute(
+        "INSERT INTO merchant_daily_rollup (merchant_id, day, currency_code, txn_count, txn_amount) "
+        "SELECT merchant_id, (created_at AT TIME ZONE 'UTC')::date, currency_code, count(*), sum(txn_amount) "
+        "FROM transaction GROUP BY 1, 2, 3"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('merchant_daily_rollup')
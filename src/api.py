@@ -1,18 +1,48 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
-from configs.config import logger
+from configs.config import logger, settings
+from container import profiler, shutdown, startup
+from profiler import ProfilingMiddleware
+from routers.admin_router import router as admin_router
+from routers.metrics_router import router as metrics_router
+from routers.stats_router import router as stats_router
+from routers.transaction_router import router as transaction_router
 from routers.wpp_router import router
 
 
-app = FastAPI(title="Test Task", debug=True)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    yield
+    await shutdown()
+
+
+app = FastAPI(title="Test Task", debug=True, lifespan=lifespan, default_response_class=ORJSONResponse)
 logger.info("Application created.")
 
 app.include_router(router)
 logger.info('Included router to app.')
 
+app.include_router(transaction_router)
+logger.info('Included transaction router to app.')
+
+app.include_router(stats_router)
+logger.info('Included stats router to app.')
+
+app.include_router(metrics_router)
+logger.info('Included metrics router to app.')
+
+if settings.PROFILER_ENABLED:
+    app.add_middleware(ProfilingMiddleware, sampler=profiler)
+    app.include_router(admin_router)
+    logger.info('Installed the sampling profiler.')
+
 if __name__ == "__main__":
+    # Single process for development, production runs `gunicorn -c gunicorn_conf.py api:app`.
     logger.info('Starting application...')
     uvicorn.run("api:app", port=8080, log_level="info")
 
-
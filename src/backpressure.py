@@ -0,0 +1,113 @@
+import time
+
+from redis import asyncio as aioredis
+
+from configs.config import logger
+
+BACKLOG = "backlog"
+LATENCY = "latency"
+
+# Weight of the newest observation in the moving average of the insert latency.
+LATENCY_ALPHA = 0.1
+
+
+class LoadShedder:
+    """
+    Admission control of the ingestion endpoints with hysteresis.
+
+    Requests are shed once the requests queue holds `backlog_high` payloads or the
+    exponentially weighted average of the insert latency reaches `latency_high`, and are
+    accepted again only when the backlog is down to `backlog_low` and the latency to
+    `latency_low`, so that the endpoint does not flap around a single threshold.
+
+    The backlog is read with LLEN at most every `check_interval` seconds, by the request
+    that finds it stale. While shedding because of latency, one request per
+    `check_interval` is let through, so that the average keeps being updated.
+    A high watermark of 0 disables that check.
+    """
+
+    def __init__(self, queue: str, backlog_high: int = 0, backlog_low: int = 0,
+                 latency_high: float = 0.0, latency_low: float = 0.0, check_interval: float = 0.25,
+                 retry_after: int = 1, redis_client: aioredis.Redis | None = None):
+        self.queue = queue
+        self.backlog_high = backlog_high
+        self.backlog_low = backlog_low
+        self.latency_high = latency_high
+        self.latency_low = latency_low
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.redis = redis_client
+
+        self.backlog = 0
+        self.latency = 0.0
+        self.shedding = {BACKLOG: False, LATENCY: False}
+        self._checked_at = float("-inf")
+        self._probed_at = float("-inf")
+        self._checking = False
+
+    async def admit(self):
+        """
+        Decides whether a request is accepted.
+
+        Returns:
+            str | None: None if the request is accepted, otherwise the reason to shed it
+            (`BACKLOG` or `LATENCY`).
+        """
+        now = time.monotonic()
+        if self.backlog_high and now - self._checked_at >= self.check_interval:
+            await self._check_backlog(now)
+        if self.shedding[BACKLOG]:
+            return BACKLOG
+        if self.shedding[LATENCY]:
+            if now - self._probed_at < self.check_interval:
+                return LATENCY
+            self._probed_at = now
+        return None
+
+    def observe_latency(self, seconds: float):
+        """
+        Adds an insert latency to the moving average and updates the latency state.
+
+        Args:
+            seconds (float): The duration of a database insert.
+        """
+        if not self.latency_high:
+            return
+        self.latency = seconds if not self.latency else self.latency + LATENCY_ALPHA * (seconds - self.latency)
+        self._update(LATENCY, self.latency, self.latency_high, self.latency_low)
+
+    def stats(self):
+        """
+        Returns the watermark states and the measured backlog and latency.
+
+        Returns:
+            dict: Whether requests are shed per reason, the backlog and the latency average in milliseconds.
+        """
+        return {
+            "shedding": dict(self.shedding),
+            "backlog": self.backlog,
+            "latency_ms": self.latency * 1000,
+        }
+
+    async def _check_backlog(self, now: float):
+        # Concurrent requests keep the current state instead of issuing more LLENs.
+        if self._checking or self.redis is None:
+            return
+        self._checking = True
+        try:
+            self.backlog = await self.redis.llen(self.queue)
+        except Exception:
+            logger.warning('Could not read the backlog of %s, keeping the previous state.', self.queue, exc_info=True)
+        else:
+            self._update(BACKLOG, self.backlog, self.backlog_high, self.backlog_low)
+        finally:
+            self._checked_at = now
+            self._checking = False
+
+    def _update(self, reason: str, value: float, high: float, low: float):
+        if not self.shedding[reason] and value >= high:
+            self.shedding[reason] = True
+            logger.warning('Shedding load: %s %s reached the high watermark %s.', reason, value, high)
+        elif self.shedding[reason] and value <= low:
+            self.shedding[reason] = False
+            logger.warning('Accepting load again: %s %s is down to the low watermark %s.', reason, value, low)
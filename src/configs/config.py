@@ -1,9 +1,12 @@
 import logging
+from typing import Literal
 
 from dotenv import find_dotenv, load_dotenv
 from pydantic_settings import BaseSettings, SettingsConfigDict
 import os
 
+from configs.log_config import SamplingFilter, setup_logging
+
 DOTENV = os.path.join(os.path.dirname(__file__), ".env")
 
 
@@ -14,6 +17,135 @@ class AppSettings(BaseSettings):
     DB_PASS: str
     DB_NAME: str
 
+    # Size the pool so that workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays below max_connections.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_S: float = 30.0
+    DB_POOL_RECYCLE_S: int = 1800
+    DB_POOL_PRE_PING: bool = False
+    DB_STATEMENT_TIMEOUT_MS: int = 0
+    DB_ECHO: bool = False
+    # Compiled statements cached per engine, and statements asyncpg prepares per connection.
+    DB_COMPILED_CACHE_SIZE: int = 500
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 100
+
+    # Read replicas ("host" or "host:port", same credentials and database as the primary) used by
+    # the query and export services, e.g. DB_REPLICAS='["replica-1", "replica-2:5433"]'. A replica is
+    # skipped while it is unreachable or more than DB_REPLICA_MAX_LAG_S behind, with none left
+    # reads go to the primary. Every replica gets a pool of DB_POOL_SIZE per worker.
+    DB_REPLICAS: list[str] = []
+    DB_REPLICA_MAX_LAG_S: float = 5.0
+    DB_REPLICA_CHECK_INTERVAL_S: float = 5.0
+    DB_REPLICA_CHECK_TIMEOUT_S: float = 1.0
+
+    # Shards ("host", "host:port" or "host:port/database", same credentials as the primary) keyed
+    # by a name that must never change, e.g. DB_SHARDS='{"s0": "db-0", "s1": "db-1:5433/pproject"}'.
+    # When set, merchants are mapped onto them with a consistent hash of merchant_id and the primary
+    # is not used; every shard holds the full schema and a pool of DB_POOL_SIZE per worker.
+    # Transaction ids are only unique within a shard. Add shards with rebalance_shards.py.
+    DB_SHARDS: dict[str, str] = {}
+    DB_SHARD_VNODES: int = 64
+
+    REDIS_HOST: str = "localhost"
+    REDIS_PORT: int = 6379
+    REDIS_DB: int = 0
+    REDIS_MAX_CONNECTIONS: int = 32
+
+    # Micro-batching of queue pushes: a batch is flushed when it reaches
+    # PRODUCER_MAX_BATCH items or PRODUCER_FLUSH_INTERVAL_MS after its first item.
+    PRODUCER_MAX_BATCH: int = 256
+    PRODUCER_FLUSH_INTERVAL_MS: float = 2.0
+
+    REQUESTS_QUEUE: str = "REQUESTS"
+
+    # Bounded requests queue and load shedding (backpressure.py). In sync mode the queue is only an
+    # audit list, trimmed to its newest REQUESTS_QUEUE_MAXLEN payloads (0 is unbounded). The
+    # write_behind work queue is never trimmed. /wpp/ answers 429 once the backlog (write_behind only) reaches
+    # BACKPRESSURE_BACKLOG_HIGH or the average insert latency BACKPRESSURE_LATENCY_HIGH_MS,
+    # and accepts again below the low marks. 0 disables a watermark.
+    REQUESTS_QUEUE_MAXLEN: int = 1_000_000
+    BACKPRESSURE_BACKLOG_HIGH: int = 100_000
+    BACKPRESSURE_BACKLOG_LOW: int = 80_000
+    BACKPRESSURE_LATENCY_HIGH_MS: float = 500.0
+    BACKPRESSURE_LATENCY_LOW_MS: float = 250.0
+    BACKPRESSURE_CHECK_INTERVAL_MS: float = 250.0
+    BACKPRESSURE_RETRY_AFTER_S: int = 1
+
+    # "sync" persists every request before responding, "write_behind" only enqueues it
+    # and leaves persistence to the background worker (worker.py).
+    INGEST_MODE: Literal["sync", "write_behind"] = "sync"
+    WORKER_BATCH_SIZE: int = 500
+    WORKER_MAX_ATTEMPTS: int = 5
+    WORKER_POLL_TIMEOUT_S: float = 1.0
+    # Delay before a failed payload is retried, doubled on every attempt, and the longest
+    # pause of a worker while the database is unreachable.
+    WORKER_RETRY_BACKOFF_S: float = 1.0
+    WORKER_RETRY_BACKOFF_MAX_S: float = 60.0
+
+    # Cache of merchant/customer ids known to exist, optionally shared through expiring Redis keys.
+    KNOWN_ID_CACHE_SIZE: int = 100_000
+    KNOWN_ID_CACHE_TTL_S: float = 3600.0
+    KNOWN_ID_CACHE_REDIS: bool = False
+
+    # Key of the HMAC fingerprints of billing addresses and saved payment details. Identical
+    # rows are stored once when set; the key must stay stable, changing it disables reuse of older rows.
+    FINGERPRINT_KEY: str = ""
+    FINGERPRINT_CACHE_SIZE: int = 100_000
+    FINGERPRINT_CACHE_TTL_S: float = 3600.0
+
+    # Cache of the reference lookup responses in front of Redis, invalidated by the writes.
+    # "Not found" is cached for RESPONSE_CACHE_NEGATIVE_TTL_S only.
+    RESPONSE_CACHE_SIZE: int = 10_000
+    RESPONSE_CACHE_TTL_S: float = 300.0
+    RESPONSE_CACHE_NEGATIVE_TTL_S: float = 2.0
+    RESPONSE_CACHE_REDIS: bool = True
+
+    # "orm" writes through the ORM unit of work, "core" with one chained-CTE statement.
+    INSERT_ENGINE: Literal["orm", "core"] = "orm"
+
+    # Replays of a (merchantID, txnReference) are answered from this store for IDEMPOTENCY_TTL_S.
+    IDEMPOTENCY_BACKEND: Literal["redis", "memory"] = "redis"
+    IDEMPOTENCY_TTL_S: float = 86400.0
+    IDEMPOTENCY_PENDING_TTL_S: float = 30.0
+
+    # NDJSON batch ingestion: records are persisted in chunks, lines above the limit are rejected.
+    BATCH_CHUNK_SIZE: int = 500
+    BATCH_MAX_LINE_BYTES: int = 64 * 1024
+
+    # Monthly partitions of `transaction` (partition_maintenance.py): months created ahead, past
+    # months kept besides the current one (0 keeps all) and where retired partitions are archived.
+    PARTITION_PRECREATE_MONTHS: int = 3
+    PARTITION_RETENTION_MONTHS: int = 0
+    PARTITION_ARCHIVE_DIR: str = "archive"
+
+    # Production server, see gunicorn_conf.py. WEB_WORKERS of 0 runs one worker per available CPU.
+    WEB_BIND: str = "0.0.0.0:8080"
+    WEB_WORKERS: int = 0
+    WEB_PRELOAD: bool = True
+    WEB_TIMEOUT_S: int = 30
+    WEB_GRACEFUL_TIMEOUT_S: int = 30
+    WEB_KEEPALIVE_S: int = 5
+    WEB_MAX_REQUESTS: int = 0
+
+    # Logs are written by a background thread; LOG_FILE="" logs to stderr. Only a
+    # LOG_SAMPLE_RATE fraction of requests emit their per-request info logs.
+    LOG_LEVEL: str = "INFO"
+    LOG_FILE: str = "app.log"
+    LOG_JSON: bool = False
+    LOG_SAMPLE_RATE: float = 1.0
+
+    # Sampling profiler (profiler.py), only installed when PROFILER_ENABLED. A request is profiled
+    # with probability PROFILER_SAMPLE_RATE or when it carries PROFILER_TRIGGER_HEADER; if
+    # PROFILER_TOKEN is set, the header must carry it. The admin endpoints require PROFILER_TOKEN
+    # and only read or change the worker process that serves them.
+    PROFILER_ENABLED: bool = False
+    PROFILER_SAMPLE_RATE: float = 0.0
+    PROFILER_TRIGGER_HEADER: str = "X-Profile"
+    PROFILER_TOKEN: str = ""
+    PROFILER_INTERVAL_MS: float = 5.0
+    PROFILER_WINDOW_S: float = 60.0
+    PROFILER_WINDOWS: int = 10
+
     model_config = SettingsConfigDict(env_file=DOTENV, env_file_encoding="utf-8")
 
 
@@ -21,12 +153,25 @@ class AppSettings(BaseSettings):
     def DATABASE_URL_asyncpg(self):
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
+    def replica_url_asyncpg(self, replica: str):
+        host, _, port = replica.partition(":")
+        return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{host}:{port or self.DB_PORT}/{self.DB_NAME}"
+
+    def shard_url_asyncpg(self, shard: str):
+        address, _, database = shard.partition("/")
+        host, _, port = address.partition(":")
+        return (f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{host}:{port or self.DB_PORT}/"
+                f"{database or self.DB_NAME}")
+
+    @property
+    def REDIS_URL(self):
+        return f"redis://{self.REDIS_HOST}:{self.REDIS_PORT}/{self.REDIS_DB}"
+
 
 settings = AppSettings()
 
-logging.basicConfig(
-        filename='app.log',
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    )
+setup_logging(settings.LOG_LEVEL, settings.LOG_FILE, settings.LOG_JSON)
 logger = logging.getLogger(__name__)
+# Per-request info logs go through here so that they can be sampled.
+request_logger = logging.getLogger(f'{__name__}.request')
+request_logger.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATE))
@@ -0,0 +1,119 @@
+import atexit
+import logging
+import os
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+import orjson
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_request_sampled: ContextVar[bool | None] = ContextVar("request_sampled", default=None)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that hands the record to the listener thread untouched.
+
+    The stock handler formats the message (and the whole log line) in the calling thread;
+    here `%`-arguments are merged and the line is rendered by the listener, off the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Renders a record as one JSON object per line, with the `extra` fields of the call.
+    """
+
+    _reserved = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._reserved:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(data, default=str).decode()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through a `rate` fraction of INFO-and-below records; warnings and errors always pass.
+
+    Inside a request marked with `sample_request`, all its records share one decision,
+    so a sampled request is logged completely.
+    """
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord):
+        if record.levelno > logging.INFO or self.rate >= 1.0:
+            return True
+        sampled = _request_sampled.get()
+        if sampled is None:
+            return random.random() < self.rate
+        return sampled
+
+
+def sample_request(rate: float):
+    """
+    Decides once whether the per-request logs of the current request (context) are kept.
+
+    Args:
+        rate (float): The fraction of requests to log.
+    """
+    _request_sampled.set(rate >= 1.0 or random.random() < rate)
+
+
+def setup_logging(level: str = "INFO", filename: str | None = "app.log", json_format: bool = False):
+    """
+    Routes all logging through an in-memory queue drained by a background listener thread,
+    which does the formatting and the file (or stderr) I/O.
+
+    Args:
+        level (str): The root log level.
+        filename (str | None): The log file, stderr if empty.
+        json_format (bool): Writes JSON lines instead of plain text.
+
+    Returns:
+        QueueListener: The started listener, stopped at interpreter exit.
+    """
+    handler = logging.FileHandler(filename) if filename else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = SimpleQueue()
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    queue_handler = DeferredQueueHandler(log_queue)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    def restart_in_child():
+        # The listener thread does not survive fork (e.g. gunicorn --preload workers). The child
+        # gets a fresh queue, records the parent had not written yet stay the parent's.
+        listener.queue = queue_handler.queue = SimpleQueue()
+        listener._thread = None
+        listener.start()
+
+    os.register_at_fork(after_in_child=restart_in_child)
+    return listener
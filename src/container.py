@@ -1,6 +1,65 @@
-import redis
-
-from db.transaction_service import TransactionService
+from backpressure import LoadShedder
+from configs.config import settings
+from db.database import dispose_engine
+from db.transaction_query_service import reference_cache
+from db.transaction_service import (TransactionService, billing_address_cache, customer_cache, merchant_cache,
+                                    payment_detail_cache)
+from idempotency import IdempotencyStore
+from profiler import StackSampler
+from redis_producer import RedisProducer
 
 transaction_service = TransactionService()
-redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
+redis_producer = RedisProducer(
+    settings.REDIS_URL,
+    max_batch=settings.PRODUCER_MAX_BATCH,
+    flush_interval=settings.PRODUCER_FLUSH_INTERVAL_MS / 1000,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    # In write-behind mode the queue holds accepted but unstored payloads: the load shedder bounds it.
+    max_len=settings.REQUESTS_QUEUE_MAXLEN if settings.INGEST_MODE != "write_behind" else 0,
+)
+idempotency_store = IdempotencyStore(
+    ttl=settings.IDEMPOTENCY_TTL_S,
+    pending_ttl=settings.IDEMPOTENCY_PENDING_TTL_S,
+)
+load_shedder = LoadShedder(
+    settings.REQUESTS_QUEUE,
+    # Nothing consumes the queue in sync mode, so only write-behind has a backlog to watch.
+    backlog_high=settings.BACKPRESSURE_BACKLOG_HIGH if settings.INGEST_MODE == "write_behind" else 0,
+    backlog_low=settings.BACKPRESSURE_BACKLOG_LOW,
+    latency_high=settings.BACKPRESSURE_LATENCY_HIGH_MS / 1000,
+    latency_low=settings.BACKPRESSURE_LATENCY_LOW_MS / 1000,
+    check_interval=settings.BACKPRESSURE_CHECK_INTERVAL_MS / 1000,
+    retry_after=settings.BACKPRESSURE_RETRY_AFTER_S,
+)
+profiler = StackSampler(
+    interval=settings.PROFILER_INTERVAL_MS / 1000,
+    window=settings.PROFILER_WINDOW_S,
+    windows=settings.PROFILER_WINDOWS,
+)
+
+
+async def startup():
+    """
+    Connects the per-process clients: called from the lifespan of every worker, never at import.
+    The database engine is created on first use, see `db.database.get_engine`.
+    """
+    await redis_producer.start()
+    client = redis_producer.client
+    load_shedder.redis = client
+    if settings.IDEMPOTENCY_BACKEND == "redis":
+        idempotency_store.redis = client
+    if settings.KNOWN_ID_CACHE_REDIS:
+        customer_cache.redis = merchant_cache.redis = client
+        billing_address_cache.redis = payment_detail_cache.redis = client
+    if settings.RESPONSE_CACHE_REDIS:
+        reference_cache.redis = client
+        await reference_cache.start()
+
+
+async def shutdown():
+    """
+    Flushes and closes the per-process clients and the database pool.
+    """
+    await reference_cache.stop()
+    await redis_producer.stop()
+    await dispose_engine()
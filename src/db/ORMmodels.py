@@ -1,5 +1,7 @@
+from datetime import date, datetime
 from typing import Optional, Annotated
-from sqlalchemy import String, Integer, Numeric, ForeignKey, Boolean, MetaData
+from sqlalchemy import (String, Integer, BigInteger, Numeric, ForeignKey, Boolean, MetaData, Index, Date, DateTime,
+                        PrimaryKeyConstraint, func, text)
 from sqlalchemy.orm import declarative_base, mapped_column, Mapped, relationship
 
 Base = declarative_base()
@@ -7,6 +9,11 @@ metadata = MetaData()
 
 intpk = Annotated[int, mapped_column(primary_key=True)]
 
+TXN_REFERENCE_CONSTRAINT = "pk_transaction_reference"
+ROLLUP_CONSTRAINT = "pk_merchant_daily_rollup"
+
+created_ts = Annotated[datetime, mapped_column(DateTime(timezone=True), server_default=func.now())]
+
 
 class Customer(Base):
     __tablename__ = "customer"
@@ -35,6 +42,12 @@ class Merchant(Base):
 
 class BillingAddress(Base):
     __tablename__ = "billing_address"
+    __table_args__ = (
+        # Identical addresses of a customer are stored once, see TransactionService.fingerprint.
+        Index("uq_billing_address_fingerprint", "fingerprint", unique=True),
+        # The latest address of a customer, see TransactionExportService.export_query.
+        Index("ix_billing_address_customer_id_id", "customer_id", text("id DESC")),
+    )
     metadata = metadata
 
     id: Mapped[intpk]
@@ -50,6 +63,8 @@ class BillingAddress(Base):
     state: Mapped[str] = mapped_column(String, nullable=True)
     zip: Mapped[str] = mapped_column(String)
     country: Mapped[str] = mapped_column(String)
+    fingerprint: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    created_at: Mapped[created_ts]
     customer: Mapped["Customer"] = relationship(
         "Customer", back_populates="billing_address"
     )
@@ -57,6 +72,10 @@ class BillingAddress(Base):
 
 class PaymentDetail(Base):
     __tablename__ = "payment_detail"
+    __table_args__ = (
+        # Only saved cards are fingerprinted and shared between transactions.
+        Index("uq_payment_detail_fingerprint", "fingerprint", unique=True),
+    )
     metadata = metadata
 
     id: Mapped[intpk]
@@ -68,6 +87,8 @@ class PaymentDetail(Base):
     name_on_card: Mapped[str] = mapped_column(String)
     save_details: Mapped[bool] = mapped_column(Boolean)
     cvv: Mapped[str] = mapped_column(String)
+    fingerprint: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    created_at: Mapped[created_ts]
 
     transaction: Mapped["Transaction"] = relationship(
         "Transaction", back_populates="payment_detail"
@@ -76,9 +97,19 @@ class PaymentDetail(Base):
 
 class Transaction(Base):
     __tablename__ = "transaction"
+    __table_args__ = (
+        # Keyset pagination: WHERE merchant_id = :m AND id < :cursor ORDER BY id DESC
+        Index("ix_transaction_merchant_id_id", "merchant_id", "id"),
+        Index("ix_transaction_customer_id_id", "customer_id", "id"),
+        Index("ix_transaction_txn_reference", "txn_reference"),
+        # Monthly partitions are created and retired by partition_maintenance.py.
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
     metadata = metadata
 
-    id: Mapped[intpk]
+    # The partition key has to be part of the primary key.
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True, server_default=func.now())
     txn_amount: Mapped[Numeric] = mapped_column(Numeric)
     payment_type: Mapped[str] = mapped_column(String)
     currency_code: Mapped[str] = mapped_column(String)
@@ -102,3 +133,37 @@ class Transaction(Base):
     payment_detail: Mapped["PaymentDetail"] = relationship(
         "PaymentDetail", uselist=False, back_populates="transaction"
     )
+
+
+class TransactionReference(Base):
+    # Unique constraints of a partitioned table must contain the partition key, so the
+    # (merchant_id, txn_reference) uniqueness of transactions is enforced here instead.
+    # A row is written in the same database transaction as its transaction.
+    __tablename__ = "transaction_reference"
+    __table_args__ = (
+        PrimaryKeyConstraint("merchant_id", "txn_reference", name=TXN_REFERENCE_CONSTRAINT),
+        # Serves the pruning of the references of archived months (partition_maintenance.py).
+        Index("ix_transaction_reference_created_at", "created_at"),
+    )
+    metadata = metadata
+
+    merchant_id: Mapped[str] = mapped_column(String)
+    txn_reference: Mapped[str] = mapped_column(String)
+    created_at: Mapped[created_ts]
+
+
+class MerchantDailyRollup(Base):
+    # Transaction count and amount per merchant, UTC day and currency, incremented in the same
+    # database transaction as the transactions (see RollupService) and fixed up by reconcile_rollups.py.
+    # Rows outlive the archived partitions of `transaction`.
+    __tablename__ = "merchant_daily_rollup"
+    __table_args__ = (
+        PrimaryKeyConstraint("merchant_id", "day", "currency_code", name=ROLLUP_CONSTRAINT),
+    )
+    metadata = metadata
+
+    merchant_id: Mapped[str] = mapped_column(String)
+    day: Mapped[date] = mapped_column(Date)
+    currency_code: Mapped[str] = mapped_column(String)
+    txn_count: Mapped[int] = mapped_column(BigInteger, server_default="0")
+    txn_amount: Mapped[Numeric] = mapped_column(Numeric, server_default="0")
@@ -1,15 +1,389 @@
+import asyncio
+import bisect
+import hashlib
+import os
+import time
+from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import lambda_stmt, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from configs.config import settings
+from configs.config import logger, settings
+from db.pool_metrics import InstrumentedAsyncQueuePool
+from db.statement_metrics import StatementCacheMetrics
 
-async_engine = create_async_engine(
-    url=settings.DATABASE_URL_asyncpg,
-    echo=True,
+# Statements are compiled once per shape into the engine's compiled cache (DB_COMPILED_CACHE_SIZE),
+# and asyncpg prepares them once per connection (DB_PREPARED_STATEMENT_CACHE_SIZE, 0 when a
+# transaction-pooling PgBouncer sits in front of the database).
+connect_args = {"prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE}
+if settings.DB_STATEMENT_TIMEOUT_MS:
+    connect_args["server_settings"] = {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}
+
+_engine: AsyncEngine | None = None
+_engine_pid: int | None = None
+_session_maker = sessionmaker(class_=AsyncSession, expire_on_commit=False)
+statement_metrics = StatementCacheMetrics()
+
+# Replication lag in seconds, 0 on a replica that has replayed everything it received
+# (pg_last_xact_replay_timestamp alone keeps growing while the primary is idle) or on a primary.
+REPLICA_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """
 )
 
-async_session_factory = sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+
+def create_engine(url: str) -> AsyncEngine:
+    engine = create_async_engine(
+        url=url,
+        echo=settings.DB_ECHO,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_S,
+        pool_recycle=settings.DB_POOL_RECYCLE_S,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        query_cache_size=settings.DB_COMPILED_CACHE_SIZE,
+        connect_args=connect_args,
+    )
+    statement_metrics.instrument(engine)
+    return engine
+
+
+def precompiled(statement, key: str):
+    """
+    Wraps a statement that is built once in a lambda statement cached under `key`.
+
+    SQLAlchemy compiles statements without a cache key on every execution; among them is every
+    PostgreSQL `INSERT ... ON CONFLICT`. Wrapped, they are compiled once per engine like any
+    other statement. The statement compiled first is executed for every statement wrapped under
+    the same key, so values are passed as execution parameters, not embedded. Use Core tables
+    rather than ORM entities, the ORM bulk paths do not accept lambda statements.
+
+    Args:
+        statement (Executable): The statement.
+        key (str): Identifies the statement among the other precompiled ones. A string: the
+            lambda shared by all of them is analyzed once, for the type of its first key.
+
+    Returns:
+        StatementLambdaElement: The statement to execute.
+    """
+    return lambda_stmt(lambda: statement, track_closure_variables=False, track_on=[key])
+
+
+def get_engine(shard: str | None = None) -> AsyncEngine:
+    """
+    Returns the engine of the current process, creating it on first use.
+
+    Nothing connects at import time, so the app can be imported by a pre-forking server
+    (gunicorn --preload) and every worker builds its own engine and pool. An engine
+    inherited through fork is abandoned without closing its connections, which still
+    belong to the parent.
+
+    Args:
+        shard (str | None): The shard, see `ShardSet`. None is the primary.
+
+    Returns:
+        AsyncEngine: The engine.
+    """
+    global _engine, _engine_pid
+    if shard is not None:
+        return shards.engine(shard)
+    if _engine is not None and _engine_pid == os.getpid():
+        return _engine
+    if _engine is not None:
+        _engine.sync_engine.dispose(close=False)
+
+    _engine = create_engine(settings.DATABASE_URL_asyncpg)
+    _engine_pid = os.getpid()
+    logger.info('Created database engine in process %d.', _engine_pid)
+    return _engine
+
+
+class ReplicaSet:
+    """
+    Engines of the read replicas, picked round-robin among the healthy ones.
+
+    A replica is healthy when it answered the last check within `check_timeout` seconds and
+    was at most `max_lag` seconds behind the primary. Checks run at most every
+    `check_interval` seconds: the first one inline, later ones in the background of the
+    request that finds them stale. A replica that refuses a connection in between is marked
+    unhealthy right away. Like the primary's, the engines are created per process.
+    """
+
+    def __init__(self, urls: list[str], max_lag: float = 5.0, check_interval: float = 5.0,
+                 check_timeout: float = 1.0):
+        self.urls = urls
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+
+        self.engines: list[AsyncEngine] = []
+        self.healthy: list[bool] = []
+        self.lag: list[float | None] = []
+        self.reads: list[int] = []
+        self.fallbacks = 0
+
+        self._pid: int | None = None
+        self._next = 0
+        self._checked_at = float("-inf")
+        self._check: asyncio.Task | None = None
+
+    async def pick(self):
+        """
+        Returns the next healthy replica engine.
+
+        Returns:
+            AsyncEngine | None: The engine, None if there are no replicas or none is healthy.
+        """
+        if not self.urls:
+            return None
+        self._ensure_engines()
+        if self._checked_at == float("-inf"):
+            await self.check()
+        elif time.monotonic() - self._checked_at >= self.check_interval and self._check is None:
+            self._check = asyncio.create_task(self.check())
+            self._check.add_done_callback(self._check_done)
+
+        for offset in range(len(self.engines)):
+            index = (self._next + offset) % len(self.engines)
+            if self.healthy[index]:
+                self._next = index + 1
+                self.reads[index] += 1
+                return self.engines[index]
+        self.fallbacks += 1
+        return None
+
+    async def check(self):
+        """
+        Measures the lag of every replica and updates their health.
+        """
+        self._checked_at = time.monotonic()
+        lags = await asyncio.gather(*(self._measure_lag(engine) for engine in self.engines))
+        for index, lag in enumerate(lags):
+            healthy = lag is not None and lag <= self.max_lag
+            if healthy and not self.healthy[index]:
+                logger.info('Replica %d is healthy (lag: %ss).', index, lag)
+            elif not healthy and self.healthy[index]:
+                logger.warning('Replica %d is unhealthy (lag: %s).', index, lag)
+            self.lag[index] = lag
+            self.healthy[index] = healthy
+
+    def mark_unhealthy(self, engine: AsyncEngine):
+        """
+        Takes a replica out of rotation until its next successful check.
+
+        Args:
+            engine (AsyncEngine): An engine returned by `pick`.
+        """
+        index = self.engines.index(engine)
+        if self.healthy[index]:
+            logger.warning('Replica %d is unhealthy: it refused a connection.', index)
+        self.healthy[index] = False
+
+    def stats(self):
+        """
+        Returns the health, lag and read count of every replica.
+
+        Returns:
+            dict: Per-replica state and the number of reads that fell back to the primary.
+        """
+        return {
+            "replicas": [
+                {"healthy": healthy, "lag_s": lag, "reads": reads, "pool": engine.pool.stats()}
+                for engine, healthy, lag, reads in zip(self.engines, self.healthy, self.lag, self.reads)
+            ],
+            "fallbacks": self.fallbacks,
+        }
+
+    async def dispose(self):
+        if self._check is not None:
+            self._check.cancel()
+        if self._pid == os.getpid():
+            for engine in self.engines:
+                await engine.dispose()
+        self.engines = []
+        self._pid = None
+
+    def _ensure_engines(self):
+        if self._pid == os.getpid():
+            return
+        for engine in self.engines:
+            engine.sync_engine.dispose(close=False)
+        self.engines = [create_engine(url) for url in self.urls]
+        self.healthy = [False] * len(self.urls)
+        self.lag = [None] * len(self.urls)
+        self.reads = [0] * len(self.urls)
+        self._checked_at = float("-inf")
+        self._check = None
+        self._pid = os.getpid()
+
+    async def _measure_lag(self, engine: AsyncEngine):
+        try:
+            async with asyncio.timeout(self.check_timeout):
+                async with engine.connect() as connection:
+                    return float(await connection.scalar(REPLICA_LAG_QUERY))
+        except Exception:
+            logger.debug('Replica check failed.', exc_info=True)
+            return None
+
+    def _check_done(self, task: asyncio.Task):
+        self._check = None
+
+
+class HashRing:
+    """
+    Consistent hash of keys onto named nodes. Every node owns `vnodes` points of a 64-bit ring
+    and a key belongs to the node of the first point at or after its hash, so adding a node
+    to N others only moves about 1/(N+1) of the keys, all of them to the new node.
+    """
+
+    def __init__(self, nodes: list[str], vnodes: int = 64):
+        points = sorted((self.hash(f'{node}#{index}'), node) for node in nodes for index in range(vnodes))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    @staticmethod
+    def hash(key: str):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def node_for(self, key: str):
+        """
+        Returns the node owning a key.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            str: The node.
+        """
+        index = bisect.bisect_left(self.hashes, self.hash(key))
+        return self.nodes[index % len(self.nodes)]
+
+
+class ShardSet:
+    """
+    Database shards by name, each with its own engine and pool per process, and the ring that
+    maps merchants onto them.
+
+    Without shards, `shard_for` returns None (the primary) and `names` is `[None]`, so code
+    that loops over the shards also covers the unsharded setup. `register` adds an engine
+    without routing to it, e.g. the new shard while rebalancing.
+    """
+
+    def __init__(self, urls: dict[str, str], vnodes: int = 64):
+        self.urls = dict(urls)
+        self.nodes = list(urls)
+        self.ring = HashRing(self.nodes, vnodes) if urls else None
+        self.engines: dict[str, AsyncEngine] = {}
+        self._pid: int | None = None
+
+    @property
+    def names(self):
+        return list(self.nodes) if self.ring is not None else [None]
+
+    def shard_for(self, merchant_id: str):
+        """
+        Returns the shard holding the records of a merchant.
+
+        Args:
+            merchant_id (str): The merchant.
+
+        Returns:
+            str | None: The shard name, None when the database is not sharded.
+        """
+        return self.ring.node_for(merchant_id) if self.ring is not None else None
+
+    def register(self, name: str, url: str):
+        if self.urls.setdefault(name, url) != url:
+            raise ValueError(f'Shard {name} is already registered with another address.')
+
+    def engine(self, name: str):
+        if self._pid != os.getpid():
+            for engine in self.engines.values():
+                engine.sync_engine.dispose(close=False)
+            self.engines = {}
+            self._pid = os.getpid()
+        engine = self.engines.get(name)
+        if engine is None:
+            engine = self.engines[name] = create_engine(self.urls[name])
+            logger.info('Created engine of shard %s in process %d.', name, self._pid)
+        return engine
+
+    def stats(self):
+        """
+        Returns the pool statistics of every shard used by this process.
+
+        Returns:
+            dict: Pool statistics by shard name.
+        """
+        return {name: engine.pool.stats() for name, engine in self.engines.items()}
+
+    async def dispose(self):
+        if self._pid == os.getpid():
+            for engine in self.engines.values():
+                await engine.dispose()
+        self.engines = {}
+        self._pid = None
+
+
+shards = ShardSet(
+    {name: settings.shard_url_asyncpg(shard) for name, shard in settings.DB_SHARDS.items()},
+    vnodes=settings.DB_SHARD_VNODES,
+)
+
+replicas = ReplicaSet(
+    [settings.replica_url_asyncpg(replica) for replica in settings.DB_REPLICAS],
+    max_lag=settings.DB_REPLICA_MAX_LAG_S,
+    check_interval=settings.DB_REPLICA_CHECK_INTERVAL_S,
+    check_timeout=settings.DB_REPLICA_CHECK_TIMEOUT_S,
+)
+
+
+async def dispose_engine():
+    """
+    Closes the pooled connections of the current process's engines and forgets them.
+    """
+    global _engine
+    if _engine is not None and _engine_pid == os.getpid():
+        await _engine.dispose()
+    _engine = None
+    await replicas.dispose()
+    await shards.dispose()
+
+
+def async_session_factory(shard: str | None = None) -> AsyncSession:
+    return _session_maker(bind=get_engine(shard))
+
+
+@asynccontextmanager
+async def read_only_session(shard: str | None = None) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Opens a session for read-only work on a healthy replica, or on the primary when there is
+    none. Reads may lag behind the primary by up to DB_REPLICA_MAX_LAG_S. A shard is read
+    directly, replicas are only those of the primary.
+    """
+    engine = await replicas.pick() if shard is None else None
+    if engine is not None:
+        session = _session_maker(bind=engine)
+        try:
+            # Connects up front, so that a replica that went down is replaced by the primary.
+            await session.connection()
+        except (OperationalError, DBAPIError, OSError):
+            await session.close()
+            replicas.mark_unhealthy(engine)
+            replicas.fallbacks += 1
+            engine = None
+    if engine is None:
+        session = async_session_factory(shard)
+
+    async with session:
+        yield session
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
@@ -0,0 +1,112 @@
+import time
+from collections import OrderedDict
+
+from redis import asyncio as aioredis
+
+
+class FingerprintCache:
+    """
+    In-process LRU/TTL map of content fingerprints to the id of the row that holds that
+    content, optionally backed by Redis keys shared between processes, one per fingerprint and
+    with the same TTL.
+
+    Like `KnownIdCache`, entries must only be added after the transaction that created
+    the rows has committed.
+    """
+
+    def __init__(self, name: str, max_size: int = 100_000, ttl: float = 3600.0,
+                 redis_client: aioredis.Redis | None = None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis = redis_client
+
+        self._entries: OrderedDict[str, tuple[float, int]] = OrderedDict()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    async def get(self, fingerprint: str):
+        """
+        Looks up the row id of a fingerprint, consulting Redis on a local miss.
+
+        Args:
+            fingerprint (str): The content fingerprint.
+
+        Returns:
+            int | None: The id of the row with that content, None if unknown.
+        """
+        entry = self._entries.get(fingerprint)
+        if entry is not None:
+            expires, row_id = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(fingerprint)
+                self.hits += 1
+                return row_id
+            del self._entries[fingerprint]
+
+        if self.redis is not None:
+            row_id = await self.redis.get(self._redis_key(fingerprint))
+            if row_id is not None:
+                self._remember(fingerprint, int(row_id))
+                self.redis_hits += 1
+                return int(row_id)
+
+        self.misses += 1
+        return None
+
+    async def put(self, rows: dict[str, int]):
+        """
+        Remembers the row ids of fingerprints locally and in Redis.
+
+        Args:
+            rows (dict[str, int]): Row ids keyed by fingerprint, committed to the database.
+        """
+        if not rows:
+            return
+        for fingerprint, row_id in rows.items():
+            self._remember(fingerprint, row_id)
+        if self.redis is not None:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for fingerprint, row_id in rows.items():
+                    pipe.set(self._redis_key(fingerprint), row_id, px=int(self.ttl * 1000))
+                await pipe.execute()
+
+    async def discard(self, *fingerprints: str):
+        """
+        Forgets fingerprints locally and in Redis, e.g. after a write that relied on them failed.
+
+        Args:
+            *fingerprints (str): The fingerprints to forget.
+        """
+        if not fingerprints:
+            return
+        for fingerprint in fingerprints:
+            self._entries.pop(fingerprint, None)
+        if self.redis is not None:
+            await self.redis.delete(*(self._redis_key(fingerprint) for fingerprint in fingerprints))
+
+    def stats(self):
+        """
+        Returns lookup counters and the hit ratio.
+
+        Returns:
+            dict: Size, hits (local and Redis), misses and hit ratio.
+        """
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
+
+    def _redis_key(self, fingerprint: str):
+        return f'fingerprint:{self.name}:{fingerprint}'
+
+    def _remember(self, fingerprint: str, row_id: int):
+        self._entries[fingerprint] = (time.monotonic() + self.ttl, row_id)
+        self._entries.move_to_end(fingerprint)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
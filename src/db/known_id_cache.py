@@ -0,0 +1,107 @@
+import time
+from collections import OrderedDict
+
+from redis import asyncio as aioredis
+
+
+class KnownIdCache:
+    """
+    In-process LRU/TTL set of ids that are known to exist in the database,
+    optionally backed by Redis keys shared between processes, one per id and with the same TTL.
+
+    Ids must only be added after the transaction that created them has committed.
+    """
+
+    def __init__(self, name: str, max_size: int = 100_000, ttl: float = 3600.0,
+                 redis_client: aioredis.Redis | None = None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis = redis_client
+
+        self._entries: OrderedDict[str, float] = OrderedDict()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    async def contains(self, key: str):
+        """
+        Checks whether an id is known, consulting Redis on a local miss.
+
+        Args:
+            key (str): The id to look up.
+
+        Returns:
+            bool: True if the id is known to exist.
+        """
+        expires = self._entries.get(key)
+        if expires is not None:
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+            del self._entries[key]
+
+        if self.redis is not None and await self.redis.exists(self._redis_key(key)):
+            self._remember(key)
+            self.redis_hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    async def add(self, *keys: str):
+        """
+        Marks ids as known locally and in Redis.
+
+        Args:
+            *keys (str): The ids that were committed to the database.
+        """
+        if not keys:
+            return
+        for key in keys:
+            self._remember(key)
+        if self.redis is not None:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.set(self._redis_key(key), 1, px=int(self.ttl * 1000))
+                await pipe.execute()
+
+    async def discard(self, *keys: str):
+        """
+        Forgets ids locally and in Redis, e.g. after a write that relied on them failed.
+
+        Args:
+            *keys (str): The ids to forget.
+        """
+        if not keys:
+            return
+        for key in keys:
+            self._entries.pop(key, None)
+        if self.redis is not None:
+            await self.redis.delete(*(self._redis_key(key) for key in keys))
+
+    def stats(self):
+        """
+        Returns lookup counters and the hit ratio.
+
+        Returns:
+            dict: Size, hits (local and Redis), misses and hit ratio.
+        """
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
+
+    def _redis_key(self, key: str):
+        return f'known:{self.name}:{key}'
+
+    def _remember(self, key: str):
+        self._entries[key] = time.monotonic() + self.ttl
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
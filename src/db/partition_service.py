@@ -0,0 +1,223 @@
+import gzip
+import os
+import re
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+
+from configs.config import logger
+from db.database import get_engine
+
+PARTITIONED_TABLE = "transaction"
+PARTITION_NAME = re.compile(rf'^{PARTITIONED_TABLE}_y(\d{{4}})m(\d{{2}})$')
+
+
+class PartitionService:
+    """
+    Maintenance of the monthly range partitions of the `transaction` table.
+
+    Partitions are named `transaction_yYYYYmMM` and hold the rows whose `created_at`
+    falls into that UTC month. There is no default partition: inserts fail for a month
+    without a partition, so `ensure_partitions` must run (e.g. daily) well ahead of time.
+    Every shard has partitions of its own, the methods work on the one given as `shard`.
+    """
+
+    @staticmethod
+    def partition_name(month: date):
+        return f'{PARTITIONED_TABLE}_y{month.year:04d}m{month.month:02d}'
+
+    @staticmethod
+    def add_months(month: date, months: int):
+        index = month.year * 12 + month.month - 1 + months
+        return date(index // 12, index % 12 + 1, 1)
+
+    @staticmethod
+    def current_month():
+        today = datetime.now(timezone.utc).date()
+        return today.replace(day=1)
+
+    @staticmethod
+    async def list_partitions(shard: str | None = None):
+        """
+        Returns the attached monthly partitions of `transaction`.
+
+        Args:
+            shard (str | None): The shard, None for the primary.
+
+        Returns:
+            dict[str, date]: The first day of the month of every partition, keyed by partition name.
+        """
+        query = text(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table
+            """
+        )
+        async with get_engine(shard).connect() as connection:
+            names = (await connection.scalars(query, {"table": PARTITIONED_TABLE})).all()
+
+        return PartitionService.months_of(names)
+
+    @staticmethod
+    async def detached_partitions(shard: str | None = None):
+        """
+        Returns the standalone tables named like a partition of `transaction`: partitions that were
+        detached but not archived, e.g. by `--detach-only` or a run interrupted in between.
+
+        Args:
+            shard (str | None): The shard, None for the primary.
+
+        Returns:
+            dict[str, date]: The first day of the month of every table, keyed by table name.
+        """
+        query = text(
+            """
+            SELECT relname
+            FROM pg_class
+            WHERE relkind = 'r' AND NOT relispartition AND relname LIKE :prefix AND pg_table_is_visible(oid)
+            """
+        )
+        async with get_engine(shard).connect() as connection:
+            names = (await connection.scalars(query, {"prefix": f'{PARTITIONED_TABLE}\\_y%'})).all()
+        return PartitionService.months_of(names)
+
+    @staticmethod
+    def months_of(names):
+        partitions = {}
+        for name in names:
+            match = PARTITION_NAME.match(name)
+            if match:
+                partitions[name] = date(int(match.group(1)), int(match.group(2)), 1)
+        return partitions
+
+    @staticmethod
+    async def ensure_partitions(ahead: int, dry_run: bool = False, shard: str | None = None):
+        """
+        Creates the partitions of the current month and of the next `ahead` months that are missing.
+
+        Args:
+            ahead (int): The number of future months that must have a partition.
+            dry_run (bool): Only reports the partitions that would be created.
+            shard (str | None): The shard, None for the primary.
+
+        Returns:
+            list[str]: The names of the created partitions.
+        """
+        existing = await PartitionService.list_partitions(shard)
+        current = PartitionService.current_month()
+        created = []
+        for offset in range(ahead + 1):
+            month = PartitionService.add_months(current, offset)
+            name = PartitionService.partition_name(month)
+            if name in existing:
+                continue
+            created.append(name)
+            if not dry_run:
+                await PartitionService.create_partition(month, shard)
+        return created
+
+    @staticmethod
+    async def create_partition(month: date, shard: str | None = None):
+        """
+        Creates the partition of a month unless it exists.
+
+        Args:
+            month (date): The first day of the month.
+            shard (str | None): The shard, None for the primary.
+        """
+        name = PartitionService.partition_name(month)
+        upper = PartitionService.add_months(month, 1)
+        async with get_engine(shard).begin() as connection:
+            await connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARTITIONED_TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{upper.isoformat()} 00:00:00+00')"
+            ))
+        logger.info('Created partition %s.', name)
+
+    @staticmethod
+    async def expired_partitions(retention: int, shard: str | None = None):
+        """
+        Returns the partitions whose whole month is older than the retention period.
+
+        Args:
+            retention (int): The number of past months to keep besides the current one.
+            shard (str | None): The shard, None for the primary.
+
+        Returns:
+            list[str]: The names of the expired partitions, oldest first.
+        """
+        return PartitionService.expired(await PartitionService.list_partitions(shard), retention)
+
+    @staticmethod
+    def expired(partitions: dict[str, date], retention: int):
+        oldest_kept = PartitionService.add_months(PartitionService.current_month(), -retention)
+        return sorted((name for name, month in partitions.items() if month < oldest_kept), key=partitions.get)
+
+    @staticmethod
+    async def detach_partition(name: str, shard: str | None = None):
+        """
+        Detaches a partition, which then remains as a standalone table. CONCURRENTLY only
+        takes a SHARE UPDATE EXCLUSIVE lock on `transaction`, so writes keep flowing, but it
+        cannot run inside a transaction block.
+
+        Args:
+            name (str): The partition to detach.
+            shard (str | None): The shard, None for the primary.
+        """
+        async with get_engine(shard).connect() as connection:
+            connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+            await connection.execute(text(f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {name} CONCURRENTLY"))
+        logger.info('Detached partition %s.', name)
+
+    @staticmethod
+    async def archive_table(name: str, directory: str, shard: str | None = None):
+        """
+        Writes a detached partition to `<directory>/<name>.csv.gz` with COPY and drops it.
+
+        Args:
+            name (str): The detached partition.
+            directory (str): The directory of the archives.
+            shard (str | None): The shard, None for the primary.
+
+        Returns:
+            str: The path of the archive.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{name}.csv.gz')
+        async with get_engine(shard).connect() as connection:
+            raw_connection = await connection.get_raw_connection()
+            with gzip.open(path, "wb") as archive:
+                async def write(chunk: bytes):
+                    archive.write(chunk)
+
+                await raw_connection.driver_connection.copy_from_table(name, output=write, format="csv", header=True)
+            # The table is only dropped once its archive has been completely written.
+            await connection.execute(text(f"DROP TABLE {name}"))
+            await connection.commit()
+        logger.info('Archived partition %s to %s.', name, path)
+        return path
+
+    @staticmethod
+    async def prune_references(before: date, shard: str | None = None):
+        """
+        Deletes the `transaction_reference` rows created before a month, whose transactions have
+        been archived. A reference is written in the same database transaction as its transaction,
+        so both have the same `created_at`.
+
+        Args:
+            before (date): The first day of the oldest month whose references are kept.
+            shard (str | None): The shard, None for the primary.
+
+        Returns:
+            int: The number of deleted references.
+        """
+        async with get_engine(shard).begin() as connection:
+            deleted = (await connection.execute(
+                text("DELETE FROM transaction_reference WHERE created_at < :before"),
+                {"before": datetime(before.year, before.month, 1, tzinfo=timezone.utc)},
+            )).rowcount
+        logger.info('Pruned %d transaction references created before %s.', deleted, before)
+        return deleted
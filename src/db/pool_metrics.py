@@ -0,0 +1,93 @@
+import bisect
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Upper bounds of the checkout wait-time histogram buckets, in milliseconds.
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class PoolMetrics:
+    """
+    Checkout counters and a wait-time histogram of a connection pool.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.waiters = 0
+        self.max_waiters = 0
+        self.wait_time_total = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def observe_wait(self, seconds: float):
+        self.checkouts += 1
+        self.wait_time_total += seconds
+        self.wait_buckets[bisect.bisect_left(WAIT_BUCKETS_MS, seconds * 1000)] += 1
+
+    def as_dict(self):
+        """
+        Returns the counters and the cumulative wait-time histogram.
+
+        Returns:
+            dict: Checkouts, timeouts, waiters and `le`-keyed cumulative bucket counts.
+        """
+        histogram, cumulative = {}, 0
+        for bound, count in zip((*WAIT_BUCKETS_MS, "+Inf"), self.wait_buckets):
+            cumulative += count
+            histogram[str(bound)] = cumulative
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "waiters": self.waiters,
+            "max_waiters": self.max_waiters,
+            "avg_wait_ms": self.wait_time_total / self.checkouts * 1000 if self.checkouts else 0.0,
+            "wait_ms_histogram": histogram,
+        }
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """
+    `AsyncAdaptedQueuePool` that records how long checkouts wait and how many are waiting.
+    The metrics survive pool recreation (e.g. after `engine.dispose()` or invalidation).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self):
+        metrics = self.metrics
+        metrics.waiters += 1
+        metrics.max_waiters = max(metrics.max_waiters, metrics.waiters)
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            metrics.timeouts += 1
+            raise
+        finally:
+            metrics.waiters -= 1
+        metrics.observe_wait(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def stats(self):
+        """
+        Returns live pool state together with the checkout metrics.
+
+        Returns:
+            dict: Pool size, checked-in/out and overflow counts plus `PoolMetrics.as_dict()`.
+        """
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            **self.metrics.as_dict(),
+        }
@@ -0,0 +1,296 @@
+from dataclasses import dataclass
+from datetime import timezone
+from decimal import Decimal
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from configs.config import logger, settings
+from db.ORMmodels import (BillingAddress, Customer, Merchant, MerchantDailyRollup, PaymentDetail, Transaction,
+                          TransactionReference, ROLLUP_CONSTRAINT)
+from db.database import HashRing, get_engine, precompiled, shards
+from db.partition_service import PartitionService
+from db.rollup_service import RollupService
+from db.transaction_service import BILLING_ADDRESS_UPSERT, DUPLICATE_LOOKUP_CHUNK, MERCHANT_UPSERT, TransactionService
+
+# Transactions of a merchant copied per database transaction of the target shard.
+COPY_CHUNK = 1000
+
+PAYMENT_DETAIL_COLUMNS = ("card_number", "card_type", "exp_year", "exp_month", "name_on_card", "save_details", "cvv",
+                          "fingerprint")
+TRANSACTION_COLUMNS = [column.name for column in Transaction.__table__.c if column.name != "id"]
+
+# Adds copied transactions to the rollups of their own day.
+ROLLUP_INCREMENT = precompiled(RollupService.upsert_statement(current_day=False), 'rollup_increment')
+
+
+class RebalanceError(Exception):
+    """
+    Raised when a merchant cannot be pruned from its previous shard because some of its
+    transactions have not been copied to the new one.
+    """
+
+
+@dataclass
+class MerchantMove:
+    merchant_id: str
+    source: str | None
+    target: str
+
+
+@dataclass
+class CopyResult:
+    copied: int = 0
+    already_copied: int = 0
+    archived_rollups: int = 0
+
+
+class RebalanceService:
+    """
+    Moves merchants to the shard a new DB_SHARDS maps them to. Adding a shard to N others moves
+    about 1/(N+1) of the merchants, all of them to the new shard. Going from the primary to
+    shards is a rebalance too, whose source is the primary.
+
+    Run with the current DB_SHARDS and the new shards as `targets`, every shard migrated first:
+
+    1. `copy` copies the merchants that move while they keep being written to their current shard.
+    2. The new DB_SHARDS is deployed to every api and worker process.
+    3. `copy` again copies what was written to the previous shards meanwhile.
+    4. `prune` deletes the moved merchants from their previous shards.
+
+    A copy skips the transactions whose (merchant_id, txn_reference) is on the target already,
+    so it can be interrupted and repeated at any time. Transactions get new ids on the target.
+    Customers, billing addresses and payment details are shared between the merchants of a
+    shard, so the moved ones are copied but not deleted from the source.
+    """
+
+    @staticmethod
+    def register(targets: dict[str, str]):
+        """
+        Registers the engines of the target shards.
+
+        Args:
+            targets (dict[str, str]): The new DB_SHARDS.
+
+        Returns:
+            HashRing: The ring of the new DB_SHARDS.
+        """
+        for name, address in targets.items():
+            shards.register(name, settings.shard_url_asyncpg(address))
+        return HashRing(list(targets), settings.DB_SHARD_VNODES)
+
+    @staticmethod
+    async def plan(targets: dict[str, str]):
+        """
+        Returns the merchants whose shard changes with the new DB_SHARDS.
+
+        Args:
+            targets (dict[str, str]): The new DB_SHARDS.
+
+        Returns:
+            list[MerchantMove]: The moves, by source shard and merchant.
+        """
+        ring = RebalanceService.register(targets)
+        moves = []
+        for shard in shards.names:
+            async with get_engine(shard).connect() as connection:
+                merchant_ids = (await connection.scalars(
+                    select(Merchant.merchant_id).order_by(Merchant.merchant_id)
+                )).all()
+            for merchant_id in merchant_ids:
+                target = ring.node_for(merchant_id)
+                if target != shard:
+                    moves.append(MerchantMove(merchant_id, shard, target))
+        return moves
+
+    @staticmethod
+    async def copy_merchant(move: MerchantMove, chunk_size: int = COPY_CHUNK):
+        """
+        Copies the transactions of a merchant that are not on the target shard yet, with their
+        customers, billing addresses, payment details, references and rollups, `chunk_size`
+        transactions per database transaction.
+
+        Rollups of days whose partitions are no longer attached on the source cannot be recomputed
+        from the copied transactions, they are copied as they are.
+
+        Args:
+            move (MerchantMove): The merchant and its shards.
+            chunk_size (int): Transactions copied per database transaction.
+
+        Returns:
+            CopyResult: The number of copied and already copied transactions and archived-day rollups.
+        """
+        result = CopyResult()
+        async with get_engine(move.target).begin() as connection:
+            await connection.execute(MERCHANT_UPSERT, {"merchant_id": move.merchant_id})
+
+        payment_detail = PaymentDetail.__table__
+        query = (
+            select(Transaction.__table__,
+                   *(payment_detail.c[column].label(f'payment_detail_{column}') for column in PAYMENT_DETAIL_COLUMNS))
+            .join(payment_detail, payment_detail.c.id == Transaction.payment_detail_id)
+            .where(Transaction.merchant_id == move.merchant_id)
+            .order_by(Transaction.id)
+            .limit(chunk_size)
+        )
+        partitions = set((await PartitionService.list_partitions(move.target)).values())
+        last_id = 0
+        while True:
+            async with get_engine(move.source).connect() as connection:
+                rows = (await connection.execute(query.where(Transaction.id > last_id))).mappings().all()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            for month in sorted({RebalanceService.utc_day(row['created_at']).replace(day=1) for row in rows}):
+                if month not in partitions:
+                    await PartitionService.create_partition(month, move.target)
+                    partitions.add(month)
+            copied = await RebalanceService._copy_chunk(move, rows)
+            result.copied += copied
+            result.already_copied += len(rows) - copied
+
+        result.archived_rollups = await RebalanceService._copy_archived_rollups(move)
+        logger.info('Copied merchant %s from %s to %s: %d transactions, %d already copied, %d archived rollups.',
+                    move.merchant_id, move.source, move.target, result.copied, result.already_copied,
+                    result.archived_rollups)
+        return result
+
+    @staticmethod
+    async def prune_merchant(move: MerchantMove):
+        """
+        Deletes a merchant, its transactions, references and rollups from its previous shard,
+        once all of its transactions are on the target. The merchant row stays locked while
+        checking, so a process still writing the merchant to the source waits and then fails.
+
+        Args:
+            move (MerchantMove): The merchant and its shards.
+
+        Returns:
+            int: The number of deleted transactions.
+
+        Raises:
+            RebalanceError: If transactions of the merchant are missing on the target.
+        """
+        async with get_engine(move.source).begin() as connection:
+            await connection.execute(
+                select(Merchant.id).where(Merchant.merchant_id == move.merchant_id).with_for_update()
+            )
+            references = (await connection.scalars(
+                select(TransactionReference.txn_reference)
+                .where(TransactionReference.merchant_id == move.merchant_id)
+                .order_by(TransactionReference.txn_reference)
+            )).all()
+            missing = 0
+            async with get_engine(move.target).connect() as target:
+                for start in range(0, len(references), DUPLICATE_LOOKUP_CHUNK):
+                    chunk = references[start:start + DUPLICATE_LOOKUP_CHUNK]
+                    copied = (await target.scalars(
+                        select(TransactionReference.txn_reference)
+                        .where(TransactionReference.merchant_id == move.merchant_id,
+                               TransactionReference.txn_reference.in_(chunk))
+                    )).all()
+                    missing += len(chunk) - len(copied)
+            if missing:
+                raise RebalanceError(f'{missing} transactions of merchant {move.merchant_id} are not on '
+                                     f'{move.target} yet, copy again.')
+
+            deleted = (await connection.execute(
+                delete(Transaction).where(Transaction.merchant_id == move.merchant_id)
+            )).rowcount
+            await connection.execute(
+                delete(TransactionReference).where(TransactionReference.merchant_id == move.merchant_id)
+            )
+            await connection.execute(
+                delete(MerchantDailyRollup).where(MerchantDailyRollup.merchant_id == move.merchant_id)
+            )
+            await connection.execute(delete(Merchant).where(Merchant.merchant_id == move.merchant_id))
+
+        logger.info('Pruned merchant %s from %s: %d transactions.', move.merchant_id, move.source, deleted)
+        return deleted
+
+    @staticmethod
+    def utc_day(created_at):
+        return created_at.astimezone(timezone.utc).date()
+
+    @staticmethod
+    async def _copy_chunk(move: MerchantMove, rows):
+        # References go first: a transaction whose reference is on the target already, copied
+        # before or written there since, is skipped.
+        references = [dict(merchant_id=move.merchant_id, txn_reference=row['txn_reference'],
+                           created_at=row['created_at'])
+                      for row in sorted(rows, key=lambda row: row['txn_reference'])]
+        async with get_engine(move.target).begin() as connection:
+            inserted = set((await connection.scalars(
+                pg_insert(TransactionReference.__table__).on_conflict_do_nothing()
+                .returning(TransactionReference.__table__.c.txn_reference),
+                references,
+            )).all())
+            rows = [row for row in rows if row['txn_reference'] in inserted]
+            if not rows:
+                return 0
+
+            customers = (await connection.scalars(
+                pg_insert(Customer.__table__).on_conflict_do_nothing(index_elements=["customer_id"])
+                .returning(Customer.__table__.c.customer_id),
+                [{"customer_id": customer_id} for customer_id in sorted({row['customer_id'] for row in rows})],
+            )).all()
+            if customers:
+                # Billing addresses belong to customers, not to transactions: the ones of
+                # customers that are new on the target are copied along.
+                billing_address = BillingAddress.__table__
+                async with get_engine(move.source).connect() as source:
+                    addresses = (await source.execute(
+                        select(*(column for column in billing_address.c if column.name != "id"))
+                        .where(billing_address.c.customer_id.in_(customers))
+                        .order_by(billing_address.c.id)
+                    )).mappings().all()
+                if addresses:
+                    await connection.execute(BILLING_ADDRESS_UPSERT, [dict(address) for address in addresses])
+
+            payment_detail_ids = await TransactionService.resolve_payment_details(
+                connection,
+                [{column: row[f'payment_detail_{column}'] for column in PAYMENT_DETAIL_COLUMNS} for row in rows],
+                move.target,
+            )
+            await connection.execute(
+                insert(Transaction.__table__),
+                [{**{column: row[column] for column in TRANSACTION_COLUMNS}, "payment_detail_id": payment_detail_id}
+                 for row, payment_detail_id in zip(rows, payment_detail_ids)],
+            )
+
+            totals = {}
+            for row in rows:
+                key = (RebalanceService.utc_day(row['created_at']), row['currency_code'])
+                count, amount = totals.get(key, (0, Decimal(0)))
+                totals[key] = (count + 1, amount + row['txn_amount'])
+            await connection.execute(ROLLUP_INCREMENT, [
+                dict(merchant_id=move.merchant_id, day=day, currency_code=currency_code, txn_count=count,
+                     txn_amount=amount)
+                for (day, currency_code), (count, amount) in sorted(totals.items())
+            ])
+        return len(rows)
+
+    @staticmethod
+    async def _copy_archived_rollups(move: MerchantMove):
+        # Days before the oldest attached partition get no more transactions on any shard.
+        partitions = await PartitionService.list_partitions(move.source)
+        rollup = MerchantDailyRollup.__table__
+        query = select(rollup).where(rollup.c.merchant_id == move.merchant_id)
+        if partitions:
+            query = query.where(rollup.c.day < min(partitions.values()))
+        async with get_engine(move.source).connect() as connection:
+            rows = (await connection.execute(query)).mappings().all()
+        if not rows:
+            return 0
+
+        upsert = pg_insert(rollup)
+        async with get_engine(move.target).begin() as connection:
+            await connection.execute(
+                upsert.on_conflict_do_update(
+                    constraint=ROLLUP_CONSTRAINT,
+                    set_={"txn_count": upsert.excluded.txn_count, "txn_amount": upsert.excluded.txn_amount},
+                ),
+                [dict(row) for row in rows],
+            )
+        return len(rows)
@@ -0,0 +1,171 @@
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+
+from sqlalchemy import Date, cast, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from configs.config import logger
+from db.ORMmodels import MerchantDailyRollup, ROLLUP_CONSTRAINT, Transaction
+from db.database import async_session_factory, precompiled, read_only_session, shards
+from validation import RequestModel
+
+# The UTC day of the current database transaction, which is also the day of the `created_at`
+# default of the transactions written by it.
+CURRENT_DAY = cast(func.timezone("UTC", func.now()), Date)
+
+
+@dataclass
+class ReconcileResult:
+    checked: int = 0
+    fixed: list[tuple] = field(default_factory=list)
+    orphans: list[tuple] = field(default_factory=list)
+
+
+class RollupService:
+    @staticmethod
+    def increments(requests: list[RequestModel]):
+        """
+        Aggregates requests into rollup increments, one per (merchant, currency).
+
+        Args:
+            requests (list[RequestModel]): The requests that are being stored.
+
+        Returns:
+            list[dict]: Column values of the increments, sorted by key so that concurrent
+            writers lock the rollup rows in the same order.
+        """
+        totals = {}
+        for request in requests:
+            key = (request.merchant.merchantID, request.transaction.currencyCode)
+            count, amount = totals.get(key, (0, Decimal(0)))
+            totals[key] = (count + 1, amount + Decimal(str(request.transaction.txnAmount)))
+        return [
+            dict(merchant_id=merchant_id, currency_code=currency_code, txn_count=count, txn_amount=amount)
+            for (merchant_id, currency_code), (count, amount) in sorted(totals.items())
+        ]
+
+    @staticmethod
+    def upsert_statement(current_day: bool = True):
+        """
+        Builds `INSERT ... ON CONFLICT DO UPDATE` adding increments to the rollups of the current day.
+
+        Args:
+            current_day (bool): False to take the day from the parameters instead.
+
+        Returns:
+            Insert: The statement, to execute with the values of `increments`.
+        """
+        table = MerchantDailyRollup.__table__
+        insert = pg_insert(table)
+        if current_day:
+            insert = insert.values(day=CURRENT_DAY)
+        return insert.on_conflict_do_update(
+            constraint=ROLLUP_CONSTRAINT,
+            set_={
+                "txn_count": table.c.txn_count + insert.excluded.txn_count,
+                "txn_amount": table.c.txn_amount + insert.excluded.txn_amount,
+            },
+        )
+
+    @staticmethod
+    async def add(executor, requests: list[RequestModel]):
+        """
+        Adds the transactions of requests to the rollups, inside the caller's database transaction.
+        The rollup rows stay locked until it commits, so call this as late as possible.
+
+        Args:
+            executor (AsyncSession | AsyncConnection): Where the statement is executed.
+            requests (list[RequestModel]): The requests that are being stored.
+        """
+        increments = RollupService.increments(requests)
+        if increments:
+            await executor.execute(ROLLUP_UPSERT, increments)
+
+    @staticmethod
+    async def daily(merchant_id: str, date_from: date, date_to: date):
+        """
+        Returns the daily rollups of a merchant. The cost depends on the number of days, not
+        on the number of transactions.
+
+        Args:
+            merchant_id (str): The merchant.
+            date_from (date): The first day.
+            date_to (date): The day after the last one.
+
+        Returns:
+            list[MerchantDailyRollup]: The rollups by day and currency.
+        """
+        query = (
+            select(MerchantDailyRollup)
+            .where(MerchantDailyRollup.merchant_id == merchant_id,
+                   MerchantDailyRollup.day >= date_from,
+                   MerchantDailyRollup.day < date_to)
+            .order_by(MerchantDailyRollup.day, MerchantDailyRollup.currency_code)
+        )
+        async with read_only_session(shards.shard_for(merchant_id)) as session:
+            return (await session.scalars(query)).all()
+
+    @staticmethod
+    async def reconcile(date_from: date, date_to: date, dry_run: bool = False):
+        """
+        Recomputes the rollups of [date_from, date_to) from `transaction` and overwrites the ones
+        that differ, on every shard. Only the partitions of those days are scanned.
+
+        Days whose transactions are still being written must not be reconciled: an increment
+        committed while the totals are computed would be overwritten. Rollups without
+        transactions are only reported, their partition may have been archived.
+
+        Args:
+            date_from (date): The first day.
+            date_to (date): The day after the last one.
+            dry_run (bool): Only reports the differences.
+
+        Returns:
+            ReconcileResult: The number of checked rollups, the fixed ones and the orphans.
+        """
+        created_day = cast(func.timezone("UTC", Transaction.created_at), Date)
+        actual_query = (
+            select(Transaction.merchant_id, created_day, Transaction.currency_code,
+                   func.count(), func.sum(Transaction.txn_amount))
+            .where(Transaction.created_at >= datetime.combine(date_from, time.min, timezone.utc),
+                   Transaction.created_at < datetime.combine(date_to, time.min, timezone.utc))
+            .group_by(Transaction.merchant_id, created_day, Transaction.currency_code)
+        )
+        stored_query = (
+            select(MerchantDailyRollup.merchant_id, MerchantDailyRollup.day, MerchantDailyRollup.currency_code,
+                   MerchantDailyRollup.txn_count, MerchantDailyRollup.txn_amount)
+            .where(MerchantDailyRollup.day >= date_from, MerchantDailyRollup.day < date_to)
+        )
+
+        result = ReconcileResult()
+        for shard in shards.names:
+            # The primary: a lagging replica would report differences that do not exist.
+            async with async_session_factory(shard) as session:
+                actual = {tuple(row[:3]): tuple(row[3:]) for row in await session.execute(actual_query)}
+                stored = {tuple(row[:3]): tuple(row[3:]) for row in await session.execute(stored_query)}
+                fixed = sorted(key for key, totals in actual.items() if stored.get(key) != totals)
+                result.checked += len(actual)
+                result.fixed.extend(fixed)
+                result.orphans.extend(sorted(key for key in stored if key not in actual))
+
+                if fixed and not dry_run:
+                    insert = pg_insert(MerchantDailyRollup)
+                    await session.execute(
+                        insert.on_conflict_do_update(
+                            constraint=ROLLUP_CONSTRAINT,
+                            set_={"txn_count": insert.excluded.txn_count, "txn_amount": insert.excluded.txn_amount},
+                        ),
+                        [dict(merchant_id=merchant_id, day=day, currency_code=currency_code,
+                              txn_count=actual[merchant_id, day, currency_code][0],
+                              txn_amount=actual[merchant_id, day, currency_code][1])
+                         for merchant_id, day, currency_code in fixed],
+                    )
+                    await session.commit()
+
+        logger.info('Reconciled %d rollups of [%s, %s): %d fixed, %d without transactions.',
+                    result.checked, date_from, date_to, len(result.fixed), len(result.orphans))
+        return result
+
+
+ROLLUP_UPSERT = precompiled(RollupService.upsert_statement(), 'rollup_upsert')
@@ -0,0 +1,52 @@
+import weakref
+from collections import Counter, deque
+
+from sqlalchemy import event
+from sqlalchemy.engine.interfaces import CacheStats
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Number of recently compiled statements kept for inspection.
+RECENT_COMPILATIONS = 20
+
+
+class StatementCacheMetrics:
+    """
+    Counts how the statements executed by instrumented engines were obtained from SQLAlchemy's
+    compiled cache: "hit", "miss" (compiled now), or "uncached" (no cache key or caching
+    disabled). Once every statement shape has been compiled, only hits should grow.
+    """
+
+    def __init__(self):
+        self.lookups = Counter()
+        self.recent_compilations = deque(maxlen=RECENT_COMPILATIONS)
+        # Engines replaced after a fork or disposal drop out by themselves.
+        self._engines = weakref.WeakSet()
+
+    def instrument(self, engine: AsyncEngine):
+        event.listen(engine.sync_engine, "after_cursor_execute", self._after_cursor_execute)
+        self._engines.add(engine)
+
+    def stats(self):
+        """
+        Returns the compiled cache lookups and sizes.
+
+        Returns:
+            dict: Lookups by result, the hit ratio, the number of compiled statements cached by
+            the live engines and the SQL of the latest compilations.
+        """
+        lookups = self.lookups["hit"] + self.lookups["miss"]
+        return {
+            "lookups": {result: self.lookups[result] for result in ("hit", "miss", "uncached")},
+            "hit_ratio": self.lookups["hit"] / lookups if lookups else 0.0,
+            "compiled_cache_size": sum(len(engine.sync_engine._compiled_cache or ()) for engine in self._engines),
+            "recent_compilations": list(self.recent_compilations),
+        }
+
+    def _after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        if context.cache_hit == CacheStats.CACHE_HIT:
+            self.lookups["hit"] += 1
+        elif context.cache_hit == CacheStats.CACHE_MISS:
+            self.lookups["miss"] += 1
+            self.recent_compilations.append(statement)
+        else:
+            self.lookups["uncached"] += 1
@@ -0,0 +1,255 @@
+import asyncio
+import base64
+import binascii
+import heapq
+from datetime import datetime
+
+import orjson
+from sqlalchemy import select, tuple_
+
+from configs.config import logger, settings
+from db.ORMmodels import Transaction
+from db.database import read_only_session, shards
+from response_cache import ResponseCache
+
+# Serialized responses of `get_by_reference`, invalidated by TransactionService after its commits.
+reference_cache = ResponseCache('reference', max_size=settings.RESPONSE_CACHE_SIZE, ttl=settings.RESPONSE_CACHE_TTL_S,
+                                negative_ttl=settings.RESPONSE_CACHE_NEGATIVE_TTL_S)
+
+
+class InvalidCursorError(ValueError):
+    """
+    Raised when a pagination cursor cannot be decoded.
+    """
+
+
+class TransactionQueryService:
+    @staticmethod
+    async def list_by_merchant(merchant_id: str, limit: int, cursor: str | None = None,
+                               created_from: datetime | None = None, created_to: datetime | None = None):
+        """
+        Lists the transactions of a merchant, newest first, using keyset pagination.
+
+        Args:
+            merchant_id (str): The merchant whose transactions are listed.
+            limit (int): The maximum number of transactions to return.
+            cursor (str | None): The `next_cursor` of the previous page, None for the first page.
+            created_from (datetime | None): Only lists transactions created at or after this time.
+            created_to (datetime | None): Only lists transactions created before this time.
+
+        Returns:
+            tuple[list[Transaction], str | None]: The page and the cursor of the next page,
+            None if this is the last page.
+        """
+        return await TransactionQueryService._list_page(Transaction.merchant_id == merchant_id, limit, cursor,
+                                                        created_from, created_to,
+                                                        shard=shards.shard_for(merchant_id))
+
+    @staticmethod
+    async def list_by_customer(customer_id: str, limit: int, cursor: str | None = None,
+                               created_from: datetime | None = None, created_to: datetime | None = None):
+        """
+        Lists the transactions of a customer, newest first, using keyset pagination. A customer
+        may pay merchants on every shard, so with shards the page is merged from all of them,
+        see `_list_sharded_page`.
+
+        Args:
+            customer_id (str): The customer whose transactions are listed.
+            limit (int): The maximum number of transactions to return.
+            cursor (str | None): The `next_cursor` of the previous page, None for the first page.
+            created_from (datetime | None): Only lists transactions created at or after this time.
+            created_to (datetime | None): Only lists transactions created before this time.
+
+        Returns:
+            tuple[list[Transaction], str | None]: The page and the cursor of the next page,
+            None if this is the last page.
+        """
+        condition = Transaction.customer_id == customer_id
+        if shards.ring is not None:
+            return await TransactionQueryService._list_sharded_page(condition, limit, cursor, created_from, created_to)
+        return await TransactionQueryService._list_page(condition, limit, cursor, created_from, created_to)
+
+    @staticmethod
+    async def get_by_reference(txn_reference: str, merchant_id: str | None = None):
+        """
+        Looks up transactions by their txnReference, optionally of a single merchant.
+
+        Args:
+            txn_reference (str): The merchant's transaction reference.
+            merchant_id (str | None): Restricts the lookup to one merchant, where the reference is unique.
+
+        Returns:
+            list[Transaction]: The matching transactions.
+        """
+        query = select(Transaction).where(Transaction.txn_reference == txn_reference)
+        if merchant_id is not None:
+            query = query.where(Transaction.merchant_id == merchant_id)
+            async with read_only_session(shards.shard_for(merchant_id)) as session:
+                return (await session.scalars(query.order_by(Transaction.id.desc()).limit(100))).all()
+
+        pages = await TransactionQueryService.fan_out(query.order_by(Transaction.id.desc()).limit(100))
+        if len(pages) == 1:
+            return pages[0]
+        return sorted((row for page in pages for row in page), key=lambda row: row.created_at, reverse=True)[:100]
+
+    @staticmethod
+    async def fan_out(query, shard_names: list[str | None] | None = None):
+        """
+        Runs a query on every shard concurrently.
+
+        Args:
+            query (Select): The query, or a function of the shard name returning it.
+            shard_names (list[str | None] | None): The shards, all of them if None.
+
+        Returns:
+            list[list]: The rows of every shard, in the order of `shard_names`.
+        """
+        async def fetch(shard: str | None):
+            async with read_only_session(shard) as session:
+                return (await session.scalars(query(shard) if callable(query) else query)).all()
+
+        return await asyncio.gather(*(fetch(shard) for shard in shard_names or shards.names))
+
+    @staticmethod
+    def reference_key(txn_reference: str, merchant_id: str | None = None):
+        """
+        Returns the `reference_cache` key of a reference lookup.
+
+        Args:
+            txn_reference (str): The merchant's transaction reference.
+            merchant_id (str | None): The merchant the lookup is restricted to, if any.
+
+        Returns:
+            str: The key.
+        """
+        return orjson.dumps([txn_reference, merchant_id]).decode()
+
+    @staticmethod
+    def reference_keys(requests):
+        """
+        Returns the `reference_cache` keys whose lookups a write of requests changes: the
+        merchant's lookup and the one across merchants of every reference.
+
+        Args:
+            requests (list[RequestModel]): The stored requests.
+
+        Returns:
+            list[str]: The keys, without duplicates.
+        """
+        keys = {}
+        for request in requests:
+            txn_reference = request.transaction.txnReference
+            keys[TransactionQueryService.reference_key(txn_reference, request.merchant.merchantID)] = None
+            keys[TransactionQueryService.reference_key(txn_reference)] = None
+        return list(keys)
+
+    @staticmethod
+    async def _list_page(condition, limit: int, cursor: str | None, created_from: datetime | None = None,
+                         created_to: datetime | None = None, shard: str | None = None):
+        # WHERE <owner> = :value AND id < :cursor ORDER BY id DESC LIMIT :limit + 1 is served by
+        # the (<owner>, id) index, so every page costs the same regardless of its depth.
+        query = select(Transaction).where(condition)
+        query = TransactionQueryService.created_between(query, created_from, created_to)
+        if cursor is not None:
+            query = query.where(Transaction.id < TransactionQueryService.decode_cursor(cursor))
+        query = query.order_by(Transaction.id.desc()).limit(limit + 1)
+
+        async with read_only_session(shard) as session:
+            rows = (await session.scalars(query)).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = TransactionQueryService.encode_cursor(rows[-1].id)
+        logger.debug('Fetched a page of %d transactions.', len(rows))
+        return rows, next_cursor
+
+    @staticmethod
+    async def _list_sharded_page(condition, limit: int, cursor: str | None, created_from: datetime | None = None,
+                                 created_to: datetime | None = None):
+        # Ids of different shards are not comparable, so every shard that is not exhausted yet
+        # returns its next limit + 1 rows by (created_at, id), and the newest `limit` of all of
+        # them make the page. The cursor holds the (created_at, id) of the last row taken from
+        # every shard that has more rows, None for a shard none of whose rows were taken yet.
+        positions = (TransactionQueryService.decode_shard_cursor(cursor) if cursor is not None
+                     else dict.fromkeys(shards.names))
+
+        def query(shard: str):
+            query = TransactionQueryService.created_between(select(Transaction).where(condition), created_from,
+                                                            created_to)
+            if positions[shard] is not None:
+                query = query.where(tuple_(Transaction.created_at, Transaction.id) < positions[shard])
+            return query.order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(limit + 1)
+
+        names = list(positions)
+        pages = await TransactionQueryService.fan_out(query, names)
+        merged = heapq.merge(*([(shard, row) for row in page] for shard, page in zip(names, pages)),
+                             key=lambda item: (item[1].created_at, item[1].id), reverse=True)
+        rows, taken = [], dict.fromkeys(names, 0)
+        for shard, row in merged:
+            if len(rows) == limit:
+                break
+            rows.append(row)
+            positions[shard] = (row.created_at, row.id)
+            taken[shard] += 1
+
+        remaining = {shard: positions[shard] for shard, page in zip(names, pages) if taken[shard] < len(page)}
+        next_cursor = TransactionQueryService.encode_shard_cursor(remaining) if remaining else None
+        logger.debug('Fetched a page of %d transactions from %d shards.', len(rows), len(names))
+        return rows, next_cursor
+
+    @staticmethod
+    def created_between(query, created_from: datetime | None, created_to: datetime | None):
+        """
+        Restricts a transaction query to a creation time range. The range is on the partition
+        key, so only the monthly partitions that overlap it are scanned.
+
+        Args:
+            query (Select): A query on `transaction`.
+            created_from (datetime | None): Inclusive lower bound, unbounded if None.
+            created_to (datetime | None): Exclusive upper bound, unbounded if None.
+
+        Returns:
+            Select: The restricted query.
+        """
+        if created_from is not None:
+            query = query.where(Transaction.created_at >= created_from)
+        if created_to is not None:
+            query = query.where(Transaction.created_at < created_to)
+        return query
+
+    @staticmethod
+    def encode_cursor(last_id: int):
+        return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str):
+        try:
+            return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        except (binascii.Error, ValueError) as ex:
+            raise InvalidCursorError(cursor) from ex
+
+    @staticmethod
+    def encode_shard_cursor(positions: dict[str, tuple[datetime, int] | None]):
+        return base64.urlsafe_b64encode(orjson.dumps(positions)).decode().rstrip("=")
+
+    @staticmethod
+    def decode_shard_cursor(cursor: str):
+        try:
+            positions = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        except (binascii.Error, ValueError) as ex:
+            raise InvalidCursorError(cursor) from ex
+        # A shard that is no longer configured invalidates the cursor.
+        if not isinstance(positions, dict) or not set(positions) <= set(shards.names):
+            raise InvalidCursorError(cursor)
+        try:
+            return {shard: None if position is None else TransactionQueryService.decode_position(*position)
+                    for shard, position in positions.items()}
+        except (TypeError, ValueError) as ex:
+            raise InvalidCursorError(cursor) from ex
+
+    @staticmethod
+    def decode_position(created_at: str, last_id: int):
+        if not isinstance(last_id, int):
+            raise TypeError(last_id)
+        return datetime.fromisoformat(created_at), last_id
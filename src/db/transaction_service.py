@@ -1,12 +1,93 @@
-from sqlalchemy import select
-from sqlalchemy.exc import DatabaseError
+import asyncio
+import hashlib
+import hmac
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+import orjson
+from sqlalchemy import bindparam, insert, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from configs.config import logger
-from db.ORMmodels import BillingAddress, Customer, Merchant, PaymentDetail, Transaction
-from db.database import async_session_factory
+from configs.config import logger, request_logger, settings
+from db.ORMmodels import (BillingAddress, Customer, Merchant, PaymentDetail, Transaction, TransactionReference,
+                          TXN_REFERENCE_CONSTRAINT)
+from db.database import async_session_factory, get_engine, precompiled, shards
+from db.fingerprint_cache import FingerprintCache
+from db.known_id_cache import KnownIdCache
+from db.rollup_service import RollupService
+from db.transaction_query_service import TransactionQueryService, reference_cache
+from metrics import stage_seconds
 from validation import RequestModel
 
+customer_cache = KnownIdCache('customer', max_size=settings.KNOWN_ID_CACHE_SIZE, ttl=settings.KNOWN_ID_CACHE_TTL_S)
+merchant_cache = KnownIdCache('merchant', max_size=settings.KNOWN_ID_CACHE_SIZE, ttl=settings.KNOWN_ID_CACHE_TTL_S)
+# Fingerprints of stored billing addresses, and of saved payment details with their row id.
+billing_address_cache = KnownIdCache('billing_address', max_size=settings.FINGERPRINT_CACHE_SIZE,
+                                     ttl=settings.FINGERPRINT_CACHE_TTL_S)
+payment_detail_cache = FingerprintCache('payment_detail', max_size=settings.FINGERPRINT_CACHE_SIZE,
+                                        ttl=settings.FINGERPRINT_CACHE_TTL_S)
+
+# Keeps the (merchant_id, txn_reference) IN list well below asyncpg's bind parameter limit.
+DUPLICATE_LOOKUP_CHUNK = 5000
+
+# Statements of the write paths, built once and executed with their values as parameters, so
+# that a request neither rebuilds them nor compiles them again, see `db.database.precompiled`.
+CUSTOMER_BY_ID = select(Customer).where(Customer.customer_id == bindparam("customer_id"))
+MERCHANT_BY_ID = select(Merchant).where(Merchant.merchant_id == bindparam("merchant_id"))
+CUSTOMER_UPSERT = precompiled(
+    pg_insert(Customer.__table__).on_conflict_do_nothing(index_elements=["customer_id"]), 'customer_upsert'
+)
+MERCHANT_UPSERT = precompiled(
+    pg_insert(Merchant.__table__).on_conflict_do_nothing(index_elements=["merchant_id"]), 'merchant_upsert'
+)
+BILLING_ADDRESS_UPSERT = precompiled(
+    pg_insert(BillingAddress.__table__).on_conflict_do_nothing(index_elements=["fingerprint"]),
+    'billing_address_upsert',
+)
+PAYMENT_DETAIL_UPSERT = precompiled(
+    pg_insert(PaymentDetail.__table__).on_conflict_do_nothing(index_elements=["fingerprint"])
+    .returning(PaymentDetail.__table__.c.fingerprint, PaymentDetail.__table__.c.id),
+    'payment_detail_upsert',
+)
+PAYMENT_DETAIL_INSERT = insert(PaymentDetail).returning(PaymentDetail.id, sort_by_parameter_order=True)
+# Shapes of the core insert statement, see `TransactionService.core_insert_statement`.
+core_statements = {}
+
+
+def scoped(shard: str | None, key: str):
+    """
+    Returns the key of a row in the id and fingerprint caches. Every shard stores its own
+    customers, merchants, billing addresses and payment details, so their keys are cached per shard.
+    """
+    return key if shard is None else f'{shard}:{key}'
+
+
+class DuplicateTransactionError(Exception):
+    """
+    Raised when a transaction with the same (merchant_id, txnReference) is already stored.
+    """
+
+
+class TransactionInsertError(Exception):
+    """
+    Raised when transactions cannot be stored for another reason than a duplicate. The database
+    error is its cause.
+    """
+
+
+@dataclass
+class InsertManyResult:
+    rows: int
+    elapsed: float
+    skipped: list[int] = field(default_factory=list)
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
 
 class TransactionService:
     @staticmethod
@@ -20,30 +101,430 @@ class TransactionService:
         Returns:
             None.
         """
-        logger.info('Starting transaction insertion process.')
+        if settings.INSERT_ENGINE == "core":
+            await TransactionService.insert_transaction_core(request)
+            return
+
+        request_logger.info('Starting transaction insertion process.')
+        shard = shards.shard_for(request.merchant.merchantID)
+        try:
+            async with async_session_factory(shard) as session:
+                request_logger.info('Created new database session.')
+                payment_detail_id = await TransactionService.add_transaction(session, request, shard)
+
+                with stage_seconds.time("commit"):
+                    await session.commit()
+                request_logger.info('Information was successfully committed to the database.')
+
+        except Exception as e:
+            await session.rollback()
+            if TransactionService.is_duplicate_error(e):
+                logger.info('Transaction is already stored, rolled back the duplicate.')
+                raise DuplicateTransactionError(request.transaction.txnReference) from e
+
+            logger.exception('An error occurred while inserting the transaction. Rolled back.')
+            await customer_cache.discard(scoped(shard, request.merchant.customerID))
+            await merchant_cache.discard(scoped(shard, request.merchant.merchantID))
+            await TransactionService.forget_fingerprints([request], shard)
+
+            raise TransactionInsertError("Transaction insertion failed.") from e
+
+        await customer_cache.add(scoped(shard, request.merchant.customerID))
+        await merchant_cache.add(scoped(shard, request.merchant.merchantID))
+        await TransactionService.remember_fingerprints([request], [payment_detail_id], shard)
+        await reference_cache.invalidate(*TransactionQueryService.reference_keys([request]))
+
+    @staticmethod
+    async def insert_transaction_core(request: RequestModel):
+        """
+        Inserts a transaction and its related records with a single SQLAlchemy Core statement
+        (chained `INSERT ... RETURNING` CTEs) executed in autocommit mode, i.e. one round trip
+        and no ORM unit of work. Selected with `INSERT_ENGINE=core`.
+
+        Args:
+            request (RequestModel): An object containing transaction data and related information.
+        Returns:
+            None.
+        """
+        request_logger.info('Starting core transaction insertion.')
+        shard = shards.shard_for(request.merchant.merchantID)
+        payment_detail_id = None
         try:
-            async with async_session_factory() as session:
-                logger.info('Created new database session.')
-                await TransactionService.process_customer(session, request)
-                await TransactionService.process_merchant(session, request)
+            async with get_engine(shard).connect() as connection:
+                connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+                payment_detail = TransactionService.payment_detail_values(request)
+                if payment_detail['fingerprint'] is not None:
+                    # A saved card is resolved first, so that the statement only references its id.
+                    payment_detail_id = (await TransactionService.resolve_payment_details(
+                        connection, [payment_detail], shard))[0]
+                query, parameters = await TransactionService.core_insert_statement(request, payment_detail_id, shard)
+                with stage_seconds.time("core_statement"):
+                    await connection.execute(query, parameters)
+                request_logger.info('Transaction was inserted with a single statement.')
+
+        except Exception as e:
+            if TransactionService.is_duplicate_error(e):
+                logger.info('Transaction is already stored, the duplicate was not inserted.')
+                raise DuplicateTransactionError(request.transaction.txnReference) from e
+
+            logger.exception('An error occurred while inserting the transaction with the core engine.')
+            await customer_cache.discard(scoped(shard, request.merchant.customerID))
+            await merchant_cache.discard(scoped(shard, request.merchant.merchantID))
+            await TransactionService.forget_fingerprints([request], shard)
+
+            raise TransactionInsertError("Transaction insertion failed.") from e
+
+        await customer_cache.add(scoped(shard, request.merchant.customerID))
+        await merchant_cache.add(scoped(shard, request.merchant.merchantID))
+        await TransactionService.remember_fingerprints([request], [payment_detail_id], shard)
+        await reference_cache.invalidate(*TransactionQueryService.reference_keys([request]))
+
+    @staticmethod
+    async def core_insert_statement(request: RequestModel, payment_detail_id: int | None = None,
+                                    shard: str | None = None):
+        """
+        Builds the single statement that writes the whole record graph of a request:
+
+            WITH customer_upsert AS (INSERT ... ON CONFLICT DO NOTHING),
+                 merchant_upsert AS (INSERT ... ON CONFLICT DO NOTHING),
+                 billing_address_insert AS (INSERT ...),
+                 payment_detail_insert AS (INSERT ... RETURNING id),
+                 reference_insert AS (INSERT INTO transaction_reference ...),
+                 rollup_upsert AS (INSERT INTO merchant_daily_rollup ... ON CONFLICT DO UPDATE)
+            INSERT INTO transaction (...) SELECT ..., payment_detail_insert.id FROM payment_detail_insert
+
+        The customer and merchant upserts are left out when their ids are known from the cache.
+        A fingerprinted billing address is upserted with `ON CONFLICT DO NOTHING`, or left out
+        when its fingerprint is cached, and the payment detail insert is left out when the id
+        of the (saved) payment detail is given.
+        Values are named parameters, so each of the few statement shapes is built and compiled once.
+
+        Args:
+            request (RequestModel): An object containing transaction data and related information.
+            payment_detail_id (int | None): The id of an already stored payment detail.
+            shard (str | None): The shard the statement is executed on.
+
+        Returns:
+            tuple[StatementLambdaElement, dict]: The statement and its parameters.
+        """
+        rows = {}
+        if not await customer_cache.contains(scoped(shard, request.merchant.customerID)):
+            rows['customer'] = dict(customer_id=request.merchant.customerID)
+        if not await merchant_cache.contains(scoped(shard, request.merchant.merchantID)):
+            rows['merchant'] = dict(merchant_id=request.merchant.merchantID)
+        billing_address = TransactionService.billing_address_values(request)
+        if billing_address['fingerprint'] is None or not await billing_address_cache.contains(
+                scoped(shard, billing_address['fingerprint'])):
+            rows['billing_address'] = billing_address
+        transaction = TransactionService.transaction_values(request, payment_detail_id)
+        if payment_detail_id is None:
+            rows['payment_detail'] = TransactionService.payment_detail_values(request)
+            del transaction['payment_detail_id']
+        rows['transaction_reference'] = TransactionService.reference_values(request)
+        rows['merchant_daily_rollup'] = RollupService.increments([request])[0]
+        rows['transaction'] = transaction
+
+        shape = (billing_address['fingerprint'] is not None, *((table, *values) for table, values in rows.items()))
+        query = core_statements.get(shape)
+        if query is None:
+            query = core_statements[shape] = TransactionService.build_core_statement(shape)
+        parameters = {f'{table}_{column}': value for table, values in rows.items() for column, value in values.items()}
+        return query, parameters
+
+    @staticmethod
+    def build_core_statement(shape: tuple):
+        """
+        Builds a shape of the core insert statement, whose values are bindparams named
+        `<table>_<column>`.
+
+        Args:
+            shape (tuple): Whether the billing address is upserted, then the name and the
+            columns of every table that is written, the transaction last.
+
+        Returns:
+            StatementLambdaElement: The statement.
+        """
+        upsert_billing_address, *written = shape
+        columns = {table: names for table, *names in written}
+        tables = {name: table for name, table in Transaction.metadata.tables.items() if name in columns}
+
+        def bound(name: str):
+            table = tables[name]
+            return {column: bindparam(f'{name}_{column}', type_=table.c[column].type) for column in columns[name]}
+
+        ctes = []
+        if 'customer' in columns:
+            ctes.append(
+                pg_insert(tables['customer']).values(**bound('customer'))
+                .on_conflict_do_nothing(index_elements=['customer_id'])
+                .cte('customer_upsert')
+            )
+        if 'merchant' in columns:
+            ctes.append(
+                pg_insert(tables['merchant']).values(**bound('merchant'))
+                .on_conflict_do_nothing(index_elements=['merchant_id'])
+                .cte('merchant_upsert')
+            )
+        if 'billing_address' in columns:
+            billing_address = pg_insert(tables['billing_address']).values(**bound('billing_address'))
+            if upsert_billing_address:
+                billing_address = billing_address.on_conflict_do_nothing(index_elements=['fingerprint'])
+            ctes.append(billing_address.cte('billing_address_insert'))
+        ctes.append(
+            insert(tables['transaction_reference']).values(**bound('transaction_reference'))
+            .cte('reference_insert')
+        )
+        ctes.append(
+            RollupService.upsert_statement().values(**bound('merchant_daily_rollup'))
+            .cte('rollup_upsert')
+        )
+
+        values = bound('transaction')
+        literals = [value.label(name) for name, value in values.items()]
+        if 'payment_detail' not in columns:
+            query = insert(tables['transaction']).from_select(list(values), select(*literals)).add_cte(*ctes)
+        else:
+            payment_detail = (
+                insert(tables['payment_detail']).values(**bound('payment_detail'))
+                .returning(tables['payment_detail'].c.id)
+                .cte('payment_detail_insert')
+            )
+            query = (
+                insert(tables['transaction'])
+                .from_select([*values, 'payment_detail_id'], select(*literals, payment_detail.c.id))
+                .add_cte(*ctes, payment_detail)
+            )
+        return precompiled(query, f'core_insert{shape}')
+
+    @staticmethod
+    async def insert_many(requests: list[RequestModel], use_copy: bool = False):
+        """
+        Inserts many transactions in one database transaction using a few bulk statements
+        instead of one ORM unit of work per request.
 
-                await TransactionService.create_billing_address(session, request)
-                payment_detail = await TransactionService.create_payment_detail(session, request)
+        Customers and merchants are upserted with multi-row `INSERT ... ON CONFLICT DO NOTHING`,
+        payment details are inserted with a multi-row `INSERT ... RETURNING id` to resolve the
+        transaction foreign keys, and billing addresses and transactions are written with
+        multi-row inserts or, with `use_copy`, asyncpg's binary `copy_records_to_table`.
+        Fingerprinted billing addresses and saved payment details are upserted instead, see
+        `resolve_payment_details`.
 
-                # Perform a flush to the database to get the payment detail id
-                await session.flush()
-                logger.info('Added records to session and flushed.')
+        The merchant rollups are incremented with one upsert per (merchant, currency).
+        Shared rows (customers, merchants, fingerprints, references, rollups) are written in key
+        order, so that concurrent batches wait for each other instead of deadlocking.
 
-                await TransactionService.create_transaction(session, request, payment_detail)
+        Requests whose (merchant_id, txnReference) is already stored, or repeated within the
+        batch, are skipped and reported in `InsertManyResult.skipped`.
 
+        With shards, the requests of every shard are inserted concurrently in a database
+        transaction of their own. If one of them fails, the others may have committed; inserting
+        the batch again skips their requests as duplicates.
+
+        Args:
+            requests (list[RequestModel]): The transaction requests to persist.
+            use_copy (bool): Whether to write billing addresses and transactions with COPY.
+        Returns:
+            InsertManyResult: The number of inserted transactions, the indexes of skipped
+            duplicates and the achieved throughput.
+        """
+        logger.info('Starting bulk insertion of %d transactions.', len(requests))
+        started = time.perf_counter()
+        groups = {}
+        for index, request in enumerate(requests):
+            groups.setdefault(shards.shard_for(request.merchant.merchantID), []).append(index)
+        if len(groups) <= 1:
+            result = await TransactionService._insert_shard(next(iter(groups), shards.names[0]), requests, use_copy)
+        else:
+            results = await asyncio.gather(
+                *(TransactionService._insert_shard(shard, [requests[index] for index in indexes], use_copy)
+                  for shard, indexes in groups.items()),
+                return_exceptions=True,
+            )
+            errors = [error for error in results if isinstance(error, Exception)]
+            if errors:
+                # A lost race for a reference is retried by the callers, so it is reported first.
+                raise next((error for error in errors if isinstance(error, DuplicateTransactionError)), errors[0])
+            result = InsertManyResult(
+                rows=sum(result.rows for result in results), elapsed=0.0,
+                skipped=sorted(indexes[index] for indexes, result in zip(groups.values(), results)
+                               for index in result.skipped),
+            )
+        result.elapsed = time.perf_counter() - started
+        logger.info('Bulk inserted %d transactions in %.3fs (%.0f rows/s), skipped %d duplicates.',
+                    result.rows, result.elapsed, result.rows_per_second, len(result.skipped))
+        return result
+
+    @staticmethod
+    async def _insert_shard(shard: str | None, requests: list[RequestModel], use_copy: bool):
+        """
+        Inserts the requests of a shard in one database transaction, see `insert_many`.
+        """
+        customer_ids = sorted({request.merchant.customerID for request in requests})
+        merchant_ids = sorted({request.merchant.merchantID for request in requests})
+        try:
+            async with async_session_factory(shard) as session:
+                requests, skipped = await TransactionService.filter_duplicates(session, requests)
+                new_customer_ids = [
+                    customer_id for customer_id in customer_ids
+                    if not await customer_cache.contains(scoped(shard, customer_id))
+                ]
+                new_merchant_ids = [
+                    merchant_id for merchant_id in merchant_ids
+                    if not await merchant_cache.contains(scoped(shard, merchant_id))
+                ]
+                if new_customer_ids:
+                    await session.execute(CUSTOMER_UPSERT,
+                                          [{"customer_id": customer_id} for customer_id in new_customer_ids])
+                if new_merchant_ids:
+                    await session.execute(MERCHANT_UPSERT,
+                                          [{"merchant_id": merchant_id} for merchant_id in new_merchant_ids])
+
+                billing_addresses, fingerprinted_addresses = [], {}
+                for request in requests:
+                    values = TransactionService.billing_address_values(request)
+                    if values['fingerprint'] is None:
+                        billing_addresses.append(values)
+                    elif (values['fingerprint'] not in fingerprinted_addresses
+                          and not await billing_address_cache.contains(scoped(shard, values['fingerprint']))):
+                        fingerprinted_addresses[values['fingerprint']] = values
+                if fingerprinted_addresses:
+                    await session.execute(BILLING_ADDRESS_UPSERT,
+                                          [fingerprinted_addresses[key] for key in sorted(fingerprinted_addresses)])
+                payment_detail_ids = []
+                if requests:
+                    payment_detail_ids = await TransactionService.resolve_payment_details(
+                        session, [TransactionService.payment_detail_values(request) for request in requests], shard
+                    )
+                transactions = [
+                    TransactionService.transaction_values(request, payment_detail_id)
+                    for request, payment_detail_id in zip(requests, payment_detail_ids)
+                ]
+                if requests:
+                    # Fails the batch if a concurrent writer stored one of its references meanwhile.
+                    await session.execute(
+                        insert(TransactionReference),
+                        sorted((TransactionService.reference_values(request) for request in requests),
+                               key=lambda values: (values['merchant_id'], values['txn_reference'])),
+                    )
+
+                if use_copy:
+                    await TransactionService._copy_rows(session, BillingAddress, billing_addresses)
+                    await TransactionService._copy_rows(session, Transaction, transactions)
+                elif requests:
+                    if billing_addresses:
+                        await session.execute(insert(BillingAddress), billing_addresses)
+                    await session.execute(insert(Transaction), transactions)
+
+                await RollupService.add(session, requests)
                 await session.commit()
-                logger.info('Information was successfully committed to the database.')
 
         except Exception as e:
-            logger.exception('An error occurred while inserting the transaction. Starting rollback...')
+            logger.exception('An error occurred while bulk inserting transactions. Starting rollback...')
             await session.rollback()
+            await customer_cache.discard(*(scoped(shard, customer_id) for customer_id in customer_ids))
+            await merchant_cache.discard(*(scoped(shard, merchant_id) for merchant_id in merchant_ids))
+            await TransactionService.forget_fingerprints(requests, shard)
+
+            if TransactionService.is_duplicate_error(e):
+                raise DuplicateTransactionError("A concurrent insert stored one of the transactions.") from e
+
+            raise TransactionInsertError("Bulk transaction insertion failed.") from e
+
+        await customer_cache.add(*(scoped(shard, customer_id) for customer_id in customer_ids))
+        await merchant_cache.add(*(scoped(shard, merchant_id) for merchant_id in merchant_ids))
+        await TransactionService.remember_fingerprints(requests, payment_detail_ids, shard)
+        await reference_cache.invalidate(*TransactionQueryService.reference_keys(requests))
+        return InsertManyResult(rows=len(transactions), elapsed=0.0, skipped=skipped)
 
-            raise DatabaseError("Transaction insertion failed.")
+    @staticmethod
+    async def filter_duplicates(session: AsyncSession, requests: list[RequestModel]):
+        """
+        Drops requests whose (merchant_id, txnReference) is already stored or repeated in the batch.
+
+        Args:
+            session (AsyncSession): The database session used to execute the query.
+            requests (list[RequestModel]): The transaction requests to check.
+
+        Returns:
+            tuple[list[RequestModel], list[int]]: The new requests and the indexes of the skipped ones.
+        """
+        keys = [(request.merchant.merchantID, request.transaction.txnReference) for request in requests]
+        unique_keys = list(set(keys))
+        existing = set()
+        for start in range(0, len(unique_keys), DUPLICATE_LOOKUP_CHUNK):
+            query = select(TransactionReference.merchant_id, TransactionReference.txn_reference).where(
+                tuple_(TransactionReference.merchant_id, TransactionReference.txn_reference).in_(
+                    unique_keys[start:start + DUPLICATE_LOOKUP_CHUNK]
+                )
+            )
+            existing.update(tuple(row) for row in await session.execute(query))
+
+        fresh, skipped = [], []
+        for index, (request, key) in enumerate(zip(requests, keys)):
+            if key in existing:
+                skipped.append(index)
+                continue
+            existing.add(key)
+            fresh.append(request)
+        return fresh, skipped
+
+    @staticmethod
+    def is_duplicate_error(error: Exception):
+        """
+        Tells whether a database error is a violation of the (merchant_id, txn_reference) key
+        of the `transaction_reference` registry.
+        """
+        return isinstance(error, IntegrityError) and TXN_REFERENCE_CONSTRAINT in str(error.orig)
+
+    @staticmethod
+    async def _copy_rows(session: AsyncSession, model, rows: list[dict]):
+        """
+        Writes rows with asyncpg's binary COPY inside the session's transaction.
+        """
+        if not rows:
+            return
+        columns = list(rows[0])
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            model.__tablename__,
+            records=[tuple(TransactionService._copy_value(row[column]) for column in columns) for row in rows],
+            columns=columns,
+        )
+
+    @staticmethod
+    def _copy_value(value):
+        # The binary numeric codec does not accept floats.
+        return Decimal(str(value)) if isinstance(value, float) else value
+
+    @staticmethod
+    async def add_transaction(session: AsyncSession, request: RequestModel, shard: str | None = None):
+        """
+        Adds the customer, merchant, billing address, payment detail, transaction and
+        transaction reference records of a request to the session, and the transaction to
+        the merchant's rollup, without committing it.
+
+        Args:
+            session (AsyncSession): The database session used to execute the query.
+            request (RequestModel): An object containing transaction data and related information.
+            shard (str | None): The shard of the session.
+        Returns:
+            int: The id of the transaction's payment detail.
+        """
+        with stage_seconds.time("customer"):
+            await TransactionService.process_customer(session, request, shard)
+        with stage_seconds.time("merchant"):
+            await TransactionService.process_merchant(session, request, shard)
+
+        await TransactionService.create_billing_address(session, request, shard)
+        payment_detail_id = await TransactionService.create_payment_detail(session, request, shard)
+        request_logger.info('Added records to session and flushed.')
+
+        await TransactionService.create_transaction(session, request, payment_detail_id)
+        await TransactionService.create_reference(session, request)
+        with stage_seconds.time("rollup"):
+            await RollupService.add(session, [request])
+        return payment_detail_id
 
     @staticmethod
     async def check_customer(session: AsyncSession, request: RequestModel):
@@ -58,39 +539,36 @@ class TransactionService:
             Customer or None: The `Customer` object if found, otherwise `None`.
         """
         customer_id = request.merchant.customerID
-        logger.debug(f'Checking customer: {customer_id}')
-        query = select(Customer).select_from(Customer).filter_by(customer_id=customer_id)
-        customer = await session.execute(query)
-        result = customer.scalars().first()
+        logger.debug('Checking customer: %s', customer_id)
+        result = (await session.scalars(CUSTOMER_BY_ID, {"customer_id": customer_id})).first()
         if result:
-            logger.debug(f'Customer was found: {customer_id}')
+            logger.debug('Customer was found: %s', customer_id)
             return result
 
-        logger.debug(f"Customer doesn't exist: {customer_id}")
+        logger.debug("Customer doesn't exist: %s", customer_id)
         return None
 
     @staticmethod
-    async def process_customer(session: AsyncSession, request: RequestModel):
+    async def process_customer(session: AsyncSession, request: RequestModel, shard: str | None = None):
         """
-        Processes the customer data by checking if the customer exists in the database.
-        If the customer does not exist, creates a new customer record.
+        Makes sure the customer exists in the database. Customers that are known from the
+        cache cost no round trip, otherwise the customer is inserted with
+        `INSERT ... ON CONFLICT DO NOTHING`, which is also safe for concurrent first requests.
 
         Args:
             session (AsyncSession): The database session used to execute the query.
             request (RequestModel): The request object containing customer information.
+            shard (str | None): The shard of the session.
 
         Returns:
             None.
         """
-        customer = await TransactionService.check_customer(session, request)
-        if customer:
+        customer_id = request.merchant.customerID
+        if await customer_cache.contains(scoped(shard, customer_id)):
             return
 
-        customer = Customer(
-            customer_id=request.merchant.customerID,
-        )
-        logger.debug(f'Created customer: {customer}')
-        session.add(customer)
+        await session.execute(CUSTOMER_UPSERT, {"customer_id": customer_id})
+        logger.debug('Upserted customer: %s', customer_id)
         return
 
     @staticmethod
@@ -106,122 +584,328 @@ class TransactionService:
             Merchant or None: The `Merchant` object if found, otherwise `None`.
         """
         merchant_id = request.merchant.merchantID
-        logger.debug(f'Checking merchant: {merchant_id}')
-        query = select(Merchant).select_from(Merchant).filter_by(merchant_id=merchant_id)
-        merchant = await session.execute(query)
-        result = merchant.scalars().first()
+        logger.debug('Checking merchant: %s', merchant_id)
+        result = (await session.scalars(MERCHANT_BY_ID, {"merchant_id": merchant_id})).first()
         if result:
-            logger.debug(f'Merchant was found: {merchant_id}')
+            logger.debug('Merchant was found: %s', merchant_id)
             return result
 
-        logger.debug(f"Merchant doesn't exist: {merchant_id}")
+        logger.debug("Merchant doesn't exist: %s", merchant_id)
         return None
 
     @staticmethod
-    async def process_merchant(session: AsyncSession, request: RequestModel):
+    async def process_merchant(session: AsyncSession, request: RequestModel, shard: str | None = None):
         """
-        Processes the merchant data by checking if the merchant exists in the database.
-        If the merchant does not exist, creates a new merchant record.
+        Makes sure the merchant exists in the database. Merchants that are known from the
+        cache cost no round trip, otherwise the merchant is inserted with
+        `INSERT ... ON CONFLICT DO NOTHING`, which is also safe for concurrent first requests.
 
         Args:
             session (AsyncSession): The database session used to execute the query.
             request (RequestModel): The request object containing merchant information.
+            shard (str | None): The shard of the session.
 
         Returns:
             None
         """
-        merchant = await TransactionService.check_merchant(session, request)
-        if merchant:
+        merchant_id = request.merchant.merchantID
+        if await merchant_cache.contains(scoped(shard, merchant_id)):
             return
 
-        merchant = Merchant(
-            merchant_id=request.merchant.merchantID,
-        )
-        logger.debug(f'Created merchant: {merchant}')
-        session.add(merchant)
+        await session.execute(MERCHANT_UPSERT, {"merchant_id": merchant_id})
+        logger.debug('Upserted merchant: %s', merchant_id)
         return
 
     @staticmethod
-    async def create_billing_address(session: AsyncSession, request: RequestModel):
+    async def create_billing_address(session: AsyncSession, request: RequestModel, shard: str | None = None):
         """
-        Creates a new billing address record in the database.
+        Creates a new billing address record in the database. A fingerprinted address is
+        upserted, and skipped entirely when its fingerprint is known from the cache.
 
         Args:
             session (AsyncSession): The database session used to execute the query.
             request (RequestModel): The request object containing billing address information.
+            shard (str | None): The shard of the session.
 
         Returns:
             None
         """
-        billing_address = BillingAddress(
-            customer_id=request.merchant.customerID,
-            first_name=request.customer.billingAddress.firstName,
-            last_name=request.customer.billingAddress.lastName,
-            mobile_no=request.customer.billingAddress.mobileNo,
-            email_id=request.customer.billingAddress.emailId,
-            address_line_1=request.customer.billingAddress.addressLine1,
-            city=request.customer.billingAddress.city,
-            state=request.customer.billingAddress.state,
-            zip=request.customer.billingAddress.zip,
-            country=request.customer.billingAddress.country,
-        )
-        logger.debug(f'Created billing address: {billing_address}')
-        session.add(billing_address)
+        values = TransactionService.billing_address_values(request)
+        if values['fingerprint'] is None:
+            billing_address = BillingAddress(**values)
+            logger.debug('Created billing address: %s', billing_address)
+            session.add(billing_address)
+            return
+
+        if await billing_address_cache.contains(scoped(shard, values['fingerprint'])):
+            return
+        await session.execute(BILLING_ADDRESS_UPSERT, values)
+        logger.debug('Upserted billing address: %s', values['fingerprint'])
         return
 
     @staticmethod
-    async def create_payment_detail(session: AsyncSession, request: RequestModel):
+    async def create_payment_detail(session: AsyncSession, request: RequestModel, shard: str | None = None):
         """
-        Creates a new payment detail record in the database.
+        Creates a new payment detail record in the database. A saved card is resolved to
+        its existing row instead, see `resolve_payment_details`.
 
         Args:
             session (AsyncSession): The database session used to execute the query.
             request (RequestModel): The request object containing payment detail information.
+            shard (str | None): The shard of the session.
 
         Returns:
-            PaymentDetail: The created `PaymentDetail` object.
-        """
-        payment_detail = PaymentDetail(
-            card_number=request.transaction.paymentDetail.cardNumber,
-            card_type=request.transaction.paymentDetail.cardType,
-            exp_year=int(request.transaction.paymentDetail.expYear),
-            exp_month=int(request.transaction.paymentDetail.expMonth),
-            name_on_card=request.transaction.paymentDetail.nameOnCard,
-            save_details=request.transaction.paymentDetail.saveDetails == "true",
-            cvv=request.transaction.paymentDetail.cvv
-        )
-        logger.debug(f'Created payment detail: {payment_detail}')
+            int: The id of the payment detail.
+        """
+        values = TransactionService.payment_detail_values(request)
+        if values['fingerprint'] is not None:
+            return (await TransactionService.resolve_payment_details(session, [values], shard))[0]
+
+        payment_detail = PaymentDetail(**values)
+        logger.debug('Created payment detail: %s', payment_detail)
         session.add(payment_detail)
-        return payment_detail
+        # Perform a flush to the database to get the payment detail id
+        with stage_seconds.time("flush"):
+            await session.flush()
+        return payment_detail.id
+
+    @staticmethod
+    async def resolve_payment_details(executor, rows: list[dict], shard: str | None = None):
+        """
+        Returns the ids of payment detail rows, inserting the ones that are not stored yet.
+
+        Fingerprinted rows are looked up in the cache first, the rest are upserted with
+        `INSERT ... ON CONFLICT (fingerprint) DO NOTHING RETURNING`, and the fingerprints
+        that were already stored are then selected. Rows without a fingerprint are always
+        inserted.
+
+        Args:
+            executor (AsyncSession | AsyncConnection): Where the statements are executed.
+            rows (list[dict]): Column values from `payment_detail_values`.
+            shard (str | None): The shard the statements are executed on.
+
+        Returns:
+            list[int]: The payment detail ids, in the order of `rows`.
+        """
+        ids = {}
+        for values in rows:
+            fingerprint = values['fingerprint']
+            if fingerprint is not None and fingerprint not in ids:
+                ids[fingerprint] = await payment_detail_cache.get(scoped(shard, fingerprint))
+
+        missing = {}
+        for values in rows:
+            if values['fingerprint'] is not None and ids[values['fingerprint']] is None:
+                missing.setdefault(values['fingerprint'], values)
+        if missing:
+            inserted = await executor.execute(PAYMENT_DETAIL_UPSERT, [missing[key] for key in sorted(missing)])
+            ids.update(inserted.tuples().all())
+            stored = [fingerprint for fingerprint in missing if ids[fingerprint] is None]
+            if stored:
+                ids.update((await executor.execute(
+                    select(PaymentDetail.fingerprint, PaymentDetail.id).where(PaymentDetail.fingerprint.in_(stored))
+                )).tuples().all())
+
+        plain = [values for values in rows if values['fingerprint'] is None]
+        plain_ids = iter(())
+        if plain:
+            plain_ids = iter((await executor.scalars(PAYMENT_DETAIL_INSERT, plain)).all())
+        return [ids[values['fingerprint']] if values['fingerprint'] is not None else next(plain_ids)
+                for values in rows]
+
+    @staticmethod
+    async def remember_fingerprints(requests: list[RequestModel], payment_detail_ids: list[int],
+                                    shard: str | None = None):
+        """
+        Adds the fingerprints of committed billing addresses and saved payment details to the caches.
+
+        Args:
+            requests (list[RequestModel]): The stored requests.
+            payment_detail_ids (list[int]): Their payment detail ids, in the same order.
+            shard (str | None): The shard they were stored on.
+        """
+        billing_fingerprints = set()
+        payment_details = {}
+        for request, payment_detail_id in zip(requests, payment_detail_ids):
+            billing_fingerprint = TransactionService.billing_address_values(request)['fingerprint']
+            if billing_fingerprint is not None:
+                billing_fingerprints.add(scoped(shard, billing_fingerprint))
+            payment_fingerprint = TransactionService.payment_detail_values(request)['fingerprint']
+            if payment_fingerprint is not None:
+                payment_details[scoped(shard, payment_fingerprint)] = payment_detail_id
+        await billing_address_cache.add(*billing_fingerprints)
+        await payment_detail_cache.put(payment_details)
+
+    @staticmethod
+    async def forget_fingerprints(requests: list[RequestModel], shard: str | None = None):
+        """
+        Removes the fingerprints of billing addresses and payment details from the caches after a
+        failed write, in case the failure came from a cached row that is no longer stored.
+
+        Args:
+            requests (list[RequestModel]): The requests whose write failed.
+            shard (str | None): The shard they were written to.
+        """
+        billing_fingerprints = set()
+        payment_fingerprints = set()
+        for request in requests:
+            billing_fingerprint = TransactionService.billing_address_values(request)['fingerprint']
+            if billing_fingerprint is not None:
+                billing_fingerprints.add(scoped(shard, billing_fingerprint))
+            payment_fingerprint = TransactionService.payment_detail_values(request)['fingerprint']
+            if payment_fingerprint is not None:
+                payment_fingerprints.add(scoped(shard, payment_fingerprint))
+        await billing_address_cache.discard(*billing_fingerprints)
+        await payment_detail_cache.discard(*payment_fingerprints)
 
     @staticmethod
-    async def create_transaction(session: AsyncSession, request, payment_detail):
+    async def create_transaction(session: AsyncSession, request, payment_detail_id: int):
         """
         Creates a new transaction record in the database.
 
         Args:
             session (AsyncSession): The database session used to execute the query.
             request (RequestModel): The request object containing transaction information.
-            payment_detail (PaymentDetail): The payment detail associated with the transaction.
+            payment_detail_id (int): The id of the payment detail associated with the transaction.
 
         Returns:
             None.
         """
-        transaction = Transaction(
-            txn_amount=request.transaction.txnAmount,
-            payment_type=request.transaction.paymentType,
-            currency_code=request.transaction.currencyCode,
-            txn_reference=request.transaction.txnReference,
-            seriestype=request.transaction.seriestype,
-            method=request.transaction.method,
-            success_url=request.transaction.url.successURL,
-            fail_url=request.transaction.url.failURL,
+        transaction = Transaction(**TransactionService.transaction_values(request, payment_detail_id))
+        logger.debug('Created transaction: %s', transaction)
+        session.add(transaction)
+
+    @staticmethod
+    async def create_reference(session: AsyncSession, request: RequestModel):
+        """
+        Registers the (merchant_id, txn_reference) of a new transaction. The registry's primary
+        key rejects a second transaction with the same reference, which the partitioned
+        `transaction` table cannot do itself.
+
+        Args:
+            session (AsyncSession): The database session used to execute the query.
+            request (RequestModel): The request object containing transaction information.
+
+        Returns:
+            None.
+        """
+        session.add(TransactionReference(**TransactionService.reference_values(request)))
+
+    @staticmethod
+    def billing_address_values(request: RequestModel):
+        """
+        Maps a request onto the column values of a `billing_address` row.
+
+        Args:
+            request (RequestModel): The request object containing billing address information.
+
+        Returns:
+            dict: Column values keyed by attribute name.
+        """
+        billing_address = request.customer.billingAddress
+        values = dict(
+            customer_id=request.merchant.customerID,
+            first_name=billing_address.firstName,
+            last_name=billing_address.lastName,
+            mobile_no=billing_address.mobileNo,
+            email_id=billing_address.emailId,
+            address_line_1=billing_address.addressLine1,
+            city=billing_address.city,
+            state=billing_address.state,
+            zip=billing_address.zip,
+            country=billing_address.country,
+        )
+        values['fingerprint'] = TransactionService.fingerprint(*values.values())
+        return values
+
+    @staticmethod
+    def payment_detail_values(request: RequestModel):
+        """
+        Maps a request onto the column values of a `payment_detail` row.
+
+        Args:
+            request (RequestModel): The request object containing payment detail information.
+
+        Returns:
+            dict: Column values keyed by attribute name.
+        """
+        payment_detail = request.transaction.paymentDetail
+        values = dict(
+            card_number=payment_detail.cardNumber,
+            card_type=payment_detail.cardType,
+            exp_year=int(payment_detail.expYear),
+            exp_month=int(payment_detail.expMonth),
+            name_on_card=payment_detail.nameOnCard,
+            save_details=payment_detail.saveDetails,
+            cvv=payment_detail.cvv
+        )
+        # Only saved cards are shared, a card used once keeps a row of its own.
+        fingerprint = None
+        if payment_detail.saveDetails:
+            fingerprint = TransactionService.fingerprint(request.merchant.customerID, *values.values())
+        values['fingerprint'] = fingerprint
+        return values
+
+    @staticmethod
+    def fingerprint(*values):
+        """
+        Computes the content fingerprint of a row: an HMAC-SHA256 of its values keyed with
+        `FINGERPRINT_KEY`, so that card data cannot be recovered by hashing guesses.
+
+        Args:
+            *values: The column values that identify the row's content.
+
+        Returns:
+            str | None: The hex digest, None when `FINGERPRINT_KEY` is not set and
+            deduplication is off.
+        """
+        if not settings.FINGERPRINT_KEY:
+            return None
+        return hmac.new(settings.FINGERPRINT_KEY.encode(), orjson.dumps(values), hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def transaction_values(request: RequestModel, payment_detail_id: int):
+        """
+        Maps a request onto the column values of a `transaction` row.
+
+        Args:
+            request (RequestModel): The request object containing transaction information.
+            payment_detail_id (int): The id of the payment detail associated with the transaction.
+
+        Returns:
+            dict: Column values keyed by attribute name.
+        """
+        transaction = request.transaction
+        return dict(
+            # Via str, so that the numeric holds the submitted amount and not its binary float expansion.
+            txn_amount=Decimal(str(transaction.txnAmount)),
+            payment_type=transaction.paymentType,
+            currency_code=transaction.currencyCode,
+            txn_reference=transaction.txnReference,
+            seriestype=transaction.seriestype,
+            method=transaction.method,
+            success_url=transaction.url.successURL,
+            fail_url=transaction.url.failURL,
             merchant_id=request.merchant.merchantID,
             customer_id=request.merchant.customerID,
-            payment_detail_id=payment_detail.id
+            payment_detail_id=payment_detail_id
+        )
+
+    @staticmethod
+    def reference_values(request: RequestModel):
+        """
+        Maps a request onto the column values of a `transaction_reference` row.
+
+        Args:
+            request (RequestModel): The request object containing transaction information.
+
+        Returns:
+            dict: Column values keyed by attribute name.
+        """
+        return dict(
+            merchant_id=request.merchant.merchantID,
+            txn_reference=request.transaction.txnReference,
         )
-        logger.debug(f'Created transaction: {transaction}')
-        session.add(transaction)
 
 
     # @staticmethod
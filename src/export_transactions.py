@@ -0,0 +1,55 @@
+import argparse
+import asyncio
+import gzip
+import sys
+from datetime import datetime
+
+from configs.config import logger
+from db.database import dispose_engine
+from db.export_service import ExportStats, TransactionExportService
+
+
+async def export(merchant_id: str, export_format: str, output: str, chunk_rows: int,
+                 created_from: datetime | None = None, created_to: datetime | None = None):
+    """
+    Writes the export of a merchant to a file (gzip-compressed if it ends with .gz) or stdout,
+    optionally restricted to the transactions created in [created_from, created_to).
+
+    Returns:
+        ExportStats: The number of exported rows and the elapsed time.
+    """
+    stats = ExportStats()
+    if output == "-":
+        sink = sys.stdout.buffer
+    elif output.endswith(".gz"):
+        sink = gzip.open(output, "wb")
+    else:
+        sink = open(output, "wb")
+    try:
+        async for chunk in TransactionExportService.stream_export(merchant_id, export_format, chunk_rows, stats,
+                                                                  created_from, created_to):
+            sink.write(chunk)
+    finally:
+        if sink is not sys.stdout.buffer:
+            sink.close()
+        await dispose_engine()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports the transactions of a merchant.")
+    parser.add_argument("merchant_id")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--output", default="-", help="Output file, '-' for stdout, '.gz' suffix to compress.")
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    parser.add_argument("--from", dest="created_from", type=datetime.fromisoformat,
+                        help="Only exports transactions created at or after this ISO time.")
+    parser.add_argument("--to", dest="created_to", type=datetime.fromisoformat,
+                        help="Only exports transactions created before this ISO time.")
+    args = parser.parse_args()
+
+    logger.info('Exporting transactions of merchant %s...', args.merchant_id)
+    stats = asyncio.run(export(args.merchant_id, args.format, args.output, args.chunk_rows,
+                               args.created_from, args.created_to))
+    print(f"Exported {stats.rows} rows in {stats.elapsed:.2f}s ({stats.rows_per_second:.0f} rows/s).",
+          file=sys.stderr)
@@ -0,0 +1,43 @@
+"""
+Production server: gunicorn managing uvicorn workers. Run from src/:
+
+    gunicorn -c gunicorn_conf.py api:app
+
+With WEB_PRELOAD the app is imported once in the master and forked into the workers.
+Importing it opens no connection: every worker creates its database engine on first use
+and its Redis clients in the app lifespan, and the logging thread is restarted after fork.
+Size the database pool per worker, see DB_POOL_SIZE.
+
+Counters of /metrics and /stats are per worker, as is a profiler rate changed at runtime.
+Every /metrics series carries the pid label of its worker, so that the series of different
+workers are told apart rather than mistaken for counter resets.
+"""
+import os
+
+from configs.config import logger, settings
+
+
+def default_workers():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+bind = settings.WEB_BIND
+workers = settings.WEB_WORKERS or default_workers()
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = settings.WEB_PRELOAD
+timeout = settings.WEB_TIMEOUT_S
+graceful_timeout = settings.WEB_GRACEFUL_TIMEOUT_S
+keepalive = settings.WEB_KEEPALIVE_S
+# Restarts a worker after that many requests (with jitter so they do not restart together), 0 never does.
+max_requests = settings.WEB_MAX_REQUESTS
+max_requests_jitter = settings.WEB_MAX_REQUESTS // 10
+
+
+def when_ready(server):
+    logger.info('Serving on %s with %d workers.', bind, workers)
+
+
+def post_fork(server, worker):
+    logger.info('Started worker %d.', worker.pid)
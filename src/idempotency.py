@@ -0,0 +1,122 @@
+import time
+from collections import OrderedDict
+
+import orjson
+from redis import asyncio as aioredis
+
+PENDING = "pending"
+
+
+class IdempotencyStore:
+    """
+    Remembers the response of every (merchant_id, txnReference) submission so that client
+    retries are answered without touching Postgres.
+
+    A submission first `claim`s its key (a short-lived "pending" marker), and `save`s the
+    response once it has been processed. Entries live in Redis when a client is given,
+    so all workers share them, and in a process-local LRU/TTL map otherwise.
+    """
+
+    def __init__(self, ttl: float = 86400.0, pending_ttl: float = 30.0, max_size: int = 100_000,
+                 redis_client: aioredis.Redis | None = None):
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.max_size = max_size
+        self.redis = redis_client
+        self.replays = 0
+
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    async def get(self, merchant_id: str, txn_reference: str):
+        """
+        Looks up a previous submission.
+
+        Args:
+            merchant_id (str): The merchant of the submission.
+            txn_reference (str): The merchant's transaction reference.
+
+        Returns:
+            dict | str | None: The stored response, `PENDING` while the first submission
+            is still being processed, or None if the key is unknown.
+        """
+        key = self._key(merchant_id, txn_reference)
+        if self.redis is not None:
+            value = await self.redis.get(key)
+        else:
+            value = self._local_get(key)
+        if value is None:
+            return None
+        if value == PENDING.encode():
+            return PENDING
+        self.replays += 1
+        return orjson.loads(value)
+
+    async def claim(self, merchant_id: str, txn_reference: str):
+        """
+        Atomically marks a key as being processed.
+
+        Args:
+            merchant_id (str): The merchant of the submission.
+            txn_reference (str): The merchant's transaction reference.
+
+        Returns:
+            bool: True if the caller owns the submission, False if the key already exists.
+        """
+        key = self._key(merchant_id, txn_reference)
+        if self.redis is not None:
+            return bool(await self.redis.set(key, PENDING, nx=True, px=int(self.pending_ttl * 1000)))
+        if self._local_get(key) is not None:
+            return False
+        self._local_set(key, PENDING.encode(), self.pending_ttl)
+        return True
+
+    async def save(self, merchant_id: str, txn_reference: str, response: dict):
+        """
+        Stores the response that replays of this submission should receive.
+
+        Args:
+            merchant_id (str): The merchant of the submission.
+            txn_reference (str): The merchant's transaction reference.
+            response (dict): The response body.
+        """
+        key = self._key(merchant_id, txn_reference)
+        value = orjson.dumps(response)
+        if self.redis is not None:
+            await self.redis.set(key, value, px=int(self.ttl * 1000))
+        else:
+            self._local_set(key, value, self.ttl)
+
+    async def release(self, merchant_id: str, txn_reference: str):
+        """
+        Drops a claim whose processing failed, so that a retry is processed again.
+
+        Args:
+            merchant_id (str): The merchant of the submission.
+            txn_reference (str): The merchant's transaction reference.
+        """
+        key = self._key(merchant_id, txn_reference)
+        if self.redis is not None:
+            await self.redis.delete(key)
+        else:
+            self._entries.pop(key, None)
+
+    @staticmethod
+    def _key(merchant_id: str, txn_reference: str):
+        # Ids may contain ':', so they are encoded as a JSON array rather than joined.
+        return f'idempotency:{orjson.dumps([merchant_id, txn_reference]).decode()}'
+
+    def _local_get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def _local_set(self, key: str, value: bytes, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,177 @@
+import bisect
+import os
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def process_label():
+    """
+    Returns the `pid` label of every series. Each worker process keeps metrics of its own, the
+    label tells their series apart instead of letting one worker's counters replace another's.
+    """
+    return f'pid="{os.getpid()}"'
+
+
+def _format_labels(labelnames: tuple, labels: tuple, extra: str = ""):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labels)]
+    pairs.append(process_label())
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by label values.
+    Not thread-safe: it is only updated from the event loop.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self):
+        for labels, value in self.values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, optionally split by label values. Observing costs one bisect
+    and three additions; cumulative bucket counts are only computed when rendered.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS_S):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels):
+        """
+        Returns a context manager that observes the duration of its block.
+
+        Args:
+            *labels: The label values of the observed series.
+
+        Returns:
+            Timer: The context manager.
+        """
+        return Timer(self, labels)
+
+    def render(self):
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                yield f'{self.name}_bucket{le} {cumulative}'
+            suffix = _format_labels(self.labelnames, labels)
+            yield f'{self.name}_sum{suffix} {total}'
+            yield f'{self.name}_count{suffix} {count}'
+
+
+class Timer:
+    __slots__ = ("histogram", "labels", "started", "elapsed")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.started
+        self.histogram.observe(self.elapsed, *self.labels)
+
+
+class Registry:
+    """
+    The metrics of this process, rendered in the Prometheus text exposition format with
+    the `pid` label of the process.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()):
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS_S):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Renders all registered metrics.
+
+        Returns:
+            str: The exposition text.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def render_sample(name: str, metric_type: str, documentation: str, samples: list[tuple[dict, float]]):
+    """
+    Renders a metric whose values are collected at scrape time (queue depth, pool state...).
+
+    Args:
+        name (str): The metric name.
+        metric_type (str): "gauge" or "counter".
+        documentation (str): The HELP text.
+        samples (list[tuple[dict, float]]): (labels, value) pairs.
+
+    Returns:
+        str: The exposition text.
+    """
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {metric_type}']
+    for labels, value in samples:
+        lines.append(f'{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}')
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+wpp_requests = registry.counter(
+    "wpp_requests_total", "Transactions submitted to /wpp/, by response status.", ("status",))
+wpp_request_errors = registry.counter(
+    "wpp_request_errors_total", "Transactions of /wpp/ that failed with a server error.")
+wpp_request_seconds = registry.histogram(
+    "wpp_request_seconds", "Time spent in the /wpp/ handler, from the read body to the response.")
+wpp_admitted = registry.counter(
+    "wpp_admitted_total", "Submissions accepted by the load shedder.")
+wpp_shed = registry.counter(
+    "wpp_shed_total", "Submissions answered with 429 by the load shedder, by reason.", ("reason",))
+stage_seconds = registry.histogram(
+    "wpp_stage_seconds", "Time spent in each stage of a /wpp/ transaction.", ("stage",))
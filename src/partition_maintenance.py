@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import os
+
+from configs.config import logger, settings
+from db.database import dispose_engine, shards
+from db.partition_service import PartitionService
+
+
+async def maintain(ahead: int, retention: int, archive_dir: str, detach_only: bool, dry_run: bool):
+    """
+    Pre-creates future partitions of `transaction` and retires the expired ones: they are
+    detached and, unless `detach_only`, archived to gzip-compressed CSV and dropped, together
+    with the `transaction_reference` rows of their months. Expired partitions left detached by
+    an earlier run are archived too. A `retention` of 0 or less keeps every partition. With
+    shards, every shard is maintained and archived to a subdirectory of `archive_dir` named after it.
+    """
+    try:
+        for shard in shards.names:
+            where = f" on {shard}" if shard is not None else ""
+            for name in await PartitionService.ensure_partitions(ahead, dry_run, shard):
+                print(f"{'Would create' if dry_run else 'Created'} {name}{where}")
+
+            if retention <= 0:
+                continue
+            directory = os.path.join(archive_dir, shard) if shard is not None else archive_dir
+            expired = await PartitionService.expired_partitions(retention, shard)
+            for name in expired:
+                if dry_run:
+                    print(f"Would {'detach' if detach_only else 'archive'} {name}{where}")
+                    continue
+                await PartitionService.detach_partition(name, shard)
+                if detach_only:
+                    print(f"Detached {name}{where}")
+            if detach_only:
+                continue
+
+            detached = await PartitionService.detached_partitions(shard)
+            archived = []
+            for name in PartitionService.expired(detached, retention):
+                if dry_run:
+                    print(f"Would archive {name}{where}")
+                    continue
+                print(f"Archived {name}{where} to {await PartitionService.archive_table(name, directory, shard)}")
+                archived.append(detached[name])
+            if archived:
+                # References of the archived months: the ones of months still on the shard are kept.
+                remaining = {**await PartitionService.list_partitions(shard),
+                             **await PartitionService.detached_partitions(shard)}
+                before = min([PartitionService.add_months(max(archived), 1), *remaining.values()])
+                deleted = await PartitionService.prune_references(before, shard)
+                print(f"Pruned {deleted} transaction references before {before}{where}")
+    finally:
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Creates future and retires expired transaction partitions.")
+    parser.add_argument("--ahead", type=int, default=settings.PARTITION_PRECREATE_MONTHS,
+                        help="Future months that must have a partition.")
+    parser.add_argument("--retention", type=int, default=settings.PARTITION_RETENTION_MONTHS,
+                        help="Past months to keep besides the current one, 0 keeps everything.")
+    parser.add_argument("--archive-dir", default=settings.PARTITION_ARCHIVE_DIR)
+    parser.add_argument("--detach-only", action="store_true",
+                        help="Leave expired partitions as standalone tables instead of archiving them.")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    logger.info('Starting partition maintenance...')
+    asyncio.run(maintain(args.ahead, args.retention, args.archive_dir, args.detach_only, args.dry_run))
@@ -0,0 +1,156 @@
+import asyncio
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from configs.config import logger, settings
+
+
+class StackSampler:
+    """
+    Statistical profiler of the event loop thread.
+
+    While at least one task is registered with `add`, a background thread wakes up every
+    `interval` seconds and, if the loop is running one of those tasks at that moment,
+    records the loop thread's stack. Stacks are counted in the collapsed
+    ("frame;frame;frame count") format of flamegraph.pl and speedscope, in `windows`
+    rolling windows of `window` seconds each. With no registered task the thread sleeps on
+    an event, so nothing is paid when no request is profiled.
+    """
+
+    def __init__(self, interval: float = 0.005, window: float = 60.0, windows: int = 10, max_depth: int = 128):
+        self.interval = interval
+        self.window = window
+        self.max_depth = max_depth
+        self.samples = 0
+
+        self._windows: deque[tuple[float, Counter]] = deque(maxlen=windows)
+        self._targets: set[asyncio.Task] = set()
+        self._active = threading.Event()
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._thread: threading.Thread | None = None
+
+    def add(self, task: asyncio.Task):
+        """
+        Starts sampling a task. Must be called from the event loop thread.
+
+        Args:
+            task (asyncio.Task): The task that serves the profiled request.
+        """
+        # A thread started before a fork does not exist in the child.
+        if self._thread is None or not self._thread.is_alive():
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread_id = threading.get_ident()
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+            logger.info('Stack sampler started, sampling every %.1fms.', self.interval * 1000)
+        self._targets.add(task)
+        self._active.set()
+
+    def discard(self, task: asyncio.Task):
+        """
+        Stops sampling a task.
+
+        Args:
+            task (asyncio.Task): A task passed to `add`.
+        """
+        self._targets.discard(task)
+        if not self._targets:
+            self._active.clear()
+
+    def collapsed(self, last_seconds: float | None = None):
+        """
+        Aggregates the recorded windows into collapsed stacks.
+
+        Args:
+            last_seconds (float | None): Only aggregates windows that started within this many
+                seconds, all kept windows if None.
+
+        Returns:
+            str: One "frame;frame;frame count" line per distinct stack, most frequent first.
+        """
+        since = time.monotonic() - last_seconds if last_seconds is not None else float("-inf")
+        total = Counter()
+        with self._lock:
+            for started, stacks in self._windows:
+                if started >= since - self.window:
+                    total.update(stacks)
+        return "".join(f'{stack} {count}\n' for stack, count in total.most_common())
+
+    def reset(self):
+        """
+        Drops all recorded samples.
+        """
+        with self._lock:
+            self._windows.clear()
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            # current_task() only reads the loop's running-task slot, it is safe from this thread.
+            task = asyncio.current_task(self._loop)
+            if task is None or task not in self._targets:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._record(self._fold(frame))
+
+    def _fold(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _record(self, stack: str):
+        now = time.monotonic()
+        with self._lock:
+            if not self._windows or now - self._windows[-1][0] >= self.window:
+                self._windows.append((now, Counter()))
+            self._windows[-1][1][stack] += 1
+            self.samples += 1
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that registers `PROFILER_SAMPLE_RATE` of the requests, and every request
+    that carries the `PROFILER_TRIGGER_HEADER` header, with a `StackSampler`. When
+    `PROFILER_TOKEN` is set, the trigger header must carry it.
+
+    The rate is read on every request, so it can be changed at runtime (see admin_router).
+    """
+
+    def __init__(self, app, sampler: StackSampler):
+        self.app = app
+        self.sampler = sampler
+        self.header = settings.PROFILER_TRIGGER_HEADER.lower().encode()
+        self.token = settings.PROFILER_TOKEN.encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        task = asyncio.current_task()
+        self.sampler.add(task)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.sampler.discard(task)
+
+    def _should_profile(self, scope):
+        rate = settings.PROFILER_SAMPLE_RATE
+        if rate and random.random() < rate:
+            return True
+        for name, value in scope["headers"]:
+            if name == self.header:
+                return not self.token or hmac.compare_digest(value, self.token)
+        return False
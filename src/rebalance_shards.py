@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from configs.config import logger
+from db.database import dispose_engine
+from db.rebalance_service import COPY_CHUNK, RebalanceError, RebalanceService
+
+
+async def rebalance(action: str, targets: dict[str, str], merchant_ids: list[str], chunk_size: int):
+    """
+    Plans, copies or prunes the merchants that move from the current DB_SHARDS (of the
+    environment) to `targets`, see `RebalanceService` for the order of the steps.
+    """
+    failed = 0
+    try:
+        moves = await RebalanceService.plan(targets)
+        if merchant_ids:
+            moves = [move for move in moves if move.merchant_id in merchant_ids]
+        for move in moves:
+            if action == "plan":
+                print(f"{move.merchant_id}: {move.source or 'primary'} -> {move.target}")
+            elif action == "copy":
+                result = await RebalanceService.copy_merchant(move, chunk_size)
+                print(f"Copied {move.merchant_id} to {move.target}: {result.copied} transactions, "
+                      f"{result.already_copied} already copied.")
+            else:
+                try:
+                    deleted = await RebalanceService.prune_merchant(move)
+                except RebalanceError as ex:
+                    failed += 1
+                    print(ex, file=sys.stderr)
+                else:
+                    print(f"Pruned {move.merchant_id} from {move.source or 'primary'}: {deleted} transactions.")
+    finally:
+        await dispose_engine()
+
+    print(f"{len(moves)} merchants move" + (f", {failed} could not be pruned." if failed else "."), file=sys.stderr)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Moves merchants to the shards of a new DB_SHARDS.")
+    parser.add_argument("action", choices=["plan", "copy", "prune"],
+                        help="plan: list the moves; copy: copy the moving merchants, again after deploying the "
+                             "new DB_SHARDS; prune: delete them from their previous shards.")
+    parser.add_argument("--to", dest="targets", type=json.loads, required=True,
+                        help='The new DB_SHARDS, e.g. \'{"s0": "db-0", "s1": "db-1", "s2": "db-2"}\'.')
+    parser.add_argument("--merchant", dest="merchant_ids", action="append", default=[],
+                        help="Only this merchant, can be repeated.")
+    parser.add_argument("--chunk-size", type=int, default=COPY_CHUNK,
+                        help="Transactions copied per database transaction.")
+    args = parser.parse_args()
+
+    logger.info('Rebalancing shards (%s)...', args.action)
+    sys.exit(1 if asyncio.run(rebalance(args.action, args.targets, args.merchant_ids, args.chunk_size)) else 0)
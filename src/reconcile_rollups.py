@@ -0,0 +1,39 @@
+import argparse
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+from configs.config import logger
+from db.database import dispose_engine
+from db.rollup_service import RollupService
+
+
+async def reconcile(date_from: date, date_to: date, dry_run: bool):
+    """
+    Recomputes the merchant rollups of [date_from, date_to) from the transactions and
+    fixes the ones that drifted.
+    """
+    try:
+        result = await RollupService.reconcile(date_from, date_to, dry_run)
+    finally:
+        await dispose_engine()
+
+    for merchant_id, day, currency_code in result.fixed:
+        print(f"{'Would fix' if dry_run else 'Fixed'} {merchant_id} {day} {currency_code}")
+    for merchant_id, day, currency_code in result.orphans:
+        print(f"No transactions for {merchant_id} {day} {currency_code}")
+    print(f"Checked {result.checked} rollups, {len(result.fixed)} differed.")
+
+
+if __name__ == "__main__":
+    today = datetime.now(timezone.utc).date()
+    parser = argparse.ArgumentParser(description="Reconciles the merchant daily rollups with the transactions.")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, default=today - timedelta(days=7),
+                        help="First UTC day, a week ago by default.")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, default=today,
+                        help="Day after the last one. Defaults to today, which is still being written and "
+                             "should not be reconciled.")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    logger.info('Reconciling merchant rollups...')
+    asyncio.run(reconcile(args.date_from, args.date_to, args.dry_run))
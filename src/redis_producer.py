@@ -0,0 +1,209 @@
+import asyncio
+import time
+from dataclasses import dataclass, asdict
+
+from redis import asyncio as aioredis
+
+from configs.config import logger
+
+
+@dataclass
+class ProducerStats:
+    pushes: int = 0
+    flushes: int = 0
+    failed_flushes: int = 0
+    trimmed: int = 0
+    max_batch_size: int = 0
+    flush_time_total: float = 0.0
+    flush_time_max: float = 0.0
+    push_latency_total: float = 0.0
+    push_latency_max: float = 0.0
+
+    def as_dict(self) -> dict:
+        """
+        Returns the raw counters together with derived averages.
+
+        Returns:
+            dict: Counters, average batch size and average/max latencies in milliseconds.
+        """
+        data = asdict(self)
+        data["avg_batch_size"] = self.pushes / self.flushes if self.flushes else 0.0
+        data["avg_flush_ms"] = self.flush_time_total / self.flushes * 1000 if self.flushes else 0.0
+        data["max_flush_ms"] = self.flush_time_max * 1000
+        data["avg_push_latency_ms"] = self.push_latency_total / self.pushes * 1000 if self.pushes else 0.0
+        data["max_push_latency_ms"] = self.push_latency_max * 1000
+        return data
+
+
+class RedisProducer:
+    """
+    Asyncio Redis producer that gathers pushes from concurrent requests into
+    pipelined micro-batches.
+
+    A batch is flushed as one non-transactional pipeline when it reaches `max_batch`
+    items or `flush_interval` seconds after its first item, whichever comes first.
+    Each `push` call resolves once its batch has been written to Redis.
+
+    With `max_len`, every list pushed to is trimmed to its newest `max_len` items in the
+    same pipeline. The dropped items are counted in `stats.trimmed` and logged, so only
+    bound lists whose oldest items may be lost this way.
+
+    The connection pool is only created by `start` (or the first push of a producer that
+    is not started), so that every worker process gets a pool of its own.
+    """
+
+    def __init__(self, url: str, max_batch: int = 256, flush_interval: float = 0.002, max_connections: int = 32,
+                 max_len: int = 0):
+        self.url = url
+        self.max_len = max_len
+        self.max_connections = max_connections
+        self._pool: aioredis.ConnectionPool | None = None
+        self.client: aioredis.Redis | None = None
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.stats = ProducerStats()
+
+        self._pending: list[tuple[str, bytes | str, float, asyncio.Future]] = []
+        self._batch_ready: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    async def start(self):
+        """
+        Connects and starts the background flush loop. Must be called from the running event loop.
+        """
+        if self._task is not None:
+            return
+        self.connect()
+        self._stopping = False
+        self._batch_ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info('Redis producer started.')
+
+    async def stop(self):
+        """
+        Stops the flush loop, flushes whatever is still pending and closes the pool.
+        The loop is not cancelled but let finish its current flush, so that no push is left waiting.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._batch_ready.set()
+            await self._task
+            self._task = None
+            # Later pushes (e.g. from shutdown paths) are flushed inline, as by a producer never started.
+            self._batch_ready = None
+        await self.flush()
+        if self.client is not None:
+            await self.client.aclose()
+            await self._pool.disconnect()
+            self.client = self._pool = None
+        logger.info('Redis producer stopped.')
+
+    def connect(self):
+        """
+        Creates the connection pool and client unless they exist (or were injected).
+
+        Returns:
+            aioredis.Redis: The client.
+        """
+        if self.client is None:
+            self._pool = aioredis.ConnectionPool.from_url(self.url, max_connections=self.max_connections)
+            self.client = aioredis.Redis(connection_pool=self._pool)
+        return self.client
+
+    async def push(self, key: str, value: bytes | str):
+        """
+        Queues an RPUSH of `value` onto `key` and waits until its batch is flushed.
+
+        Args:
+            key (str): The Redis list to push to.
+            value (bytes | str): The payload.
+
+        Returns:
+            int: The length of the list after the push.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((key, value, time.perf_counter(), future))
+        if self._batch_ready is None:
+            # Not started (e.g. scripts): flush inline so the push is never lost.
+            await self.flush()
+        elif len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+            self._batch_ready.set()
+        return await future
+
+    async def flush(self):
+        """
+        Writes all pending pushes to Redis in a single pipeline and resolves their futures.
+        """
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        self.connect()
+
+        started = time.perf_counter()
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key, value, _, _ in batch:
+                    pipe.rpush(key, value)
+                if self.max_len:
+                    for key in {key for key, _, _, _ in batch}:
+                        pipe.ltrim(key, -self.max_len, -1)
+                results = await pipe.execute()
+        except Exception as ex:
+            self.stats.failed_flushes += 1
+            logger.exception('Failed to flush %d pushes to redis.', len(batch))
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(ex)
+            return
+        except asyncio.CancelledError:
+            # The batch is no longer pending: its pushes must not wait for a flush that never comes.
+            for _, _, _, future in batch:
+                future.cancel()
+            raise
+
+        finished = time.perf_counter()
+        self._record_flush(batch, started, finished)
+        if self.max_len:
+            self._record_trim(batch, results)
+        for (_, _, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _record_flush(self, batch, started: float, finished: float):
+        stats = self.stats
+        flush_time = finished - started
+        stats.flushes += 1
+        stats.pushes += len(batch)
+        stats.max_batch_size = max(stats.max_batch_size, len(batch))
+        stats.flush_time_total += flush_time
+        stats.flush_time_max = max(stats.flush_time_max, flush_time)
+        for _, _, enqueued, _ in batch:
+            latency = finished - enqueued
+            stats.push_latency_total += latency
+            stats.push_latency_max = max(stats.push_latency_max, latency)
+
+    def _record_trim(self, batch, results):
+        # Each RPUSH replies the length of its list; the last one of a key is the length trimmed.
+        lengths = {key: length for (key, _, _, _), length in zip(batch, results)}
+        for key, length in lengths.items():
+            if length > self.max_len:
+                self.stats.trimmed += length - self.max_len
+                logger.warning('Trimmed %d oldest items of %s to keep %d.', length - self.max_len, key, self.max_len)
+
+    async def _run(self):
+        while not self._stopping:
+            await self._batch_ready.wait()
+            if len(self._pending) < self.max_batch and not self._stopping:
+                # Give concurrent requests a few milliseconds to join the batch.
+                try:
+                    await asyncio.wait_for(self._wait_for_full_batch(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    async def _wait_for_full_batch(self):
+        while len(self._pending) < self.max_batch:
+            self._batch_ready.clear()
+            await self._batch_ready.wait()
@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+
+from pydantic import ValidationError
+from redis import asyncio as aioredis
+
+from configs.config import logger, settings
+from container import redis_producer, shutdown, startup, transaction_service
+from db.transaction_service import DuplicateTransactionError
+from validation import RequestModel
+
+# Seconds between two progress lines.
+PROGRESS_INTERVAL_S = 10.0
+# Attempts of a batch that lost a race for a reference, before it is replayed record by record.
+BATCH_ATTEMPTS = 3
+
+
+class ReplayAborted(Exception):
+    """
+    Raised when every record of a batch failed, which points at the database rather than
+    at the records. The batch is not checkpointed, so the next run starts over from it.
+    """
+
+
+@dataclass
+class ReplayStats:
+    read: int = 0
+    stored: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+
+    def add(self, other: "ReplayStats"):
+        self.read += other.read
+        self.stored += other.stored
+        self.duplicates += other.duplicates
+        self.invalid += other.invalid
+        self.failed += other.failed
+
+    @property
+    def records_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+def validate_payloads(payloads: list[bytes]):
+    """
+    Validates raw payloads, in a process of the pool.
+
+    Args:
+        payloads (list[bytes]): Raw payloads of the queue.
+
+    Returns:
+        tuple[list[tuple[int, RequestModel]], list[int]]: The valid requests with their index
+        in `payloads`, and the indexes of the invalid payloads.
+    """
+    valid, invalid = [], []
+    for index, payload in enumerate(payloads):
+        try:
+            valid.append((index, RequestModel.model_validate_json(payload)))
+        except ValidationError:
+            invalid.append(index)
+    return valid, invalid
+
+
+class QueueReplayer:
+    """
+    Re-ingests the payloads of a Redis list, e.g. the requests queue whose database inserts failed.
+
+    The list is read by index in batches of `batch_size`. Batches are validated in a process
+    pool and persisted with `insert_many`, up to `concurrency` at a time. Payloads whose
+    (merchantID, txnReference) is already stored are counted as duplicates and skipped, so a
+    list can be replayed any number of times. Invalid payloads and records that cannot be
+    stored are pushed to the dead-letter list.
+
+    After every batch, the index below which all batches are done is written to the checkpoint
+    file, and a run resumes from there. Batches past it that were done before an interruption
+    are replayed again and found to be duplicates; their dead letters may be pushed twice.
+    """
+
+    def __init__(self, client: aioredis.Redis, source: str, dead_letter_key: str, checkpoint_path: str,
+                 executor: Executor, batch_size: int = settings.WORKER_BATCH_SIZE,
+                 concurrency: int = settings.DB_POOL_SIZE):
+        self.client = client
+        self.source = source
+        self.dead_letter_key = dead_letter_key
+        self.checkpoint_path = checkpoint_path
+        self.executor = executor
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+        self.stats = ReplayStats()
+        self.next_index = 0
+        self._done: dict[int, int] = {}
+        self._logged_at = 0.0
+
+    def load_checkpoint(self):
+        """
+        Resumes from the checkpoint file if it belongs to the source list.
+
+        Returns:
+            int: The index to start from.
+        """
+        try:
+            with open(self.checkpoint_path) as file:
+                checkpoint = json.load(file)
+        except FileNotFoundError:
+            return 0
+        if checkpoint["source"] != self.source:
+            raise SystemExit(f'{self.checkpoint_path} is the checkpoint of {checkpoint["source"]}, '
+                             f'not of {self.source}.')
+        self.next_index = checkpoint["next_index"]
+        logger.info('Resuming the replay of %s at index %d.', self.source, self.next_index)
+        return self.next_index
+
+    def save_checkpoint(self):
+        # Written aside and renamed, so that an interruption never leaves a truncated file.
+        temporary = f'{self.checkpoint_path}.tmp'
+        with open(temporary, "w") as file:
+            json.dump({"source": self.source, "next_index": self.next_index}, file)
+        os.replace(temporary, self.checkpoint_path)
+
+    async def run(self):
+        """
+        Replays the source list from the checkpoint to its current end.
+
+        Returns:
+            ReplayStats: The counts of this run.
+        """
+        started = time.perf_counter()
+        index = self.load_checkpoint()
+        pending = set()
+        try:
+            while True:
+                if len(pending) >= self.concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    self._complete(done)
+                payloads = await self.client.lrange(self.source, index, index + self.batch_size - 1)
+                if not payloads:
+                    break
+                pending.add(asyncio.create_task(self.replay_batch(index, payloads)))
+                index += len(payloads)
+            if pending:
+                done, pending = await asyncio.wait(pending)
+                self._complete(done)
+        finally:
+            for task in pending:
+                task.cancel()
+            self.stats.elapsed = time.perf_counter() - started
+        return self.stats
+
+    async def replay_batch(self, start: int, payloads: list[bytes]):
+        """
+        Validates and persists a batch, then dead-letters the payloads that could not be stored.
+
+        Args:
+            start (int): The index of the first payload in the source list.
+            payloads (list[bytes]): The payloads.
+
+        Returns:
+            tuple[int, int, ReplayStats]: The index range [start, end) of the batch and its counts.
+        """
+        valid, invalid = await asyncio.get_running_loop().run_in_executor(self.executor, validate_payloads, payloads)
+        stats = ReplayStats(read=len(payloads), invalid=len(invalid))
+        dead = [payloads[index] for index in invalid]
+
+        if valid:
+            requests = [request for _, request in valid]
+            try:
+                result = await self._insert_many(requests)
+            except Exception:
+                logger.warning('Batch at index %d failed, replaying its %d records one by one.', start, len(valid))
+                await self._replay_one_by_one(start, payloads, valid, stats, dead)
+            else:
+                stats.stored += result.rows
+                stats.duplicates += len(result.skipped)
+
+        if dead:
+            await self.client.rpush(self.dead_letter_key, *dead)
+        return start, start + len(payloads), stats
+
+    @staticmethod
+    async def _insert_many(requests: list[RequestModel]):
+        # A concurrent batch may have stored one of the references first: it is skipped by the next attempt.
+        for _ in range(BATCH_ATTEMPTS - 1):
+            try:
+                return await transaction_service.insert_many(requests)
+            except DuplicateTransactionError:
+                pass
+        return await transaction_service.insert_many(requests)
+
+    async def _replay_one_by_one(self, start: int, payloads: list[bytes], valid: list, stats: ReplayStats,
+                                 dead: list[bytes]):
+        for index, request in valid:
+            try:
+                await transaction_service.insert_transaction(request)
+            except DuplicateTransactionError:
+                stats.duplicates += 1
+            except Exception:
+                stats.failed += 1
+                dead.append(payloads[index])
+            else:
+                stats.stored += 1
+        if len(valid) > 1 and stats.failed == len(valid):
+            raise ReplayAborted(f'All {len(valid)} records of the batch at index {start} failed.')
+
+    def _complete(self, done: set[asyncio.Task]):
+        for task in done:
+            start, end, stats = task.result()
+            self._done[start] = end
+            self.stats.add(stats)
+        while self.next_index in self._done:
+            self.next_index = self._done.pop(self.next_index)
+        self.save_checkpoint()
+
+        now = time.monotonic()
+        if now - self._logged_at >= PROGRESS_INTERVAL_S:
+            self._logged_at = now
+            logger.info('Replayed %s up to index %d: %d stored, %d duplicates, %d invalid, %d failed.',
+                        self.source, self.next_index, self.stats.stored, self.stats.duplicates,
+                        self.stats.invalid, self.stats.failed)
+
+
+async def snapshot(client: aioredis.Redis, queue: str):
+    """
+    Moves the queue aside for a drain, unless a previous drain is still unfinished. New
+    requests keep being pushed to a fresh queue meanwhile.
+
+    Returns:
+        str | None: The list to replay, None if there is nothing to replay.
+    """
+    replay_key = f'{queue}:replay'
+    if await client.exists(replay_key):
+        logger.info('Continuing the unfinished drain of %s.', replay_key)
+        return replay_key
+    if not await client.exists(queue):
+        return None
+    await client.rename(queue, replay_key)
+    return replay_key
+
+
+async def replay(mode: str, queue: str, checkpoint_path: str, processes: int, batch_size: int, concurrency: int):
+    """
+    Replays the requests queue. `drain` replays a snapshot of it and deletes the snapshot when
+    done, `scan` replays it in place and leaves it untouched; scanning again later continues
+    with the payloads pushed since. Trimming the list (REQUESTS_QUEUE_MAXLEN, sync mode) or consuming it
+    (write-behind workers) during a scan shifts its indexes, so drain a live queue instead.
+    """
+    await startup()
+    client = redis_producer.client
+    try:
+        source = await snapshot(client, queue) if mode == "drain" else queue
+        if source is None:
+            print(f"{queue} is empty.", file=sys.stderr)
+            return
+
+        # Spawned, so that the children do not inherit the event loop and the pools.
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+            replayer = QueueReplayer(client, source, f'{queue}:dead', checkpoint_path, executor,
+                                     batch_size=batch_size, concurrency=concurrency)
+            stats = await replayer.run()
+
+        if mode == "drain":
+            await client.delete(source)
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+    finally:
+        await shutdown()
+
+    print(f"Replayed {stats.read} payloads in {stats.elapsed:.2f}s ({stats.records_per_second:.0f}/s): "
+          f"{stats.stored} stored, {stats.duplicates} duplicates, {stats.invalid} invalid, {stats.failed} failed.",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-ingests the payloads of the requests queue.")
+    parser.add_argument("mode", choices=["drain", "scan"],
+                        help="drain: replay and delete a snapshot of the queue; scan: replay it in place.")
+    parser.add_argument("--queue", default=settings.REQUESTS_QUEUE)
+    parser.add_argument("--checkpoint", default="replay_checkpoint.json",
+                        help="Progress file, the run resumes from it.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Processes validating payloads.")
+    parser.add_argument("--batch-size", type=int, default=settings.WORKER_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=settings.DB_POOL_SIZE,
+                        help="Batches persisted at a time, at most DB_POOL_SIZE + DB_MAX_OVERFLOW.")
+    args = parser.parse_args()
+
+    logger.info('Replaying %s (%s)...', args.queue, args.mode)
+    asyncio.run(replay(args.mode, args.queue, args.checkpoint, args.processes, args.batch_size, args.concurrency))
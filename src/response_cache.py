@@ -0,0 +1,229 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+import orjson
+from redis import asyncio as aioredis
+from redis.exceptions import WatchError
+
+from configs.config import logger
+
+
+class ResponseCache:
+    """
+    Two-tier cache of serialized responses: a per-process LRU/TTL map in front of Redis
+    string keys shared by all workers.
+
+    Concurrent misses of a key are single-flighted: one caller loads the value, the others
+    wait for its result. `invalidate` drops keys from Redis and publishes them, so that
+    every worker running `listen` drops them from its local map too. A load that was
+    running when its key was invalidated is returned to its callers but not stored: locally
+    because the invalidation drops it from the in-flight loads, in Redis because `invalidate`
+    increments a version of the key that the load reads first and checks when it stores.
+
+    Empty values (e.g. "not found") are kept for `negative_ttl` seconds only.
+    """
+
+    def __init__(self, name: str, max_size: int = 10_000, ttl: float = 300.0, negative_ttl: float = 2.0,
+                 redis_client: aioredis.Redis | None = None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.redis = redis_client
+        self.channel = f'response:{name}:invalidations'
+
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._listener: asyncio.Task | None = None
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[bytes]]):
+        """
+        Returns the cached value of a key, loading and caching it on a miss.
+
+        Args:
+            key (str): The cache key.
+            loader (Callable[[], Awaitable[bytes]]): Produces the value, empty for a negative result.
+
+        Returns:
+            bytes: The value.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._load(key, loader, future)
+        except Exception as ex:
+            future.set_exception(ex)
+            # Marks the exception as retrieved when nobody else waits for it.
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def invalidate(self, *keys: str):
+        """
+        Drops keys from this process, from Redis and, through the invalidation channel,
+        from the other workers.
+
+        Args:
+            *keys (str): The keys whose values changed.
+        """
+        if not keys:
+            return
+        self._drop(keys)
+        self.invalidations += len(keys)
+        if self.redis is None:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    # Outlives any load that could have read the previous version.
+                    pipe.incr(self._version_key(key))
+                    pipe.pexpire(self._version_key(key), int(self.ttl * 1000))
+                pipe.delete(*(self._redis_key(key) for key in keys))
+                pipe.publish(self.channel, orjson.dumps(keys))
+                await pipe.execute()
+        except Exception:
+            logger.warning('Could not invalidate %d keys of the %s cache in redis.', len(keys), self.name,
+                           exc_info=True)
+
+    async def listen(self):
+        """
+        Drops the keys published by `invalidate` in any process from the local map, until cancelled.
+        """
+        while True:
+            try:
+                async with self.redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        self._drop(orjson.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Entries invalidated meanwhile are missed, so the local map is dropped as a whole.
+                logger.warning('Lost the invalidation channel of the %s cache, resubscribing.', self.name,
+                               exc_info=True)
+                self._entries.clear()
+                await asyncio.sleep(1.0)
+
+    async def start(self):
+        """
+        Starts `listen` in the background when the cache is backed by Redis.
+        """
+        if self.redis is not None and self._listener is None:
+            self._listener = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    def stats(self):
+        """
+        Returns lookup counters and the hit ratio.
+
+        Returns:
+            dict: Size, hits (local and Redis), misses, coalesced misses, invalidations and hit ratio.
+        """
+        lookups = self.hits + self.redis_hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hit_ratio": (self.hits + self.redis_hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[bytes]], future: asyncio.Future):
+        version = None
+        versioned = self.redis is not None
+        if self.redis is not None:
+            try:
+                value, version = await self.redis.mget(self._redis_key(key), self._version_key(key))
+            except Exception:
+                logger.warning('Could not read the %s cache from redis.', self.name, exc_info=True)
+                # Without the version the load cannot tell whether it is stale when storing it.
+                value, versioned = None, False
+            if value is not None:
+                self.redis_hits += 1
+                if self._inflight.get(key) is future:
+                    self._remember(key, value, self._ttl(value))
+                return value
+
+        self.misses += 1
+        value = await loader()
+        if self._inflight.get(key) is not future:
+            # Invalidated while loading.
+            return value
+        ttl = self._ttl(value)
+        if versioned and not await self._store(key, value, ttl, version):
+            return value
+        self._remember(key, value, ttl)
+        return value
+
+    async def _store(self, key: str, value: bytes, ttl: float, version: bytes | None):
+        # Another worker may have invalidated the key after this load read the database: the
+        # value is only stored if the version read before loading is still the current one.
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(self._version_key(key))
+                if await pipe.get(self._version_key(key)) != version:
+                    return False
+                pipe.multi()
+                pipe.set(self._redis_key(key), value, px=int(ttl * 1000))
+                await pipe.execute()
+        except WatchError:
+            return False
+        except Exception:
+            logger.warning('Could not write the %s cache to redis.', self.name, exc_info=True)
+        return True
+
+    def _ttl(self, value: bytes):
+        return self.ttl if value else self.negative_ttl
+
+    def _redis_key(self, key: str):
+        return f'response:{self.name}:{key}'
+
+    def _version_key(self, key: str):
+        return f'response:{self.name}:{key}:version'
+
+    def _remember(self, key: str, value: bytes, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _drop(self, keys):
+        for key in keys:
+            self._entries.pop(key, None)
+            self._inflight.pop(key, None)
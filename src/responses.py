@@ -0,0 +1,18 @@
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    Streaming response whose body is produced while the request body is still being read.
+
+    `StreamingResponse` listens for client disconnects by consuming `receive()`, which would
+    swallow the request body chunks the iterator reads through `Request.stream()`. Here the
+    iterator owns `receive()`; a disconnect surfaces as `ClientDisconnect` from the stream.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+
+        if self.background is not None:
+            await self.background()
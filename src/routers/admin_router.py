@@ -0,0 +1,60 @@
+import hmac
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+
+from configs.config import logger, settings
+from container import profiler
+
+router = APIRouter(
+    prefix="/admin"
+)
+
+
+async def verify_token(request: Request):
+    """
+    Rejects the request unless it carries `PROFILER_TOKEN` in the `PROFILER_TRIGGER_HEADER` header.
+    Without a `PROFILER_TOKEN` the admin endpoints are not served at all.
+    """
+    if not settings.PROFILER_TOKEN:
+        raise HTTPException(status_code=404)
+    token = request.headers.get(settings.PROFILER_TRIGGER_HEADER, "")
+    if not hmac.compare_digest(token.encode(), settings.PROFILER_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid profiler token")
+
+
+@router.get("/profile", response_class=PlainTextResponse, dependencies=[Depends(verify_token)])
+async def get_profile(seconds: float | None = Query(None, gt=0), reset: bool = False):
+    """
+    Returns the stacks sampled from profiled requests in the collapsed format, ready for
+    flamegraph.pl or speedscope.
+
+    Args:
+        seconds (float | None): Only includes the rolling windows of the last `seconds`, all kept windows if omitted.
+        reset (bool): Drops the samples after reading them.
+
+    Returns:
+        PlainTextResponse: One "frame;frame;frame count" line per distinct stack.
+    """
+    collapsed = profiler.collapsed(seconds)
+    if reset:
+        profiler.reset()
+    return PlainTextResponse(collapsed)
+
+
+@router.put("/profile/rate", dependencies=[Depends(verify_token)])
+async def set_profile_rate(rate: float = Query(..., ge=0, le=1)):
+    """
+    Changes the fraction of requests that are profiled, without a restart. Only the worker
+    process that handles the request is changed, the response names it.
+
+    Args:
+        rate (float): The new `PROFILER_SAMPLE_RATE`, 0 profiles only triggered requests.
+
+    Returns:
+        dict: The rate in effect, the pid of the changed worker and the number of samples it took so far.
+    """
+    settings.PROFILER_SAMPLE_RATE = rate
+    logger.warning('Profiler sample rate was set to %s in worker %d.', rate, os.getpid())
+    return {"rate": rate, "pid": os.getpid(), "samples": profiler.samples}
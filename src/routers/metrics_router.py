@@ -0,0 +1,120 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from configs.config import logger, settings
+from container import idempotency_store, load_shedder, redis_producer
+from db.database import get_engine, replicas, shards, statement_metrics
+from db.transaction_query_service import reference_cache
+from db.transaction_service import billing_address_cache, customer_cache, merchant_cache, payment_detail_cache
+from metrics import process_label, registry, render_sample
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Exports the request and stage metrics of this process, the depth of the requests queue
+    the load shedder state and the pool, producer and cache statistics in the Prometheus text format.
+    Every series carries the `pid` label of the worker process that served the scrape.
+
+    Returns:
+        PlainTextResponse: The exposition text.
+    """
+    parts = [registry.render()]
+
+    try:
+        async with redis_producer.client.pipeline(transaction=False) as pipe:
+            pipe.llen(settings.REQUESTS_QUEUE)
+            pipe.llen(f'{settings.REQUESTS_QUEUE}:dead')
+            queued, dead = await pipe.execute()
+    except Exception:
+        logger.warning('Could not read the queue depth from redis.', exc_info=True)
+    else:
+        parts.append(render_sample("requests_queue_depth", "gauge", "Payloads waiting in the requests queue.",
+                                   [({"queue": settings.REQUESTS_QUEUE}, queued)]))
+        parts.append(render_sample("requests_queue_dead_letters", "gauge", "Payloads in the dead-letter list.",
+                                   [({"queue": settings.REQUESTS_QUEUE}, dead)]))
+
+    parts.append(render_sample("backpressure_shedding", "gauge", "Whether submissions are shed, by reason.",
+                               [({"reason": reason}, int(shedding))
+                                for reason, shedding in load_shedder.shedding.items()]))
+    parts.append(render_sample("backpressure_insert_latency_seconds", "gauge",
+                               "Moving average of the insert latency watched by the load shedder.",
+                               [({}, load_shedder.latency)]))
+
+    statements = statement_metrics.stats()
+    parts.append(render_sample("db_compiled_cache_lookups_total", "counter",
+                               "Executed statements by compiled cache lookup result.",
+                               [({"result": result}, count) for result, count in statements["lookups"].items()]))
+    parts.append(render_sample("db_compiled_cache_size", "gauge", "Statements in the compiled cache.",
+                               [({}, statements["compiled_cache_size"])]))
+
+    pool = get_engine().pool.stats()
+    parts.append(render_sample("db_pool_checked_out", "gauge", "Connections checked out of the pool.",
+                               [({}, pool["checked_out"])]))
+    parts.append(render_sample("db_pool_overflow", "gauge", "Overflow connections of the pool.",
+                               [({}, pool["overflow"])]))
+    parts.append(render_sample("db_pool_waiters", "gauge", "Checkouts waiting for a connection.",
+                               [({}, pool["waiters"])]))
+    parts.append(render_sample("db_pool_timeouts_total", "counter", "Checkouts that timed out.",
+                               [({}, pool["timeouts"])]))
+    # The pool histogram is kept in milliseconds, Prometheus expects seconds.
+    lines = ['# HELP db_pool_checkout_wait_seconds Time spent waiting for a pool connection.',
+             '# TYPE db_pool_checkout_wait_seconds histogram']
+    pid = process_label()
+    for bound, count in pool["wait_ms_histogram"].items():
+        le = bound if bound == "+Inf" else str(int(bound) / 1000)
+        lines.append(f'db_pool_checkout_wait_seconds_bucket{{{pid},le="{le}"}} {count}')
+    lines.append(f'db_pool_checkout_wait_seconds_sum{{{pid}}} {pool["avg_wait_ms"] * pool["checkouts"] / 1000}')
+    lines.append(f'db_pool_checkout_wait_seconds_count{{{pid}}} {pool["checkouts"]}')
+    parts.append("\n".join(lines) + "\n")
+
+    if replicas.engines:
+        parts.append(render_sample("db_replica_healthy", "gauge", "Whether a read replica is in rotation.",
+                                   [({"replica": str(index)}, int(healthy))
+                                    for index, healthy in enumerate(replicas.healthy)]))
+        parts.append(render_sample("db_replica_lag_seconds", "gauge", "Replication lag of the read replicas.",
+                                   [({"replica": str(index)}, lag)
+                                    for index, lag in enumerate(replicas.lag) if lag is not None]))
+        parts.append(render_sample("db_replica_reads_total", "counter", "Read sessions opened on a replica.",
+                                   [({"replica": str(index)}, reads) for index, reads in enumerate(replicas.reads)]))
+    parts.append(render_sample("db_replica_fallbacks_total", "counter",
+                               "Read sessions that fell back to the primary.", [({}, replicas.fallbacks)]))
+    shard_pools = shards.stats()
+    if shard_pools:
+        parts.append(render_sample("db_shard_pool_checked_out", "gauge", "Connections checked out of the shard pools.",
+                                   [({"shard": name}, pool["checked_out"]) for name, pool in shard_pools.items()]))
+        parts.append(render_sample("db_shard_pool_waiters", "gauge", "Checkouts waiting for a shard connection.",
+                                   [({"shard": name}, pool["waiters"]) for name, pool in shard_pools.items()]))
+
+    producer = redis_producer.stats
+    parts.append(render_sample("redis_producer_pushes_total", "counter", "Pushes flushed to redis.",
+                               [({}, producer.pushes)]))
+    parts.append(render_sample("redis_producer_flushes_total", "counter", "Pipelines flushed to redis.",
+                               [({"result": "ok"}, producer.flushes), ({"result": "failed"}, producer.failed_flushes)]))
+    parts.append(render_sample("redis_producer_trimmed_total", "counter",
+                               "Oldest items dropped by trimming the bounded lists.", [({}, producer.trimmed)]))
+
+    cache_lookups = []
+    caches = (("customer", customer_cache), ("merchant", merchant_cache),
+              ("billing_address", billing_address_cache), ("payment_detail", payment_detail_cache))
+    for name, cache in caches:
+        cache_lookups += [({"cache": name, "result": "hit"}, cache.hits),
+                          ({"cache": name, "result": "redis_hit"}, cache.redis_hits),
+                          ({"cache": name, "result": "miss"}, cache.misses)]
+    parts.append(render_sample("known_id_cache_lookups_total", "counter", "Lookups of the known id and fingerprint caches.",
+                               cache_lookups))
+    parts.append(render_sample("response_cache_lookups_total", "counter", "Lookups of the reference response cache.",
+                               [({"result": "hit"}, reference_cache.hits),
+                                ({"result": "redis_hit"}, reference_cache.redis_hits),
+                                ({"result": "miss"}, reference_cache.misses),
+                                ({"result": "coalesced"}, reference_cache.coalesced)]))
+    parts.append(render_sample("response_cache_invalidations_total", "counter",
+                               "Keys of the reference response cache invalidated by writes.",
+                               [({}, reference_cache.invalidations)]))
+    parts.append(render_sample("idempotency_replays_total", "counter",
+                               "Submissions answered from the idempotency store.",
+                               [({}, idempotency_store.replays)]))
+
+    return PlainTextResponse("".join(parts), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,103 @@
+from fastapi import APIRouter
+
+from configs.config import settings
+from container import idempotency_store, load_shedder, redis_producer
+from db.database import get_engine, replicas, shards, statement_metrics
+from db.transaction_query_service import reference_cache
+from db.transaction_service import billing_address_cache, customer_cache, merchant_cache, payment_detail_cache
+
+router = APIRouter(
+    prefix="/stats"
+)
+
+
+@router.get("/producer")
+async def producer_stats():
+    """
+    Returns flush and latency statistics of the Redis queue producer.
+
+    Returns:
+        dict: Push/flush counters, batch sizes and flush/push latencies in milliseconds.
+    """
+    return redis_producer.stats.as_dict()
+
+
+@router.get("/backpressure")
+async def backpressure_stats():
+    """
+    Returns the state of the load shedder of /wpp/.
+
+    Returns:
+        dict: Whether submissions are shed per reason, the last measured backlog and the
+        moving average of the insert latency in milliseconds.
+    """
+    return load_shedder.stats()
+
+
+@router.get("/caches")
+async def cache_stats():
+    """
+    Returns hit ratios of the known merchant and customer id caches and of the billing
+    address and payment detail fingerprint caches, of the reference lookup response cache,
+    and the number of submissions answered from the idempotency store.
+
+    Returns:
+        dict: Size, hits, misses and hit ratio per cache, and idempotency replays.
+    """
+    return {
+        "customer": customer_cache.stats(),
+        "merchant": merchant_cache.stats(),
+        "billing_address": billing_address_cache.stats(),
+        "payment_detail": payment_detail_cache.stats(),
+        "reference_responses": reference_cache.stats(),
+        "idempotency": {"replays": idempotency_store.replays},
+    }
+
+
+@router.get("/pool")
+async def pool_stats():
+    """
+    Returns live statistics of the database connection pool.
+
+    Returns:
+        dict: Checked-out connections, overflow, current waiters and the checkout wait-time histogram.
+    """
+    return get_engine().pool.stats()
+
+
+@router.get("/statements")
+async def statement_stats():
+    """
+    Returns how executed statements were found in the compiled statement cache. After warm-up
+    only hits should grow; `recent_compilations` shows what was compiled last.
+
+    Returns:
+        dict: Lookups by result, hit ratio, compiled cache size and the latest compiled statements.
+    """
+    return statement_metrics.stats()
+
+
+@router.get("/replicas")
+async def replica_stats():
+    """
+    Returns the health, replication lag and pool statistics of the read replicas.
+
+    Returns:
+        dict: Per-replica state and the number of reads that fell back to the primary.
+    """
+    return replicas.stats()
+
+
+@router.get("/shards")
+async def shard_stats():
+    """
+    Returns the configured shards and the pool statistics of the ones this worker has used.
+
+    Returns:
+        dict: Shard addresses, virtual nodes per shard and pool statistics by shard.
+    """
+    return {
+        "shards": settings.DB_SHARDS,
+        "vnodes": settings.DB_SHARD_VNODES,
+        "pools": shards.stats(),
+    }
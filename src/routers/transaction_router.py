@@ -0,0 +1,163 @@
+from datetime import date, datetime, timedelta, timezone
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from pydantic import TypeAdapter
+
+from db.export_service import ExportFormat, TransactionExportService
+from db.rollup_service import RollupService
+from db.transaction_query_service import InvalidCursorError, TransactionQueryService, reference_cache
+from validation import MerchantRollup, RollupRecord, RollupTotal, TransactionPage, TransactionRecord
+
+router = APIRouter(
+    prefix="/transactions"
+)
+
+MAX_PAGE_SIZE = 500
+MAX_ROLLUP_DAYS = 366
+
+transaction_records = TypeAdapter(list[TransactionRecord])
+
+
+@router.get("/merchant/{merchant_id}", response_model=TransactionPage)
+async def list_merchant_transactions(merchant_id: str, limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+                                     cursor: str | None = None, created_from: datetime | None = None,
+                                     created_to: datetime | None = None):
+    """
+    Lists the transactions of a merchant, newest first.
+
+    Args:
+        merchant_id (str): The merchant whose transactions are listed.
+        limit (int): Page size.
+        cursor (str | None): `nextCursor` of the previous page.
+        created_from (datetime | None): Only lists transactions created at or after this time.
+        created_to (datetime | None): Only lists transactions created before this time.
+
+    Returns:
+        TransactionPage: The page and the cursor of the next one, null on the last page.
+    """
+    try:
+        rows, next_cursor = await TransactionQueryService.list_by_merchant(merchant_id, limit, cursor,
+                                                                           created_from, created_to)
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return TransactionPage(items=[TransactionRecord.model_validate(row) for row in rows], nextCursor=next_cursor)
+
+
+@router.get("/customer/{customer_id}", response_model=TransactionPage)
+async def list_customer_transactions(customer_id: str, limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+                                     cursor: str | None = None, created_from: datetime | None = None,
+                                     created_to: datetime | None = None):
+    """
+    Lists the transactions of a customer, newest first.
+
+    Args:
+        customer_id (str): The customer whose transactions are listed.
+        limit (int): Page size.
+        cursor (str | None): `nextCursor` of the previous page.
+        created_from (datetime | None): Only lists transactions created at or after this time.
+        created_to (datetime | None): Only lists transactions created before this time.
+
+    Returns:
+        TransactionPage: The page and the cursor of the next one, null on the last page.
+    """
+    try:
+        rows, next_cursor = await TransactionQueryService.list_by_customer(customer_id, limit, cursor,
+                                                                           created_from, created_to)
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return TransactionPage(items=[TransactionRecord.model_validate(row) for row in rows], nextCursor=next_cursor)
+
+
+@router.get("/reference/{txn_reference}", response_model=list[TransactionRecord])
+async def get_transactions_by_reference(txn_reference: str, merchant_id: str | None = None):
+    """
+    Looks up transactions by txnReference. With `merchant_id` at most one transaction matches.
+    Responses are served from the reference cache, which the writes of a reference invalidate,
+    and concurrent lookups of the same reference share one query.
+
+    Args:
+        txn_reference (str): The merchant's transaction reference.
+        merchant_id (str | None): Restricts the lookup to one merchant.
+
+    Returns:
+        list[TransactionRecord]: The matching transactions.
+
+    Raises:
+        HTTPException: 404 if no transaction matches.
+    """
+    async def load():
+        rows = await TransactionQueryService.get_by_reference(txn_reference, merchant_id)
+        return transaction_records.dump_json(transaction_records.validate_python(rows)) if rows else b""
+
+    content = await reference_cache.get_or_load(TransactionQueryService.reference_key(txn_reference, merchant_id),
+                                                load)
+    if not content:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    return Response(content=content, media_type="application/json")
+
+
+@router.get("/merchant/{merchant_id}/export")
+async def export_merchant_transactions(merchant_id: str, format: ExportFormat = "ndjson",
+                                      created_from: datetime | None = None, created_to: datetime | None = None):
+    """
+    Streams all transactions of a merchant, joined to their payment details and billing
+    addresses, as NDJSON or CSV. Rows are read through a server-side cursor and written
+    in chunks, so memory stays constant for any export size.
+
+    Args:
+        merchant_id (str): The merchant whose transactions are exported.
+        format (ExportFormat): "ndjson" or "csv".
+        created_from (datetime | None): Only exports transactions created at or after this time.
+        created_to (datetime | None): Only exports transactions created before this time.
+
+    Returns:
+        StreamingResponse: The chunked export.
+    """
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"transactions-{merchant_id}.{format}"
+    return StreamingResponse(
+        TransactionExportService.stream_export(merchant_id, format, created_from=created_from,
+                                               created_to=created_to),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/merchant/{merchant_id}/rollup", response_model=MerchantRollup)
+async def get_merchant_rollup(merchant_id: str, date_from: date | None = None, date_to: date | None = None):
+    """
+    Returns the transaction count and amount of a merchant per UTC day and currency, and their
+    totals per currency, from the incrementally maintained rollups. The cost grows with the
+    number of days, not with the number of transactions.
+
+    Args:
+        merchant_id (str): The merchant.
+        date_from (date | None): The first day, 30 days before `date_to` by default.
+        date_to (date | None): The day after the last one, tomorrow (so today is included) by default.
+
+    Returns:
+        MerchantRollup: The daily rollups and the totals of the range.
+
+    Raises:
+        HTTPException: 400 if the range is empty or longer than MAX_ROLLUP_DAYS.
+    """
+    date_to = date_to or datetime.now(timezone.utc).date() + timedelta(days=1)
+    date_from = date_from or date_to - timedelta(days=30)
+    if not 0 < (date_to - date_from).days <= MAX_ROLLUP_DAYS:
+        raise HTTPException(status_code=400, detail=f"The range must cover 1 to {MAX_ROLLUP_DAYS} days")
+
+    rows = await RollupService.daily(merchant_id, date_from, date_to)
+    # Summed as Decimal, the amounts are only converted for the response.
+    totals = {}
+    for row in rows:
+        count, amount = totals.get(row.currency_code, (0, 0))
+        totals[row.currency_code] = (count + row.txn_count, amount + row.txn_amount)
+    return MerchantRollup(
+        merchantID=merchant_id,
+        dateFrom=date_from,
+        dateTo=date_to,
+        days=[RollupRecord.model_validate(row) for row in rows],
+        totals=[RollupTotal(currencyCode=currency_code, txnCount=count, txnAmount=amount)
+                for currency_code, (count, amount) in totals.items()],
+    )
@@ -1,8 +1,21 @@
 import logging
-from fastapi import APIRouter, HTTPException
+import time
+from contextlib import suppress
+from typing import AsyncIterator
 
-from configs.config import logger
-from container import transaction_service, redis_client
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse
+from pydantic import ValidationError
+
+from configs.config import logger, request_logger, settings
+from configs.log_config import sample_request
+from container import idempotency_store, load_shedder, transaction_service, redis_producer
+from db.transaction_service import DuplicateTransactionError
+from idempotency import PENDING
+from metrics import stage_seconds, wpp_admitted, wpp_request_errors, wpp_request_seconds, wpp_requests, wpp_shed
+from responses import DuplexStreamingResponse
 from validation import RequestModel
 
 router = APIRouter(
@@ -10,19 +23,49 @@ router = APIRouter(
 )
 
 
-@router.post("/")
-async def process_transaction(request: RequestModel):
+# The body is validated by the handler (see `handle_transaction`), so its schema is documented here.
+REQUEST_BODY_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": RequestModel.model_json_schema()}},
+    }
+}
+
+
+async def get_raw_body(request: Request):
+    """
+    Returns the raw request body.
+    """
+    return await request.body()
+
+
+@router.post("/", openapi_extra=REQUEST_BODY_OPENAPI)
+async def process_transaction(raw_body: bytes = Depends(get_raw_body)):
     """
     Processes a transaction by adding it to a Redis queue and storing it in the database.
+    The body is validated straight from the JSON bytes, which are queued as received.
+    With `INGEST_MODE=write_behind` the transaction is only enqueued, answered with 202
+    and persisted later by the background worker.
+
+    Submissions are idempotent on (merchantID, txnReference): a repeated submission gets the
+    response of the first one without touching the queue or the database, and a repeat that
+    arrives while the first one is still being processed gets 409.
+
+    Under overload (see `backpressure.LoadShedder`) the submission is rejected with 429 and a
+    Retry-After header before any work is done.
+
+    The handler time, the time of every stage and the response status are recorded in `metrics`.
 
     Args:
-        request (RequestModel): The transaction request data containing transaction, merchant, and customer details.
+        raw_body (bytes): The request body, a `RequestModel` JSON object.
 
     Returns:
-        dict: A response dictionary containing the status and transaction reference.
+        ORJSONResponse: A response containing the status and transaction reference.
 
     Raises:
-        HTTPException: If there is an error during processing, a 500 status code is returned with details.
+        RequestValidationError: If the body is not a valid `RequestModel`, answered with 422.
+        HTTPException: If there is an error during processing, a 500 status code is returned with details,
+            429 if the submission is shed.
 
     Example:
         Request:
@@ -74,35 +117,267 @@ async def process_transaction(request: RequestModel):
             "statusCode": 200,
             "txnReference": "txn123"
         }
+
+        Response (write_behind mode):
+        {
+            "description": "Transaction has been accepted for processing",
+            "statusCode": 202,
+            "txnReference": "txn123"
+        }
     """
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handle_transaction(raw_body)
+        status = response.status_code
+        return response
+    except (HTTPException, RequestValidationError) as ex:
+        status = getattr(ex, "status_code", 422)
+        raise
+    finally:
+        wpp_request_seconds.observe(time.perf_counter() - started)
+        wpp_requests.inc(str(status))
 
-    logger.info('Transaction came on the endpoint.')
+
+async def handle_transaction(raw_body: bytes):
+    """
+    Validates, enqueues and persists a transaction, see `process_transaction`.
+
+    Args:
+        raw_body (bytes): The request body.
+
+    Returns:
+        ORJSONResponse: The response of the submission.
+    """
+    await shed_load()
+    with stage_seconds.time("validate"):
+        try:
+            request = RequestModel.model_validate_json(raw_body)
+        except ValidationError as ex:
+            raise RequestValidationError(
+                [{**error, "loc": ("body", *error["loc"])} for error in ex.errors(include_url=False)]
+            )
+
+    sample_request(settings.LOG_SAMPLE_RATE)
+    request_logger.info('Transaction came on the endpoint.')
+    merchant_id = request.merchant.merchantID
+    txn_reference = request.transaction.txnReference
     try:
+        # Idempotency: retries of a known (merchantID, txnReference) get the original response
+        with stage_seconds.time("idempotency_claim"):
+            claimed = await idempotency_store.claim(merchant_id, txn_reference)
+        if not claimed:
+            previous = await idempotency_store.get(merchant_id, txn_reference)
+            if previous is None or previous == PENDING:
+                raise HTTPException(status_code=409, detail={
+                    "status": "error",
+                    "post_id": None,
+                    "details": "Transaction is already being processed"
+                })
+            request_logger.info('Replaying the stored response of a repeated transaction.')
+            return ORJSONResponse(previous, status_code=previous["statusCode"])
+
         # Caching
-        request_json = request.model_dump_json()
-        logger.debug('Dumped request to json.')
+        with stage_seconds.time("redis_push"):
+            await redis_producer.push(settings.REQUESTS_QUEUE, raw_body)
+        request_logger.debug('Pushed request to redis queue.')
 
-        redis_client.rpush('REQUESTS', request_json)
-        logger.debug('Pushed request to redis queue.')
+        if settings.INGEST_MODE == "write_behind":
+            request_logger.info('Transaction was accepted for write-behind persistence.')
+            response_data = {
+                "description": "Transaction has been accepted for processing",
+                "statusCode": 202,
+                "txnReference": txn_reference
+            }
+            with stage_seconds.time("idempotency_save"):
+                await idempotency_store.save(merchant_id, txn_reference, response_data)
+            return ORJSONResponse(response_data, status_code=202)
 
         # Storing in DB
-        logger.debug('Starting working with database.')
-        await transaction_service.insert_transaction(request)
-        logger.debug('Finished working with database.')
+        request_logger.debug('Starting working with database.')
+        try:
+            with stage_seconds.time("insert") as insert_timer:
+                await transaction_service.insert_transaction(request)
+        except DuplicateTransactionError:
+            request_logger.info('Transaction was already stored by an earlier submission.')
+        finally:
+            load_shedder.observe_latency(insert_timer.elapsed)
+        request_logger.debug('Finished working with database.')
 
         response_data = {
             "description": "Transaction has been processed successfully",
             "statusCode": 200,
-            "txnReference": request.transaction.txnReference
+            "txnReference": txn_reference
         }
+        with stage_seconds.time("idempotency_save"):
+            await idempotency_store.save(merchant_id, txn_reference, response_data)
+
+        request_logger.info('Transaction processing is successful. Returning response...')
+        return ORJSONResponse(response_data)
 
-        logger.info('Transaction processing is successful. Returning response...')
-        return response_data
+    except HTTPException:
+        raise
 
     except Exception as ex:
         logging.error(ex)
+        wpp_request_errors.inc()
+        with suppress(Exception):
+            await idempotency_store.release(merchant_id, txn_reference)
         raise HTTPException(status_code=500, detail={
             "status": "error",
             "post_id": None,
             "details": "Server Error"
         })
+
+
+async def shed_load():
+    """
+    Rejects the request with 429 while the load shedder is shedding.
+
+    Raises:
+        HTTPException: 429 with a Retry-After header.
+    """
+    reason = await load_shedder.admit()
+    if reason is None:
+        wpp_admitted.inc()
+        return
+    wpp_shed.inc(reason)
+    raise HTTPException(status_code=429, headers={"Retry-After": str(load_shedder.retry_after)}, detail={
+        "status": "error",
+        "post_id": None,
+        "details": "Server is overloaded, retry later"
+    })
+
+
+@router.post("/batch")
+async def process_batch(request: Request):
+    """
+    Ingests a stream of transactions sent as NDJSON, one `RequestModel` JSON object per line.
+
+    The body is consumed incrementally: each line is validated as it arrives, valid records are
+    persisted in chunks of `BATCH_CHUNK_SIZE` with `TransactionService.insert_many`, and one
+    result line per record is streamed back while the upload is still in progress, so memory
+    stays bounded by the chunk size regardless of the upload size.
+
+    Records of a chunk that could not be persisted are pushed to the Redis queue for replay.
+    Under overload the whole upload is rejected with 429, see `shed_load`.
+
+    Args:
+        request (Request): The raw request whose body is the NDJSON stream.
+
+    Returns:
+        DuplexStreamingResponse: An NDJSON stream of per-record results.
+
+    Example:
+        Response lines:
+        {"line": 1, "txnReference": "txn123", "status": "ok"}
+        {"line": 2, "txnReference": "txn123", "status": "duplicate"}
+        {"line": 3, "txnReference": null, "status": "invalid", "details": [...]}
+    """
+    await shed_load()
+    logger.info('NDJSON batch came on the endpoint.')
+    return DuplexStreamingResponse(ingest_ndjson(request.stream()), media_type="application/x-ndjson")
+
+
+async def ingest_ndjson(chunks: AsyncIterator[bytes]):
+    """
+    Validates and persists NDJSON records, yielding one result line per record.
+
+    Args:
+        chunks (AsyncIterator[bytes]): The request body stream.
+
+    Yields:
+        bytes: NDJSON result lines.
+    """
+    pending = []
+    async for line_number, line in read_lines(chunks, settings.BATCH_MAX_LINE_BYTES):
+        if line is None:
+            yield batch_result(line_number, None, "invalid", "Line exceeds BATCH_MAX_LINE_BYTES")
+            continue
+        try:
+            record = RequestModel.model_validate_json(line)
+        except ValidationError as ex:
+            details = ex.errors(include_url=False, include_context=False, include_input=False)
+            yield batch_result(line_number, None, "invalid", details)
+            continue
+
+        pending.append((line_number, line, record))
+        if len(pending) >= settings.BATCH_CHUNK_SIZE:
+            async for result in persist_chunk(pending):
+                yield result
+            pending = []
+
+    if pending:
+        async for result in persist_chunk(pending):
+            yield result
+    logger.info('NDJSON batch was processed.')
+
+
+async def persist_chunk(chunk: list):
+    """
+    Persists a chunk of validated records and yields their results.
+
+    Args:
+        chunk (list): (line number, raw line, RequestModel) tuples.
+
+    Yields:
+        bytes: NDJSON result lines.
+    """
+    try:
+        result = await transaction_service.insert_many([record for _, _, record in chunk])
+    except Exception as ex:
+        logging.error(ex)
+        for _, line, _ in chunk:
+            await redis_producer.push(settings.REQUESTS_QUEUE, line)
+        for line_number, _, record in chunk:
+            yield batch_result(line_number, record, "error", "Stored for replay")
+        return
+
+    skipped = set(result.skipped)
+    for index, (line_number, _, record) in enumerate(chunk):
+        yield batch_result(line_number, record, "duplicate" if index in skipped else "ok")
+
+
+async def read_lines(chunks: AsyncIterator[bytes], max_line_bytes: int):
+    """
+    Splits a byte stream into non-empty lines without buffering more than one line.
+
+    Args:
+        chunks (AsyncIterator[bytes]): The byte stream.
+        max_line_bytes (int): Lines longer than this are skipped and reported as None.
+
+    Yields:
+        tuple[int, bytes | None]: The 1-based line number and the line, or None if it was too long.
+    """
+    buffer = b""
+    line_number = 0
+    oversized = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            # A line is too long whether it arrived within one chunk or over several.
+            if oversized or len(line) > max_line_bytes:
+                oversized = False
+                yield line_number, None
+            elif line.strip():
+                yield line_number, line
+        if len(buffer) > max_line_bytes:
+            oversized, buffer = True, b""
+
+    if oversized:
+        yield line_number + 1, None
+    elif buffer.strip():
+        yield line_number + 1, buffer
+
+
+def batch_result(line_number: int, record: RequestModel | None, status: str, details=None):
+    result = {
+        "line": line_number,
+        "txnReference": record.transaction.txnReference if record else None,
+        "status": status,
+    }
+    if details is not None:
+        result["details"] = details
+    return orjson.dumps(result) + b"\n"
@@ -1,5 +1,6 @@
+from datetime import date, datetime
 from typing import Optional
-from pydantic import BaseModel, EmailStr, constr
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, constr
 
 
 class BillingAddress(BaseModel):
@@ -54,3 +55,49 @@ class RequestModel(BaseModel):
     merchant: Merchant
     customer: Customer
     transaction: Transaction
+
+
+class TransactionRecord(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    merchantID: str = Field(validation_alias="merchant_id")
+    customerID: str = Field(validation_alias="customer_id")
+    txnAmount: float = Field(validation_alias="txn_amount")
+    paymentType: str = Field(validation_alias="payment_type")
+    currencyCode: str = Field(validation_alias="currency_code")
+    txnReference: str = Field(validation_alias="txn_reference")
+    seriestype: Optional[str]
+    method: Optional[str]
+    successURL: str = Field(validation_alias="success_url")
+    failURL: str = Field(validation_alias="fail_url")
+    paymentDetailID: int = Field(validation_alias="payment_detail_id")
+    createdAt: datetime = Field(validation_alias="created_at")
+
+
+class TransactionPage(BaseModel):
+    items: list[TransactionRecord]
+    nextCursor: Optional[str]
+
+
+class RollupRecord(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    day: date
+    currencyCode: str = Field(validation_alias="currency_code")
+    txnCount: int = Field(validation_alias="txn_count")
+    txnAmount: float = Field(validation_alias="txn_amount")
+
+
+class RollupTotal(BaseModel):
+    currencyCode: str
+    txnCount: int
+    txnAmount: float
+
+
+class MerchantRollup(BaseModel):
+    merchantID: str
+    dateFrom: date
+    dateTo: date
+    days: list[RollupRecord]
+    totals: list[RollupTotal]
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import hashlib
+import socket
+import time
+
+from pydantic import ValidationError
+from redis import asyncio as aioredis
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+from configs.config import logger, settings
+from container import redis_producer, shutdown, startup, transaction_service
+from db.transaction_service import DuplicateTransactionError
+from validation import RequestModel
+
+
+class DatabaseUnavailableError(Exception):
+    """
+    Raised when a batch could not be stored because the database could not be reached.
+    """
+
+
+class WriteBehindWorker:
+    """
+    Consumes the requests queue in batches and persists them with group commit.
+
+    Delivery is at-least-once: every fetched payload is atomically moved to a
+    per-worker processing list and only removed from it (acked) after its database
+    transaction has been committed. On start the worker returns whatever its
+    processing list still holds to the queue, so a crash loses nothing.
+    A batch that fails is retried payload by payload. A failed payload waits in the delayed
+    set for `backoff` seconds, doubled on every attempt, before it is queued again, and is
+    moved to the dead-letter list after `max_attempts`. While the database cannot be reached
+    at all, the batch is kept and retried with the same backoff, without counting attempts.
+    """
+
+    def __init__(self, client: aioredis.Redis, name: str, queue: str = settings.REQUESTS_QUEUE,
+                 batch_size: int = settings.WORKER_BATCH_SIZE, max_attempts: int = settings.WORKER_MAX_ATTEMPTS,
+                 poll_timeout: float = settings.WORKER_POLL_TIMEOUT_S, backoff: float = settings.WORKER_RETRY_BACKOFF_S,
+                 max_backoff: float = settings.WORKER_RETRY_BACKOFF_MAX_S):
+        self.client = client
+        self.queue = queue
+        self.processing_key = f'{queue}:processing:{name}'
+        self.dead_letter_key = f'{queue}:dead'
+        self.attempts_key = f'{queue}:attempts'
+        # Payloads waiting for their next attempt, scored by its time.
+        self.delayed_key = f'{queue}:delayed'
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_timeout = poll_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    async def recover(self):
+        """
+        Moves payloads left in the processing list by a previous run back to the head of the queue.
+
+        Returns:
+            int: The number of recovered payloads.
+        """
+        recovered = 0
+        while await self.client.lmove(self.processing_key, self.queue, 'RIGHT', 'LEFT') is not None:
+            recovered += 1
+        if recovered:
+            logger.warning('Recovered %d unacknowledged payloads to %s.', recovered, self.queue)
+        return recovered
+
+    async def promote_due(self):
+        """
+        Moves the delayed payloads whose next attempt is due to the tail of the queue.
+
+        Returns:
+            int: The number of moved payloads.
+        """
+        async def move(pipe):
+            due = await pipe.zrangebyscore(self.delayed_key, '-inf', time.time(), start=0, num=self.batch_size)
+            pipe.multi()
+            if due:
+                pipe.zrem(self.delayed_key, *due)
+                pipe.rpush(self.queue, *due)
+            return len(due)
+
+        # Retried if another worker moves payloads meanwhile, so that none is queued twice.
+        return await self.client.transaction(move, self.delayed_key, value_from_callable=True)
+
+    async def fetch_batch(self):
+        """
+        Blocks until at least one payload is available and moves up to `batch_size`
+        payloads to the processing list.
+
+        Returns:
+            list[bytes]: The fetched payloads, empty if the poll timed out.
+        """
+        first = await self.client.blmove(self.queue, self.processing_key, self.poll_timeout, 'LEFT', 'RIGHT')
+        if first is None:
+            return []
+
+        async with self.client.pipeline(transaction=False) as pipe:
+            for _ in range(self.batch_size - 1):
+                pipe.lmove(self.queue, self.processing_key, 'LEFT', 'RIGHT')
+            rest = await pipe.execute()
+        return [first] + [payload for payload in rest if payload is not None]
+
+    async def process_batch(self, payloads: list[bytes]):
+        """
+        Validates and persists a batch, then acks, retries or dead-letters each payload.
+
+        Args:
+            payloads (list[bytes]): Raw payloads taken from the processing list.
+        Returns:
+            None.
+        """
+        valid = []
+        for payload in payloads:
+            try:
+                valid.append((payload, RequestModel.model_validate_json(payload)))
+            except ValidationError:
+                logger.exception('Invalid payload in %s, moving it to dead letters.', self.queue)
+                await self._dead_letter(payload)
+
+        failures = 0
+        while valid:
+            try:
+                await self._store(valid)
+            except DatabaseUnavailableError:
+                delay = self.retry_delay(failures)
+                failures += 1
+                logger.warning('Database is unavailable, retrying %d payloads in %.1fs.', len(valid), delay)
+                await asyncio.sleep(delay)
+
+    async def _store(self, valid: list[tuple[bytes, RequestModel]]):
+        # Removes the payloads it is done with from `valid`, so that a retry continues with the others.
+        try:
+            await transaction_service.insert_many([request for _, request in valid])
+        except Exception as ex:
+            if self.is_unavailable(ex):
+                raise DatabaseUnavailableError() from ex
+            logger.warning('Group commit of %d payloads failed, retrying one by one.', len(valid))
+        else:
+            await self._ack([payload for payload, _ in valid])
+            valid.clear()
+            return
+
+        while valid:
+            payload, request = valid[0]
+            try:
+                await transaction_service.insert_transaction(request)
+            except DuplicateTransactionError:
+                logger.info('Payload was already stored, acknowledging it.')
+                await self._ack([payload])
+            except Exception as ex:
+                if self.is_unavailable(ex):
+                    raise DatabaseUnavailableError() from ex
+                await self._retry_or_dead_letter(payload)
+            else:
+                await self._ack([payload])
+            del valid[0]
+
+    def retry_delay(self, attempts: int):
+        return min(self.backoff * 2 ** attempts, self.max_backoff)
+
+    @staticmethod
+    def is_unavailable(error: BaseException):
+        """
+        Tells whether an insert failed because the database could not be reached, rather than
+        because of its payloads. The services wrap the driver errors, so the chain is searched.
+        """
+        while error is not None:
+            if isinstance(error, (OSError, asyncio.TimeoutError, PoolTimeoutError, InterfaceError, OperationalError)):
+                return True
+            if isinstance(error, DBAPIError) and error.connection_invalidated:
+                return True
+            error = error.__cause__ or error.__context__
+        return False
+
+    async def run(self):
+        """
+        Recovers unacknowledged payloads and processes the queue until cancelled.
+        """
+        await self.recover()
+        logger.info('Write-behind worker is consuming %s.', self.queue)
+        while True:
+            await self.promote_due()
+            payloads = await self.fetch_batch()
+            if payloads:
+                await self.process_batch(payloads)
+
+    async def _ack(self, payloads: list[bytes]):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for payload in payloads:
+                pipe.lrem(self.processing_key, 1, payload)
+                pipe.hdel(self.attempts_key, self._payload_key(payload))
+            await pipe.execute()
+
+    async def _dead_letter(self, payload: bytes):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.rpush(self.dead_letter_key, payload)
+            pipe.lrem(self.processing_key, 1, payload)
+            pipe.hdel(self.attempts_key, self._payload_key(payload))
+            await pipe.execute()
+
+    async def _retry_or_dead_letter(self, payload: bytes):
+        attempts = await self.client.hincrby(self.attempts_key, self._payload_key(payload), 1)
+        if attempts >= self.max_attempts:
+            logger.error('Payload failed %d times, moving it to dead letters.', attempts)
+            await self._dead_letter(payload)
+            return
+
+        delay = self.retry_delay(attempts - 1)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.delayed_key, {payload: time.time() + delay})
+            pipe.lrem(self.processing_key, 1, payload)
+            await pipe.execute()
+
+    @staticmethod
+    def _payload_key(payload: bytes):
+        return hashlib.sha1(payload).hexdigest()
+
+
+async def main(name: str):
+    if settings.INGEST_MODE != "write_behind":
+        raise SystemExit('The worker only runs with INGEST_MODE=write_behind, '
+                         'in sync mode requests are already persisted by the API.')
+
+    # The clients of the API: the writes share its id and fingerprint caches and invalidate
+    # the cached reference lookups.
+    await startup()
+    try:
+        await WriteBehindWorker(redis_producer.client, name).run()
+    finally:
+        await shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persists queued transactions in batches.")
+    parser.add_argument("--name", default=socket.gethostname(),
+                        help="Unique worker name, used for its processing list.")
+    args = parser.parse_args()
+    logger.info('Starting write-behind worker %s...', args.name)
+    asyncio.run(main(args.name))
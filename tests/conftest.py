@@ -0,0 +1,10 @@
+import os
+import sys
+
+# src/ is the import root of the application, as for the scripts run from it.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+# The settings require a database, which these tests never connect to.
+for name, value in (("DB_HOST", "localhost"), ("DB_PORT", "5432"), ("DB_USER", "postgres"), ("DB_PASS", ""),
+                    ("DB_NAME", "postgres")):
+    os.environ.setdefault(name, value)
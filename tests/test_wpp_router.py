@@ -0,0 +1,35 @@
+import asyncio
+
+from routers.wpp_router import read_lines
+
+
+def collect(chunks: list[bytes], max_line_bytes: int):
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def run():
+        return [item async for item in read_lines(stream(), max_line_bytes)]
+
+    return asyncio.run(run())
+
+
+def test_read_lines_splits_across_chunks():
+    assert collect([b'{"a"', b': 1}\n\n{"b": 2}\n', b'{"c": 3}'], 20) == [
+        (1, b'{"a": 1}'), (3, b'{"b": 2}'), (4, b'{"c": 3}'),
+    ]
+
+
+def test_read_lines_rejects_oversized_line_within_one_chunk():
+    line = b'{"txnReference": "' + b"x" * 30 + b'"}'
+    assert collect([b'{"a": 1}\n' + line + b'\n{"b": 2}\n'], 20) == [
+        (1, b'{"a": 1}'), (2, None), (3, b'{"b": 2}'),
+    ]
+
+
+def test_read_lines_rejects_oversized_line_over_several_chunks():
+    assert collect([b"x" * 15, b"x" * 15, b"\n", b'{"b": 2}'], 20) == [(1, None), (2, b'{"b": 2}')]
+
+
+def test_read_lines_rejects_oversized_last_line():
+    assert collect([b'{"a": 1}\n' + b"x" * 50], 20) == [(1, b'{"a": 1}'), (2, None)]